@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Compare two benchmark result files: `python benchmarks/compare.py before.json after.json`.
+Prints every numeric metric present in both with its relative change.
+"""
+from typing import Any, Dict, Iterator, Tuple
+import argparse
+import json
+
+
+def _key(row: Dict[str, Any]) -> str:
+    parts = [f"{k}={row[k]}" for k in ("size", "backend", "workers", "top_k", "mode") if k in row]
+    return ",".join(parts)
+
+
+def flatten(node: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k in ("meta", "args"):
+                continue
+            yield from flatten(v, f"{prefix}.{k}" if prefix else k)
+    elif isinstance(node, list):
+        for i, row in enumerate(node):
+            label = _key(row) if isinstance(row, dict) else ""
+            yield from flatten(row, f"{prefix}[{label or i}]")
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, float(node)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff two benchmark JSON files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    with open(args.before, encoding="utf-8") as f:
+        before = dict(flatten(json.load(f)))
+    with open(args.after, encoding="utf-8") as f:
+        after = dict(flatten(json.load(f)))
+    width = max((len(k) for k in before if k in after), default=10)
+    for key, old in before.items():
+        if key not in after:
+            continue
+        new = after[key]
+        delta = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{key:<{width}}  {old:>12.3f}  {new:>12.3f}  {delta:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from typing import Dict, Iterator, List
+import hashlib
+import random
+
+import numpy as np
+
+_SPECIALTY_TERMS = {
+    "cardiology": ["myocardial infarction", "atrial fibrillation", "coronary angiography", "troponin", "ejection fraction"],
+    "neurology": ["seizure", "cerebral infarct", "encephalopathy", "lumbar puncture", "hemiparesis"],
+    "oncology": ["carcinoma", "metastatic lesion", "lymphoma", "chemotherapy", "tumor markers"],
+    "infectious_disease": ["sepsis", "blood cultures", "tuberculosis", "fungal infection", "empirical antibiotics"],
+    "gastroenterology": ["hepatitis", "pancreatitis", "biliary obstruction", "colonoscopy", "gastric ulcer"],
+    "pulmonology": ["pneumonia", "pleural effusion", "pulmonary embolism", "bronchoscopy", "hypoxemia"],
+}
+_FILLER = [
+    "The patient was admitted for further evaluation.",
+    "Physical examination was otherwise unremarkable.",
+    "Laboratory investigations revealed mild leukocytosis.",
+    "Vital signs were stable on arrival.",
+    "The symptoms had progressively worsened over two weeks.",
+    "There was no relevant family history.",
+    "Imaging studies were obtained the same day.",
+    "The patient denied fever, weight loss or night sweats.",
+    "Treatment was started and the patient improved gradually.",
+    "Follow-up at three months showed no recurrence.",
+]
+_QUESTIONS = [
+    "What brings you in today?",
+    "When did the symptoms start?",
+    "Do you have any allergies?",
+    "Are you taking any medications?",
+    "Has anyone in your family had similar problems?",
+    "Can you describe the pain?",
+    "Have you had a fever?",
+    "Any recent travel?",
+]
+
+
+def synthetic_cases(n: int, seed: int = 0, min_chars: int = 1500, max_chars: int = 6000) -> Iterator[Dict[str, str]]:
+    """
+    Deterministic case-report-like rows in the shape load_pmc_dataset yields.
+    Lengths vary so chunk counts per case vary as in the real dataset.
+    """
+    rng = random.Random(seed)
+    specialties = list(_SPECIALTY_TERMS)
+    for i in range(n):
+        specialty = specialties[i % len(specialties)]
+        target = rng.randint(min_chars, max_chars)
+        age = rng.randint(18, 90)
+        sex = rng.choice(["man", "woman"])
+        parts = [f"A {age}-year-old {sex} presented with {rng.choice(_SPECIALTY_TERMS[specialty])}."]
+        size = len(parts[0])
+        while size < target:
+            sentence = rng.choice(_FILLER) if rng.random() < 0.7 else (
+                f"Findings were consistent with {rng.choice(_SPECIALTY_TERMS[specialty])}."
+            )
+            parts.append(sentence)
+            size += len(sentence) + 1
+        yield {"pmc_id": f"SYN{i:07d}", "context": " ".join(parts)}
+
+
+def synthetic_questions(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [rng.choice(_QUESTIONS) for _ in range(n)]
+
+
+class HashingEmbedder:
+    """
+    Offline stand-in for SentenceTransformer: hashed bag-of-words vectors, normalized.
+    Measures storage/retrieval cost without downloading or running a model.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts, convert_to_numpy: bool = True, normalize_embeddings: bool = True, **kwargs):
+        out = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                bucket = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little")
+                out[row, bucket % self.dimension] += 1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.maximum(norms, 1e-12)
+        return out
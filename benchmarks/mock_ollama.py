@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Minimal local stand-in for Ollama's HTTP API so benchmarks run offline.
+
+Serves /api/generate and /api/chat (streaming NDJSON or a single JSON body) and
+/api/tags; a `format` JSON schema is answered with a matching object. Latency is synthetic: `prompt_delay` seconds per 1000 prompt characters
+not shared with a recent prompt (a crude model of Ollama's KV-cache prefix reuse),
+then `token_delay` seconds per generated token.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import threading
+import time
+
+# Recent prompts kept for prefix matching (Ollama keeps one KV cache per parallel slot).
+_PREFIX_SLOTS = 8
+
+_EVALUATION = {
+    "scores": {
+        "relevance": 4,
+        "diagnostic_utility": 4,
+        "clarity_specificity": 3,
+        "empathy_professionalism": 4,
+        "hipaa_ethics": 5,
+    },
+    "reasoning": {
+        "relevance": "Relevant.",
+        "diagnostic_utility": "Useful.",
+        "clarity_specificity": "Clear.",
+        "empathy_professionalism": "Polite.",
+        "hipaa_ethics": "Appropriate.",
+    },
+    "phase_guess": "hpi",
+    "risk_flags": [],
+}
+
+
+def _from_schema(schema):
+    """
+    A value matching a `format` JSON schema (the subset the evaluator uses).
+    """
+    kind = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if kind == "object":
+        return {k: _from_schema(v) for k, v in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_from_schema(schema["items"]) for _ in range(schema.get("minItems", 0))]
+    if kind == "integer":
+        return min(schema.get("maximum", 4), 4)
+    if kind == "string":
+        return "Focused, open question."
+    return None
+
+
+def _reply_tokens(prompt: str, n_tokens: int, schema=None):
+    if isinstance(schema, dict) or "JSON" in prompt:
+        text = json.dumps(_from_schema(schema) if isinstance(schema, dict) else _EVALUATION)
+        step = max(1, len(text) // max(n_tokens, 1))
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    return [f"word{i} " for i in range(n_tokens)]
+
+
+def _flatten(payload) -> str:
+    if "messages" in payload:
+        return "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in payload["messages"])
+    return payload.get("prompt", "")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._json({"models": [{"name": "mock"}]})
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        chat = self.path.startswith("/api/chat")
+        if not (chat or self.path.startswith("/api/generate")):
+            self._json({"error": "not found"}, status=404)
+            return
+        server = self.server
+        prompt = _flatten(payload)
+        tokens = _reply_tokens(prompt, server.n_tokens, payload.get("format"))
+        new_chars = len(prompt) - server.cached_prefix(prompt)
+        prompt_tokens = max(1, new_chars // 4)
+        started = time.perf_counter()
+        time.sleep(server.prompt_delay * new_chars / 1000.0)
+        prompt_ns = int((time.perf_counter() - started) * 1e9)
+        final = {
+            "model": payload.get("model"),
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": prompt_ns,
+            "eval_count": len(tokens),
+            "eval_duration": int(server.token_delay * len(tokens) * 1e9),
+        }
+
+        # What the next request in the same conversation would start with.
+        seen = prompt + ("<assistant>" if chat else "") + "".join(tokens)
+
+        def body(text, **extra):
+            if chat:
+                return dict(extra, message={"role": "assistant", "content": text})
+            return dict(extra, response=text)
+
+        if payload.get("stream") is False:
+            time.sleep(server.token_delay * len(tokens))
+            self._json(body("".join(tokens), **final))
+            server.remember(seen)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(server.token_delay)
+                self._chunk(body(token, model=payload.get("model"), done=False))
+            self._chunk(body("", **final))
+            self.wfile.write(b"0\r\n\r\n")
+            server.remember(seen)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client cancelled
+
+    def _chunk(self, body):
+        data = (json.dumps(body) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, token_delay: float, prompt_delay: float, n_tokens: int):
+        super().__init__(address, _Handler)
+        self.token_delay = token_delay
+        self.prompt_delay = prompt_delay
+        self.n_tokens = n_tokens
+        self._recent = []
+        self._lock = threading.Lock()
+
+    def cached_prefix(self, prompt: str) -> int:
+        with self._lock:
+            return max((len(os.path.commonprefix([prompt, p])) for p in self._recent), default=0)
+
+    def remember(self, text: str):
+        with self._lock:
+            self._recent = ([text] + self._recent)[:_PREFIX_SLOTS]
+
+
+class MockOllama:
+    """
+    Run the mock server on a background thread: `with MockOllama(token_delay=0.02) as url: ...`.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        token_delay: float = 0.02,
+        prompt_delay: float = 0.0,
+        n_tokens: int = 48,
+    ):
+        self.server = _Server((host, port), token_delay, prompt_delay, n_tokens)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> str:
+        self._thread.start()
+        return self.url
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Ollama /api/generate and /api/chat for offline benchmarks")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds per generated token")
+    parser.add_argument("--prompt-delay", type=float, default=0.0, help="Seconds per 1000 prompt characters")
+    parser.add_argument("--tokens", type=int, default=48, help="Tokens per reply")
+    args = parser.parse_args()
+    mock = MockOllama(port=args.port, token_delay=args.token_delay, prompt_delay=args.prompt_delay, n_tokens=args.tokens)
+    print(f"Mock Ollama listening on {mock.url}")
+    mock.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+"""
+Offline benchmark suite: chunking, embedding throughput, indexing throughput, retrieval latency and
+end-to-end Virtual Patient turn latency against a mock Ollama server, in-process
+and through the asyncio HTTP service.
+
+    PYTHONPATH=$PWD python benchmarks/run.py all --sizes 500,2000 --out results.json
+    PYTHONPATH=$PWD python benchmarks/compare.py old.json results.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.corpus import synthetic_cases, synthetic_questions, HashingEmbedder
+from benchmarks.mock_ollama import MockOllama
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """
+    Percentiles in milliseconds for a list of durations in seconds.
+    """
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "n": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def _embedder(args):
+    if args.fake_embedder:
+        return HashingEmbedder()
+    from src.rag.embeddings import EmbeddingEngine
+    return EmbeddingEngine(workers=args.embed_workers)
+
+
+def _encoder(args, embedder):
+    from src.config import EMBEDDING_MODEL_NAME
+    from src.rag.embeddings import QueryEncoder
+    return QueryEncoder(EMBEDDING_MODEL_NAME, model=embedder)
+
+
+def bench_chunking(args) -> Dict[str, Any]:
+    from src.config import CHUNK_SIZE, CHUNK_OVERLAP
+    from src.rag.chunker import split_text
+
+    rows = list(synthetic_cases(args.chunk_rows, seed=args.seed))
+    chars = sum(len(r["context"]) for r in rows)
+    started = time.perf_counter()
+    chunks = sum(len(split_text(r["context"], CHUNK_SIZE, CHUNK_OVERLAP)) for r in rows)
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": len(rows),
+        "chunks": chunks,
+        "seconds": elapsed,
+        "mchars_per_s": chars / elapsed / 1e6 if elapsed else 0.0,
+    }
+
+
+def bench_embedding(args) -> List[Dict[str, Any]]:
+    """
+    Encoding throughput of the embedding engine per backend and process count, with
+    each approximate backend's cosine agreement with the fp32 model.
+    """
+    from src.config import CHUNK_SIZE, CHUNK_OVERLAP
+    from src.rag.chunker import split_text
+    from src.rag.embeddings import EmbeddingEngine
+
+    texts = [c for r in synthetic_cases(args.chunk_rows, seed=args.seed) for c in split_text(r["context"], CHUNK_SIZE, CHUNK_OVERLAP)]
+    texts = texts[: args.embed_texts]
+    configs = [("torch", 0), ("int8", 0), ("onnx", 0)]
+    if args.embed_workers:
+        configs += [("torch", args.embed_workers), ("int8", args.embed_workers)]
+    out = []
+    for backend, workers in configs:
+        try:
+            engine = EmbeddingEngine(backend=backend, workers=workers, min_cosine=0.0)
+            fidelity = engine.verify(0.0) if backend != "torch" else None
+        except Exception as exc:  # e.g. no ONNX runtime installed
+            out.append({"backend": backend, "workers": workers, "error": str(exc)})
+            continue
+        try:
+            engine.encode(texts[: engine.batch_size])  # start the workers, load the weights
+            started = time.perf_counter()
+            engine.encode(texts, batch_size=args.batch_size)
+            elapsed = time.perf_counter() - started
+        finally:
+            engine.close()
+        out.append({
+            "backend": backend,
+            "workers": workers,
+            "texts": len(texts),
+            "seconds": elapsed,
+            "texts_per_s": len(texts) / elapsed if elapsed else 0.0,
+            "min_cosine": fidelity["min_cosine"] if fidelity else 1.0,
+        })
+    return out
+
+
+def build_index(args, size: int, root: str, embedder) -> Dict[str, Any]:
+    from src.rag.indexer import ChromaIndexer
+    from src.rag.pipeline import IngestionPipeline
+
+    persist_dir = os.path.join(root, f"chroma_{size}")
+    indexer = ChromaIndexer(persist_dir=persist_dir, collection_name=f"bench_{size}", embedder=embedder)
+    pipeline = IngestionPipeline(indexer, workers=args.workers, batch_size=args.batch_size)
+    stats = pipeline.run(synthetic_cases(size, seed=args.seed))
+    return {
+        "size": size,
+        "persist_dir": persist_dir,
+        "collection": f"bench_{size}",
+        "rows": stats["rows"],
+        "chunks": stats["chunks"],
+        "seconds": stats["seconds"],
+        "rows_per_s": stats["rows_per_s"],
+        "chunks_per_s": stats["chunks_per_s"],
+    }
+
+
+def _retriever(args, built: Dict[str, Any], embedder, backend: str = "chroma"):
+    from src.rag.retriever import ChromaRetriever
+    from src.rag.vector_store import ChromaStore, NumpyStore
+
+    if backend == "chroma":
+        return ChromaRetriever(built["persist_dir"], built["collection"], encoder=_encoder(args, embedder), backend="chroma")
+    path = f"{built['persist_dir']}_{backend}"
+    if not os.path.exists(path):
+        NumpyStore.export(ChromaStore(built["persist_dir"], built["collection"]), path, dtype=backend.split("-")[1])
+    return ChromaRetriever(store=NumpyStore(path), encoder=_encoder(args, embedder))
+
+
+def bench_retrieval(args, built: Dict[str, Any], embedder, backend: str = "chroma") -> List[Dict[str, Any]]:
+    retriever = _retriever(args, built, embedder, backend)
+    rng = random.Random(args.seed)
+    questions = synthetic_questions(args.queries, seed=args.seed)
+    case_ids = [f"SYN{rng.randrange(built['size']):07d}" for _ in questions]
+    retriever.encoder.encode_many(questions)  # measure search cost, not first-time encoding
+    results = []
+    for top_k in args.top_k:
+        timings = {"global": [], "case_filter": [], "case_preloaded": []}
+        for q, pmc in zip(questions, case_ids):
+            t0 = time.perf_counter()
+            retriever.retrieve(q, top_k=top_k)
+            t1 = time.perf_counter()
+            retriever.retrieve(q, top_k=top_k, pmc_id=pmc)
+            t2 = time.perf_counter()
+            timings["global"].append(t1 - t0)
+            timings["case_filter"].append(t2 - t1)
+        for pmc in set(case_ids[: args.preload_cases]):
+            case = retriever.load_case(pmc)
+            for q in questions[:20]:
+                t0 = time.perf_counter()
+                case.retrieve(q, top_k=top_k)
+                timings["case_preloaded"].append(time.perf_counter() - t0)
+        for mode, samples in timings.items():
+            results.append({
+                "size": built["size"], "backend": backend, "top_k": top_k, "mode": mode, **latency_summary(samples)
+            })
+    return results
+
+
+def bench_turn(args, built: Dict[str, Any], embedder) -> Dict[str, Any]:
+    from src.rag.llm import OllamaLLM
+    from src.rag.evaluator import evaluate_question
+    from src.rag.response_cache import ResponseCache
+    from src.rag.scheduler import get_scheduler
+
+    retriever = _retriever(args, built, embedder)
+    # Replies and evaluations share the process scheduler, as in the app.
+    llm = OllamaLLM(cache=ResponseCache(enabled=False), scheduler=get_scheduler())
+    eval_pool = ThreadPoolExecutor(max_workers=max(1, args.sessions))
+    persona = {"name": "Alex", "age": 47, "sex": "female", "notes": "Cooperative."}
+
+    def session(seed: int) -> List[Dict[str, float]]:
+        rng = random.Random(seed)
+        case = retriever.load_case(f"SYN{rng.randrange(built['size']):07d}")
+        conversation = llm.start_patient_session(persona, case) if args.session else None
+        turns = []
+        for question in synthetic_questions(args.turns, seed=seed):
+            t0 = time.perf_counter()
+            contexts = case.retrieve(question, top_k=args.turn_top_k)
+            t_retrieved = time.perf_counter()
+            evaluation = eval_pool.submit(evaluate_question, question, contexts, False)
+            if conversation is not None:
+                stream = conversation.stream_reply(question, contexts, use_cache=False)
+            else:
+                stream = llm.stream_patient_reply(question, contexts, persona, use_cache=False)
+            for _ in stream:
+                pass
+            t_reply = time.perf_counter()
+            evaluation.result()
+            t_done = time.perf_counter()
+            turns.append({
+                "retrieval": t_retrieved - t0,
+                "ttft": stream.stats.get("ttft_s") or 0.0,
+                "prompt_tokens": stream.stats.get("prompt_eval_count") or 0,
+                "reply": t_reply - t_retrieved,
+                "turn": t_done - t0,
+            })
+        return turns
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        all_turns = [t for turns in pool.map(session, range(args.sessions)) for t in turns]
+    elapsed = time.perf_counter() - started
+    eval_pool.shutdown()
+    return {
+        "sessions": args.sessions,
+        "turns": len(all_turns),
+        "token_delay": args.token_delay,
+        "tokens": args.tokens,
+        "session": args.session,
+        "prompt_tokens_mean": float(np.mean([t["prompt_tokens"] for t in all_turns])) if all_turns else 0.0,
+        "turns_per_s": len(all_turns) / elapsed if elapsed else 0.0,
+        **{stage: latency_summary([t[stage] for t in all_turns]) for stage in ("retrieval", "ttft", "reply", "turn")},
+        "scheduler": {k: v for k, v in get_scheduler().metrics().items() if k not in ("endpoints", "queued")},
+    }
+
+
+def bench_service(args, built: Dict[str, Any], embedder) -> Dict[str, Any]:
+    """
+    Many concurrent encounters driven over HTTP against the asyncio service, all in
+    one process (client and server share the event loop).
+    """
+    import asyncio
+    import aiohttp
+    from aiohttp import web
+    from src.app.service import SCHEDULER, create_app
+    from src.rag import runtime
+
+    retriever = _retriever(args, built, embedder)
+    runtime.registry.register("retriever", lambda: retriever)
+    errors: List[str] = []
+
+    async def encounter(client: aiohttp.ClientSession, base: str, seed: int) -> List[Dict[str, float]]:
+        rng = random.Random(seed)
+        async with client.post(f"{base}/encounters", json={"pmc_id": f"SYN{rng.randrange(built['size']):07d}"}) as resp:
+            encounter_id = (await resp.json())["id"]
+        turns = []
+        for question in synthetic_questions(args.turns, seed=seed):
+            t0 = time.perf_counter()
+            first = t_reply = None
+            body = {"utterance": question, "top_k": args.turn_top_k, "evaluate": True, "bypass_cache": True}
+            async with client.post(f"{base}/encounters/{encounter_id}/reply", json=body) as resp:
+                async for line in resp.content:
+                    event = json.loads(line)
+                    if event["type"] == "token" and first is None:
+                        first = time.perf_counter()
+                    elif event["type"] == "done":
+                        t_reply = time.perf_counter()
+                    elif event["type"] == "error":
+                        errors.append(event["error"])
+            t_done = time.perf_counter()
+            if t_reply is not None:
+                turns.append({"ttft": (first or t_reply) - t0, "reply": t_reply - t0, "turn": t_done - t0})
+        return turns
+
+    async def drive() -> Dict[str, Any]:
+        app = create_app()
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        try:
+            connector = aiohttp.TCPConnector(limit=args.encounters)
+            async with aiohttp.ClientSession(connector=connector) as client:
+                started = time.perf_counter()
+                per = await asyncio.gather(*(encounter(client, base, seed) for seed in range(args.encounters)))
+                elapsed = time.perf_counter() - started
+            return {"turns": [t for turns in per for t in turns], "elapsed": elapsed, "scheduler": app[SCHEDULER].metrics()}
+        finally:
+            await runner.cleanup()
+
+    run = asyncio.run(drive())
+    all_turns = run["turns"]
+    return {
+        "encounters": args.encounters,
+        "turns": len(all_turns),
+        "errors": len(errors),
+        "token_delay": args.token_delay,
+        "tokens": args.tokens,
+        "turns_per_s": len(all_turns) / run["elapsed"] if run["elapsed"] else 0.0,
+        **{stage: latency_summary([t[stage] for t in all_turns]) for stage in ("ttft", "reply", "turn")},
+        "scheduler": {k: v for k, v in run["scheduler"].items() if k not in ("endpoints", "queued")},
+    }
+
+
+def _meta(args) -> Dict[str, Any]:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=False).stdout.strip()
+    except OSError:
+        rev = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_rev": rev,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k != "func"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MedSim benchmark suite (offline)")
+    parser.add_argument("suite", choices=["chunking", "embedding", "index", "retrieval", "turn", "service", "all"])
+    parser.add_argument("--sizes", default="500,2000", help="Comma-separated synthetic corpus sizes (cases)")
+    parser.add_argument("--top-k", default="1,4,10", help="Comma-separated top_k values for retrieval")
+    parser.add_argument(
+        "--backends", default="chroma", help="Comma-separated stores to query: chroma, numpy-float16, numpy-int8"
+    )
+    parser.add_argument("--queries", type=int, default=200, help="Queries per retrieval measurement")
+    parser.add_argument("--preload-cases", type=int, default=10, help="Cases to preload for in-memory retrieval timings")
+    parser.add_argument("--chunk-rows", type=int, default=2000, help="Rows for the chunking micro-benchmark")
+    parser.add_argument("--workers", type=int, default=2, help="Chunking workers for index builds")
+    parser.add_argument("--batch-size", type=int, default=256, help="Embedding batch size for index builds")
+    parser.add_argument("--embed-workers", type=int, default=0, help="Embedding processes (index builds and the embedding suite)")
+    parser.add_argument("--embed-texts", type=int, default=2000, help="Chunks encoded per embedding measurement")
+    parser.add_argument("--fake-embedder", action="store_true", help="Use a hashing embedder (no model download)")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent simulated sessions for the turn benchmark")
+    parser.add_argument("--encounters", type=int, default=100, help="Concurrent encounters for the service benchmark")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per simulated session")
+    parser.add_argument("--turn-top-k", type=int, default=4)
+    parser.add_argument("--session", action="store_true", help="Use prefix-stable patient sessions (/api/chat) for replies")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Mock Ollama seconds per token")
+    parser.add_argument("--prompt-delay", type=float, default=0.0, help="Mock Ollama seconds per 1000 prompt chars")
+    parser.add_argument("--tokens", type=int, default=48, help="Mock Ollama tokens per reply")
+    parser.add_argument("--mock-port", type=int, default=11435)
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Scheduler slots on the mock endpoint")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary index directories")
+    parser.add_argument("--out", default=None, help="Write results JSON here (default: print)")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    args.top_k = [int(k) for k in args.top_k.split(",") if k]
+    args.backends = [b for b in args.backends.split(",") if b]
+
+    # src.config reads these at import time; replies and evaluations share the scheduler built from them.
+    endpoint = f"http://127.0.0.1:{args.mock_port}"
+    os.environ["OLLAMA_ENDPOINT"] = endpoint
+    os.environ["OLLAMA_ENDPOINTS"] = endpoint
+    os.environ["OLLAMA_MAX_CONCURRENCY"] = str(args.max_concurrency)
+    # Every encounter of the service benchmark may have a reply and an evaluation queued at once.
+    os.environ["OLLAMA_MAX_QUEUE"] = str(max(64, 2 * args.encounters))
+    os.environ["RESPONSE_CACHE"] = "0"
+
+    results: Dict[str, Any] = {"meta": _meta(args)}
+    suites = {"chunking", "embedding", "index", "retrieval", "turn", "service"} if args.suite == "all" else {args.suite}
+    if args.fake_embedder:
+        suites.discard("embedding")  # measures the real model only
+
+    if "chunking" in suites:
+        results["chunking"] = bench_chunking(args)
+        print(f"chunking: {results['chunking']['mchars_per_s']:.1f} Mchars/s", file=sys.stderr)
+
+    if "embedding" in suites:
+        results["embedding"] = bench_embedding(args)
+        for r in results["embedding"]:
+            if "error" in r:
+                print(f"embedding[{r['backend']}, workers={r['workers']}]: skipped ({r['error']})", file=sys.stderr)
+            else:
+                print(
+                    f"embedding[{r['backend']}, workers={r['workers']}]: {r['texts_per_s']:.1f} texts/s, "
+                    f"min cosine {r['min_cosine']:.4f}",
+                    file=sys.stderr,
+                )
+
+    if suites & {"index", "retrieval", "turn", "service"}:
+        root = tempfile.mkdtemp(prefix="medsim-bench-")
+        embedder = _embedder(args)
+        try:
+            built = []
+            for size in args.sizes:
+                b = build_index(args, size, root, embedder)
+                built.append(b)
+                print(f"index[{size}]: {b['rows_per_s']:.1f} rows/s, {b['chunks_per_s']:.1f} chunks/s", file=sys.stderr)
+            if "index" in suites:
+                results["index"] = [{k: v for k, v in b.items() if k != "persist_dir"} for b in built]
+            if "retrieval" in suites:
+                results["retrieval"] = []
+                for b in built:
+                    for backend in args.backends:
+                        rows = bench_retrieval(args, b, embedder, backend)
+                        results["retrieval"].extend(rows)
+                        for r in rows:
+                            print(
+                                f"retrieval[{r['size']}, {backend}, k={r['top_k']}, {r['mode']}]: "
+                                f"p50 {r['p50_ms']:.2f} ms, p99 {r['p99_ms']:.2f} ms",
+                                file=sys.stderr,
+                            )
+            if "turn" in suites:
+                with MockOllama(port=args.mock_port, token_delay=args.token_delay, prompt_delay=args.prompt_delay, n_tokens=args.tokens):
+                    results["turn"] = bench_turn(args, built[0], embedder)
+                t = results["turn"]
+                print(f"turn: p50 {t['turn']['p50_ms']:.0f} ms, ttft p50 {t['ttft']['p50_ms']:.0f} ms", file=sys.stderr)
+            if "service" in suites:
+                with MockOllama(port=args.mock_port, token_delay=args.token_delay, prompt_delay=args.prompt_delay, n_tokens=args.tokens):
+                    results["service"] = bench_service(args, built[0], embedder)
+                t = results["service"]
+                print(
+                    f"service[{args.encounters} encounters]: {t['turns_per_s']:.1f} turns/s, "
+                    f"ttft p50 {t['ttft']['p50_ms']:.0f} ms, p95 {t['ttft']['p95_ms']:.0f} ms",
+                    file=sys.stderr,
+                )
+        finally:
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Results written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,227 @@
 #!/usr/bin/env python
 import argparse
+import glob
+import itertools
 import os
+from typing import List
 
-from src.rag.dataset_loader import load_pmc_dataset
+from src.rag.dataset_loader import ShardCache, load_pmc_dataset, parse_shard
+from src.rag.embeddings import BACKENDS, EmbeddingEngine
 from src.rag.indexer import ChromaIndexer
-from src.config import PERSIST_DIR, COLLECTION_NAME
+from src.rag.pipeline import IngestionPipeline, Checkpoint, Manifest
+from src.rag.case_catalog import CaseCatalog
+from src.rag.vector_store import ChromaStore
+from src.config import (
+    PERSIST_DIR,
+    COLLECTION_NAME,
+    INDEX_WORKERS,
+    EMBED_BATCH_SIZE,
+    CHECKPOINT_FILE,
+    MANIFEST_FILE,
+    CASE_CATALOG_FILE,
+    DATASET_STREAMING,
+    DATASET_CACHE_DIR,
+    DATASET_OFFLINE,
+    EMBED_BACKEND,
+    EMBED_WORKERS,
+)
+
+
+def shard_path(path: str, shard) -> str:
+    """
+    Per-shard variant of a state file, so shards indexing into one directory keep
+    separate checkpoints and manifests.
+    """
+    if shard is None:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def shard_arg(spec: str):
+    try:
+        return parse_shard(spec)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def shard_paths(path: str) -> List[str]:
+    """
+    Every shard variant of a state file that exists next to it.
+    """
+    stem, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{stem}.shard-*{ext}"))
+
+
+def load_manifests(path: str) -> Manifest:
+    """
+    The manifest at `path` merged (in memory) with every shard manifest next to it.
+    """
+    manifest = Manifest(path)
+    for other in shard_paths(path):
+        manifest.cases.update(Manifest(other).cases)
+    return manifest
+
+
+def merge_shards(target: ChromaStore, dirs: List[str], page_size: int = 5000) -> int:
+    """
+    Copy the chunks of shard builds made in other directories into `target` (by id,
+    so merging twice is harmless), then record their manifests in the target's main
+    manifest. Manifests are only recorded once their chunks are in, so the catalog
+    never lists a case the collection lacks.
+    """
+    manifest = Manifest(os.path.join(target.path, MANIFEST_FILE))
+    copied = 0
+    for path in dirs:
+        source = ChromaStore(path, COLLECTION_NAME)
+        if not source.embedding_model:
+            raise ValueError(f"{path} has no recorded embedding model; rebuild that shard first")
+        target.record_embedding_model(source.embedding_model)
+        for ids, texts, metadatas, embeddings in source.iter_pages(page_size):
+            target.upsert(ids, texts, metadatas, embeddings)
+            copied += len(ids)
+        shard = load_manifests(os.path.join(path, MANIFEST_FILE))
+        manifest.record([
+            {"pmc_id": pmc_id, "hash": h, **info} for pmc_id, hashes in shard.cases.items() for h, info in hashes.items()
+        ])
+        print(f"Merged {path}: {source.count()} chunks / {len(shard)} cases")
+    manifest.compact()
+    return copied
 
 
 def main():
     parser = argparse.ArgumentParser(description="Build Chroma index from PMC-CaseReport")
     parser.add_argument("--limit", type=int, default=None, help="Limit number of dataset rows")
     parser.add_argument("--reset", action="store_true", help="Reset collection before indexing")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last committed row")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip unchanged cases, re-embed changed ones, delete removed ones (needs a full pass)",
+    )
+    parser.add_argument(
+        "--rebuild-catalog",
+        action="store_true",
+        help="Only rewrite the case catalog (from the manifest, or by scanning Chroma) and exit",
+    )
+    parser.add_argument("--workers", type=int, default=INDEX_WORKERS, help="Chunking worker processes (0 = inline)")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks per embedding/write batch")
+    parser.add_argument(
+        "--embed-workers", type=int, default=EMBED_WORKERS, help="Embedding processes (0 = encode in this process)"
+    )
+    parser.add_argument("--embed-backend", choices=BACKENDS, default=EMBED_BACKEND, help="Embedding runtime")
+    parser.add_argument("--shard", type=shard_arg, default=None, help="Index only shard i of n (e.g. 0/4), split by PMC_id")
+    parser.add_argument(
+        "--no-streaming",
+        dest="streaming",
+        action="store_false",
+        default=DATASET_STREAMING,
+        help="Download the whole split instead of streaming it from the Hub",
+    )
+    parser.add_argument("--offline", action="store_true", default=DATASET_OFFLINE, help="Read the local dataset cache only")
+    parser.add_argument("--refresh-cache", action="store_true", help="Drop the local dataset cache and re-read from the Hub")
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        metavar="DIR",
+        help="Copy shard indexes built in other CHROMA_DIRs into this one, rebuild the catalog and exit",
+    )
     args = parser.parse_args()
 
-    indexer = ChromaIndexer(persist_dir=PERSIST_DIR, collection_name=COLLECTION_NAME)
+    catalog_path = os.path.join(PERSIST_DIR, CASE_CATALOG_FILE)
+    if args.merge:
+        target = ChromaStore(PERSIST_DIR, COLLECTION_NAME)
+        copied = merge_shards(target, args.merge)
+        catalog = CaseCatalog.from_manifest(load_manifests(os.path.join(PERSIST_DIR, MANIFEST_FILE)))
+        catalog.save(catalog_path)
+        print(f"Copied {copied} chunks · collection now {target.count()} chunks · case catalog: {len(catalog)} cases")
+        return
+
+    engine = EmbeddingEngine(backend=args.embed_backend, workers=args.embed_workers)
+    if engine.fidelity:
+        print(f"Embedding backend {engine.backend}: min cosine {engine.fidelity['min_cosine']:.4f} vs fp32")
+    indexer = ChromaIndexer(persist_dir=PERSIST_DIR, collection_name=COLLECTION_NAME, embedder=engine)
+    checkpoint = Checkpoint(shard_path(os.path.join(PERSIST_DIR, CHECKPOINT_FILE), args.shard))
+    manifest = Manifest(shard_path(os.path.join(PERSIST_DIR, MANIFEST_FILE), args.shard))
 
     if args.reset:
         print("Resetting collection…")
         indexer.reset_collection()
+        checkpoint.clear()
+        manifest.clear()
+        # The collection is shared, so every shard's state goes with it.
+        for name in (CHECKPOINT_FILE, MANIFEST_FILE):
+            for other in shard_paths(os.path.join(PERSIST_DIR, name)):
+                os.remove(other)
+    if args.rebuild_catalog:
+        manifest = load_manifests(os.path.join(PERSIST_DIR, MANIFEST_FILE))
+        catalog = CaseCatalog.from_manifest(manifest) if len(manifest) else CaseCatalog.from_collection(indexer.collection)
+        catalog.save(catalog_path)
+        print(f"Case catalog: {len(catalog)} cases → {catalog_path}")
+        return
+
+    if not len(load_manifests(os.path.join(PERSIST_DIR, MANIFEST_FILE))) and indexer.collection.count() > 0:
+        # Chunks from before content-hash IDs are unknown to the manifest and would be duplicated.
+        parser.error("Collection has no index manifest (built by an older version); rebuild once with --reset")
+
+    start_row = 0
+    if args.resume:
+        state = checkpoint.load()
+        if state.get("collection") == COLLECTION_NAME:
+            start_row = int(state.get("next_row", 0))
+            print(f"Resuming from row {start_row}")
+        else:
+            print("No checkpoint for this collection; starting from the beginning")
+    else:
+        checkpoint.clear()
+
+    # Offline runs read only the cache; if it is partial, the pass does not see the whole dataset.
+    full_source = not args.offline
+    if DATASET_CACHE_DIR:
+        cache = ShardCache(DATASET_CACHE_DIR)
+        if args.refresh_cache:
+            cache.clear()
+        state = "complete" if cache.complete else "partial"
+        print(f"Dataset cache: {cache.rows} rows ({state}) in {cache.dir}")
+        full_source = full_source or cache.complete
+    if args.incremental and not full_source:
+        print("Warning: offline with a partial dataset cache; cases missing from it will not be deleted")
+    shard_note = f" (shard {args.shard[0]}/{args.shard[1]})" if args.shard else ""
+    print(f"Loading dataset{shard_note}…")
+    rows = load_pmc_dataset(limit=args.limit, shard=args.shard, streaming=args.streaming, offline=args.offline)
+    rows = itertools.islice(rows, start_row, None)
 
-    print("Loading dataset…")
-    rows = load_pmc_dataset(limit=args.limit)
+    print(f"Indexing… (workers={args.workers}, batch size={args.batch_size})")
+    pipeline = IngestionPipeline(
+        indexer,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint=checkpoint,
+        manifest=manifest,
+        incremental=args.incremental,
+        # Removed cases can only be detected after seeing the whole dataset.
+        prune_missing=(
+            args.incremental and full_source and args.limit is None and start_row == 0 and args.shard is None
+        ),
+        log=print,
+    )
+    try:
+        stats = pipeline.run(rows, start_row=start_row)
+    finally:
+        indexer.close()
+    print(
+        f"Indexed {stats['rows']} rows / {stats['chunks']} chunks in {stats['seconds']:.1f}s "
+        f"({stats['rows_per_s']:.1f} rows/s, {stats['chunks_per_s']:.1f} chunks/s)"
+    )
+    print(
+        f"Cases: {stats['new']} new, {stats['changed']} changed, {stats['unchanged']} unchanged · "
+        f"duplicate rows: {stats['duplicate_rows']} · embeddings skipped: {stats['skipped_embeddings']} · "
+        f"chunks deleted: {stats['deleted_chunks']}"
+    )
 
-    print("Indexing…")
-    indexer.add_documents(rows)
+    catalog = CaseCatalog.from_manifest(load_manifests(os.path.join(PERSIST_DIR, MANIFEST_FILE)))
+    catalog.save(catalog_path)
+    print(f"Case catalog: {len(catalog)} cases · {catalog.specialty_counts()}")
 
     print("Done. Index stored at:", os.path.abspath(PERSIST_DIR))
 
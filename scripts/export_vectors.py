@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+
+from src.rag.vector_store import ChromaStore, NumpyStore
+from src.rag.case_catalog import CaseCatalog, guess_specialty
+from src.config import (
+    PERSIST_DIR,
+    COLLECTION_NAME,
+    EMBEDDING_MODEL_NAME,
+    CASE_CATALOG_FILE,
+    VECTOR_STORE_DIR,
+    VECTOR_STORE_DTYPE,
+)
+
+
+def _catalog_for(store: NumpyStore) -> CaseCatalog:
+    entries = []
+    for case in store.cases:
+        start, stop = int(case["start"]), int(case["stop"])
+        entries.append({
+            "pmc_id": case["pmc_id"].decode("utf-8"),
+            "n_chunks": stop - start,
+            "text_len": int(store.texts.offsets[stop] - store.texts.offsets[start]),
+            "specialty": guess_specialty(store.texts[start]),
+        })
+    return CaseCatalog.from_entries(entries)
+
+
+def _verify(source: ChromaStore, store: NumpyStore, samples: int, top_k: int = 5):
+    """
+    Query both stores with stored chunk vectors and report top-k overlap.
+    """
+    rng = np.random.default_rng(0)
+    rows = rng.choice(store.count(), size=min(samples, store.count()), replace=False)
+    queries = np.stack([store.vectors(int(r), int(r) + 1)[0] for r in rows])
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    started = time.perf_counter()
+    expected = source.query(queries, top_k=top_k)
+    chroma_s = time.perf_counter() - started
+    started = time.perf_counter()
+    got = store.query(queries, top_k=top_k)
+    numpy_s = time.perf_counter() - started
+    overlap = np.mean([
+        len({h["id"] for h in a} & {h["id"] for h in b}) / max(len(a), 1) for a, b in zip(expected, got)
+    ])
+    print(
+        f"Verify: top-{top_k} overlap with Chroma {overlap:.1%} over {len(queries)} queries · "
+        f"chroma {chroma_s * 1000 / len(queries):.2f} ms/query, numpy {numpy_s * 1000 / len(queries):.2f} ms/query"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Chroma collection to a memory-mapped NumPy store")
+    parser.add_argument("--out", default=VECTOR_STORE_DIR, help="Output directory")
+    parser.add_argument("--dtype", choices=["float16", "int8"], default=VECTOR_STORE_DTYPE)
+    parser.add_argument("--page-size", type=int, default=5000, help="Chunks read from Chroma per page")
+    parser.add_argument("--verify", type=int, default=200, help="Compare top-k against Chroma for N queries (0 = skip)")
+    args = parser.parse_args()
+
+    source = ChromaStore(PERSIST_DIR, COLLECTION_NAME)
+    if source.count() == 0:
+        parser.error("Collection is empty; build the index first")
+
+    print(f"Exporting {source.count()} chunks as {args.dtype}…")
+    started = time.perf_counter()
+    store = NumpyStore.export(
+        source, args.out, dtype=args.dtype, page_size=args.page_size,
+        embedding_model=source.embedding_model or EMBEDDING_MODEL_NAME,
+    )
+    size = sum(os.path.getsize(os.path.join(args.out, f)) for f in os.listdir(args.out))
+    print(
+        f"Wrote {store.count()} chunks / {len(store.cases)} cases in {time.perf_counter() - started:.1f}s "
+        f"({size / 1e6:.1f} MB) → {os.path.abspath(args.out)}"
+    )
+
+    catalog_src = os.path.join(PERSIST_DIR, CASE_CATALOG_FILE)
+    catalog_dst = os.path.join(args.out, CASE_CATALOG_FILE)
+    if os.path.exists(catalog_src):
+        shutil.copyfile(catalog_src, catalog_dst)
+        sidecar = os.path.splitext(catalog_src)[0] + ".json"
+        if os.path.exists(sidecar):
+            shutil.copyfile(sidecar, os.path.splitext(catalog_dst)[0] + ".json")
+        print("Copied case catalog")
+    else:
+        _catalog_for(store).save(catalog_dst)
+        print("Built case catalog from the export")
+
+    if args.verify:
+        _verify(source, store, args.verify)
+
+    print("Done. Serve it with VECTOR_BACKEND=numpy VECTOR_STORE_DIR=" + args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from src.rag.retriever import ChromaRetriever
+from src.rag.evaluator import evaluate_question_async
+from src.rag.ollama_async import AsyncOllamaScheduler
+from src.rag.history import chunk_refs, compact_evaluation
+from src.config import DEFAULT_TOP_K, OLLAMA_ENDPOINTS, OLLAMA_MAX_CONCURRENCY
+
+# Row fields copied through to the output so results can be joined back to students.
+PASSTHROUGH = ("session", "student", "n")
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def row_key(row: Dict[str, Any]) -> str:
+    """
+    Stable identity of an input row for resuming: its `id`, else its session and
+    message number (saved transcripts), else a hash of case and question.
+    """
+    if row.get("id") is not None:
+        return str(row["id"])
+    if row.get("session") and row.get("n") is not None:
+        return f"{row['session']}:{row['n']}"
+    digest = hashlib.sha1(f"{row.get('pmc_id') or ''}\n{row['question']}".encode("utf-8")).hexdigest()
+    return digest[:16]
+
+
+def read_rows(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """
+    (pmc_id, question) rows from JSONL files (optionally gzipped), including the
+    transcripts the app saves: lines without a `question` (e.g. the student's own
+    message) are skipped.
+    """
+    for path in paths:
+        with _open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if not row.get("question"):
+                    continue
+                row["key"] = row_key(row)
+                yield row
+
+
+def done_keys(path: str) -> Set[str]:
+    """
+    Keys already graded in an existing output file. A partial last line (the run was
+    killed mid-write) is cut off so appending continues on a clean line.
+    """
+    keys: Set[str] = set()
+    if not os.path.exists(path):
+        return keys
+    with open(path, "rb+") as f:
+        good = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                keys.add(json.loads(line)["key"])
+            except (ValueError, KeyError):
+                pass
+            good += len(line)
+        f.truncate(good)
+    return keys
+
+
+def group_by_case(rows: List[Dict[str, Any]]) -> "OrderedDict[Optional[str], List[Dict[str, Any]]]":
+    groups: "OrderedDict[Optional[str], List[Dict[str, Any]]]" = OrderedDict()
+    for row in rows:
+        groups.setdefault(row.get("pmc_id") or None, []).append(row)
+    return groups
+
+
+def retrieve_group(retriever: ChromaRetriever, pmc_id: Optional[str], questions: List[str], top_k: int):
+    """
+    Contexts for every question of one case: one case load and one batched encode,
+    ranked in memory. Rows without a case search the whole index.
+    """
+    if pmc_id is None:
+        return retriever.retrieve_many(questions, top_k=top_k)
+    return retriever.load_case(pmc_id).retrieve_many(questions, top_k=top_k)
+
+
+class Progress:
+    def __init__(self, total: int, every: float):
+        self.total = total
+        self.every = every
+        self.done = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self._last = self.started
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = f"{(self.total - self.done - self.failed) / rate:.0f}s" if rate > 0 else "?"
+        return (
+            f"{self.done}/{self.total} rows · {rate:.1f} rows/s · {self.failed} failed · "
+            f"{elapsed:.0f}s elapsed, ETA {eta}"
+        )
+
+    def tick(self, ok: bool):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        now = time.perf_counter()
+        if now - self._last >= self.every:
+            self._last = now
+            print(self.line(), file=sys.stderr, flush=True)
+
+
+async def grade(groups, retriever: ChromaRetriever, out, args, progress: Progress):
+    """
+    Retrieve case by case (off the event loop, so the next case's retrieval overlaps
+    the current evaluations) and keep at most `args.concurrency` evaluations in flight.
+    Each result is appended and flushed as soon as it is in.
+    """
+    loop = asyncio.get_running_loop()
+    scheduler = AsyncOllamaScheduler()
+    slots = asyncio.Semaphore(args.concurrency)
+    tasks: Set[asyncio.Task] = set()
+
+    async def one(row: Dict[str, Any], contexts: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        try:
+            evaluation = await evaluate_question_async(row["question"], contexts, scheduler, use_cache=args.cache)
+        except Exception as exc:
+            # Not written, so the next run retries it.
+            print(f"[{row['key']}] {type(exc).__name__}: {exc}", file=sys.stderr)
+            progress.tick(False)
+            return
+        finally:
+            slots.release()
+        record = {"key": row["key"], "pmc_id": row.get("pmc_id"), "question": row["question"]}
+        record.update({k: row[k] for k in PASSTHROUGH if k in row})
+        record["refs"] = chunk_refs(contexts)
+        record["evaluation"] = compact_evaluation(evaluation)
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        out.write(json.dumps(record, separators=(",", ":")) + "\n")
+        out.flush()
+        progress.tick(True)
+
+    try:
+        for pmc_id, rows in groups.items():
+            questions = [r["question"] for r in rows]
+            try:
+                batch = await loop.run_in_executor(None, retrieve_group, retriever, pmc_id, questions, args.top_k)
+            except Exception as exc:
+                print(f"[{pmc_id}] retrieval failed: {type(exc).__name__}: {exc}", file=sys.stderr)
+                for _ in rows:
+                    progress.tick(False)
+                continue
+            for row, contexts in zip(rows, batch):
+                if not contexts:
+                    print(f"[{row['key']}] no indexed chunks for case {pmc_id}", file=sys.stderr)
+                    progress.tick(False)
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(one(row, contexts))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        await scheduler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade saved student questions offline with the rubric evaluator")
+    parser.add_argument("inputs", nargs="+", help="JSONL files (.jsonl or .jsonl.gz) with pmc_id and question per line")
+    parser.add_argument("--out", required=True, help="Output JSONL; rows already in it are skipped")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=OLLAMA_MAX_CONCURRENCY * len(OLLAMA_ENDPOINTS),
+        help="Evaluations in flight (default: every Ollama slot)",
+    )
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="Chunks retrieved per question")
+    parser.add_argument("--limit", type=int, default=None, help="Grade at most N rows this run")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="Bypass the evaluation cache")
+    parser.add_argument("--overwrite", action="store_true", help="Start a fresh output file instead of resuming")
+    parser.add_argument("--progress-every", type=float, default=5.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    if args.overwrite and os.path.exists(args.out):
+        os.remove(args.out)
+    finished = done_keys(args.out)
+    rows, seen = [], set(finished)
+    for row in read_rows(args.inputs):
+        if row["key"] in seen:
+            continue
+        seen.add(row["key"])
+        rows.append(row)
+        if args.limit is not None and len(rows) >= args.limit:
+            break
+    if finished:
+        print(f"Resuming: {len(finished)} rows already graded in {args.out}")
+    if not rows:
+        print("Nothing to grade.")
+        return
+
+    groups = group_by_case(rows)
+    print(f"Grading {len(rows)} rows over {len(groups)} cases (concurrency={args.concurrency}, top_k={args.top_k})…")
+    retriever = ChromaRetriever()
+    progress = Progress(len(rows), args.progress_every)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "a", encoding="utf-8") as out:
+        asyncio.run(grade(groups, retriever, out, args, progress))
+    print(progress.line())
+    if progress.failed:
+        print(f"{progress.failed} rows failed and were not written; rerun the same command to retry them.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Headless HTTP service for the retrieval, Virtual Patient and evaluation flows.
+
+    python -m src.app.service --port 8600
+
+Ollama is called through an AsyncOllamaScheduler, so one event loop holds many
+open streams; embedding and vector search run on a small thread pool. Generation
+endpoints stream NDJSON events (`contexts`, `token`, `done`, `evaluation`, `error`)
+unless the body sets `"stream": false`, in which case one JSON object is returned.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import time
+import uuid
+
+from aiohttp import web
+
+from src.config import (
+    DEFAULT_TOP_K,
+    PATIENT_SESSION,
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SERVICE_WORKERS,
+    SERVICE_MAX_ENCOUNTERS,
+    WARMUP_ON_START,
+)
+from src.rag import runtime, tracing
+from src.rag.case_catalog import SPECIALTIES
+from src.rag.evaluator import evaluate_question_async
+from src.rag.llm import OllamaLLM, random_persona
+from src.rag.ollama_async import AsyncOllamaScheduler
+from src.rag.scheduler import SchedulerBusy
+
+logger = logging.getLogger(__name__)
+
+POOL = web.AppKey("pool", ThreadPoolExecutor)
+SCHEDULER = web.AppKey("scheduler", AsyncOllamaScheduler)
+LLM = web.AppKey("llm", OllamaLLM)
+ENCOUNTERS = web.AppKey("encounters", OrderedDict)
+MAX_ENCOUNTERS = web.AppKey("max_encounters", int)
+
+# Upper bound on `top_k` per request.
+MAX_TOP_K = 50
+
+
+class Encounter:
+    """
+    One Virtual Patient encounter held by the service. Replies are serialised per
+    encounter because the patient session's history is append-only.
+    """
+
+    def __init__(self, pmc_id: str, persona: Dict, case, session):
+        self.id = uuid.uuid4().hex
+        self.pmc_id = pmc_id
+        self.persona = persona
+        self.case = case
+        self.session = session
+        self.turns: List[Dict[str, Any]] = []
+        self.created = time.time()
+        self.lock = asyncio.Lock()
+
+    def describe(self, turns: bool = False) -> Dict[str, Any]:
+        out = {
+            "id": self.id,
+            "pmc_id": self.pmc_id,
+            "persona": self.persona,
+            "chunks": len(self.case),
+            "n_turns": len(self.turns),
+            "created": self.created,
+            "session": self.session.summary() if self.session is not None else None,
+        }
+        if turns:
+            out["turns"] = self.turns
+        return out
+
+
+def _error(exc_class, message: str) -> web.HTTPException:
+    return exc_class(text=json.dumps({"error": message}), content_type="application/json")
+
+
+async def _body(request: web.Request) -> Dict[str, Any]:
+    if not request.body_exists:
+        return {}
+    try:
+        body = await request.json()
+    except ValueError:
+        raise _error(web.HTTPBadRequest, "Body must be JSON")
+    if not isinstance(body, dict):
+        raise _error(web.HTTPBadRequest, "Body must be a JSON object")
+    return body
+
+
+def _text_field(body: Dict[str, Any], name: str) -> str:
+    value = body.get(name)
+    if not isinstance(value, str) or not value.strip():
+        raise _error(web.HTTPBadRequest, f"'{name}' is required")
+    return value.strip()
+
+
+def _top_k(body: Dict[str, Any]) -> int:
+    value = body.get("top_k", DEFAULT_TOP_K)
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_TOP_K:
+        raise _error(web.HTTPBadRequest, f"'top_k' must be an integer from 1 to {MAX_TOP_K}")
+    return value
+
+
+async def _run(request: web.Request, fn, *args, **kwargs):
+    # Embedding, vector search and SQLite calls block; keep them off the event loop.
+    # bind() carries the request's trace into the worker thread.
+    return await asyncio.get_running_loop().run_in_executor(
+        request.app[POOL], tracing.bind(functools.partial(fn, *args, **kwargs))
+    )
+
+
+def _encounter(request: web.Request) -> Encounter:
+    encounter = request.app[ENCOUNTERS].get(request.match_info["encounter_id"])
+    if encounter is None:
+        raise _error(web.HTTPNotFound, "Unknown encounter")
+    return encounter
+
+
+async def _token_events(token_stream) -> AsyncIterator[Dict[str, Any]]:
+    tokens = token_stream.__aiter__()
+    try:
+        async for token in tokens:
+            yield {"type": "token", "text": token}
+    finally:
+        # The client went away mid-reply: drop the Ollama connection so generation stops.
+        if not token_stream.done:
+            token_stream.cancel()
+        await tokens.aclose()
+    t = tracing.current()
+    yield {
+        "type": "done",
+        "text": token_stream.text,
+        "stats": token_stream.stats,
+        "trace_id": t.id if t is not None else None,
+    }
+
+
+async def _respond(request: web.Request, events: AsyncIterator[Dict[str, Any]], stream: bool) -> web.StreamResponse:
+    """
+    Send `events` as NDJSON lines, or fold them into one JSON object (tokens dropped,
+    the other events' fields merged) when the client asked for `"stream": false`.
+    """
+    if not stream:
+        result: Dict[str, Any] = {}
+        try:
+            async for event in events:
+                if event["type"] != "token":
+                    result.update({k: v for k, v in event.items() if k != "type"})
+        except SchedulerBusy as exc:
+            raise _error(web.HTTPServiceUnavailable, str(exc))
+        finally:
+            await events.aclose()
+        return web.json_response(result)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    try:
+        async for event in events:
+            await response.write((json.dumps(event) + "\n").encode("utf-8"))
+    except SchedulerBusy as exc:
+        await response.write((json.dumps({"type": "error", "error": str(exc)}) + "\n").encode("utf-8"))
+    finally:
+        await events.aclose()
+    await response.write_eof()
+    return response
+
+
+# -- handlers ---------------------------------------------------------------
+
+
+async def health(request: web.Request) -> web.Response:
+    status: Dict[str, Any] = {}
+    try:
+        retriever = await _run(request, runtime.get_retriever)
+        status["index_chunks"] = await _run(request, retriever.store.count)
+        status["index_ok"] = True
+    except Exception:
+        status["index_chunks"] = 0
+        status["index_ok"] = False
+    status["ollama_ok"] = await request.app[SCHEDULER].ping()
+    status["ready"] = bool(status["index_ok"] and status["ollama_ok"])
+    return web.json_response(status, status=200 if status["ready"] else 503)
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.json_response({
+        "scheduler": request.app[SCHEDULER].metrics(),
+        "runtime": runtime.metrics(),
+        "stages": tracing.histograms.summary(),
+        "encounters": len(request.app[ENCOUNTERS]),
+    })
+
+
+async def prometheus(request: web.Request) -> web.Response:
+    return web.Response(text=tracing.prometheus_text(), content_type="text/plain", charset="utf-8")
+
+
+async def traces(request: web.Request) -> web.Response:
+    """
+    Recent traces as JSONL, optionally for one encounter (`?session_id=`).
+    """
+    body = tracing.traces_jsonl(request.query.get("session_id"))
+    return web.Response(text=body, content_type="application/x-ndjson", charset="utf-8")
+
+
+async def retrieve(request: web.Request) -> web.Response:
+    body = await _body(request)
+    queries = body.get("queries")
+    if queries is None:
+        queries = [_text_field(body, "query")]
+    elif not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        raise _error(web.HTTPBadRequest, "'queries' must be a list of strings")
+    top_k = _top_k(body)
+    retriever = await _run(request, runtime.get_retriever)
+    results = await _run(request, retriever.retrieve_many, queries, top_k=top_k, pmc_id=body.get("pmc_id"))
+    if "queries" in body:
+        return web.json_response({"results": results})
+    return web.json_response({"contexts": results[0]})
+
+
+async def generate(request: web.Request) -> web.StreamResponse:
+    """
+    Study-mode RAG answer: retrieve, then stream the grounded reply.
+    """
+    body = await _body(request)
+    question = _text_field(body, "question")
+    top_k = _top_k(body)
+    use_cache = not body.get("bypass_cache", False)
+    with tracing.trace("generate"):
+        retriever = await _run(request, runtime.get_retriever)
+        contexts = await _run(request, retriever.retrieve, question, top_k=top_k, pmc_id=body.get("pmc_id"))
+
+        async def events():
+            yield {"type": "contexts", "contexts": contexts}
+            token_stream = await _run(request, request.app[LLM].stream, question, contexts, use_cache=use_cache)
+            async for event in _token_events(token_stream):
+                yield event
+
+        return await _respond(request, events(), body.get("stream", True))
+
+
+async def create_encounter(request: web.Request) -> web.Response:
+    body = await _body(request)
+    pmc_id = body.get("pmc_id")
+    if pmc_id is not None and not isinstance(pmc_id, str):
+        raise _error(web.HTTPBadRequest, "'pmc_id' must be a string")
+    specialty = body.get("specialty")
+    if specialty is not None and specialty not in SPECIALTIES:
+        raise _error(web.HTTPBadRequest, f"'specialty' must be one of {', '.join(SPECIALTIES)}")
+    min_chunks = body.get("min_chunks")
+    if min_chunks is not None and (isinstance(min_chunks, bool) or not isinstance(min_chunks, int) or min_chunks < 0):
+        raise _error(web.HTTPBadRequest, "'min_chunks' must be a non-negative integer")
+    persona = body.get("persona")
+    if persona is not None and not isinstance(persona, dict):
+        raise _error(web.HTTPBadRequest, "'persona' must be an object")
+    retriever = await _run(request, runtime.get_retriever)
+    pmc_id = pmc_id or await _run(
+        request,
+        retriever.sample_pmc_id,
+        specialty=specialty,
+        min_chunks=min_chunks,
+        stratified=bool(body.get("stratified", False)),
+    )
+    if not pmc_id:
+        raise _error(web.HTTPNotFound, "No case available")
+    case = await _run(request, retriever.load_case, pmc_id)
+    if not len(case):
+        raise _error(web.HTTPNotFound, f"Case {pmc_id} is not in the index")
+    persona = persona or random_persona()
+    session = request.app[LLM].start_patient_session(persona, case) if PATIENT_SESSION else None
+
+    encounter = Encounter(pmc_id, persona, case, session)
+    encounters = request.app[ENCOUNTERS]
+    encounters[encounter.id] = encounter
+    while len(encounters) > request.app[MAX_ENCOUNTERS]:
+        encounters.popitem(last=False)
+    return web.json_response(encounter.describe(), status=201)
+
+
+async def get_encounter(request: web.Request) -> web.Response:
+    return web.json_response(_encounter(request).describe(turns=True))
+
+
+async def delete_encounter(request: web.Request) -> web.Response:
+    encounter = _encounter(request)
+    request.app[ENCOUNTERS].pop(encounter.id, None)
+    return web.Response(status=204)
+
+
+async def reply(request: web.Request) -> web.StreamResponse:
+    """
+    Next Virtual Patient turn. With `"evaluate": true` the clinician's question is
+    scored concurrently (at evaluation priority) and sent after the reply.
+    """
+    encounter = _encounter(request)
+    body = await _body(request)
+    utterance = _text_field(body, "utterance")
+    top_k = _top_k(body)
+    use_cache = not body.get("bypass_cache", False)
+    llm = request.app[LLM]
+
+    async def events():
+        async with encounter.lock:
+            contexts = await _run(request, encounter.case.retrieve, utterance, top_k=top_k)
+            yield {"type": "contexts", "contexts": contexts}
+            evaluation = None
+            if body.get("evaluate"):
+                evaluation = asyncio.ensure_future(
+                    evaluate_question_async(utterance, contexts, request.app[SCHEDULER], use_cache=use_cache)
+                )
+            try:
+                if encounter.session is not None:
+                    token_stream = await _run(request, encounter.session.stream_reply, utterance, contexts, use_cache)
+                else:
+                    token_stream = await _run(
+                        request, llm.stream_patient_reply, utterance, contexts, encounter.persona, use_cache
+                    )
+                async for event in _token_events(token_stream):
+                    yield event
+                turn = {
+                    "question": utterance,
+                    "reply": token_stream.text,
+                    "context_ids": [c.get("id") for c in contexts],
+                    "trace_id": tracing.current().id,
+                }
+                encounter.turns.append(turn)
+                if evaluation is not None:
+                    turn["evaluation"] = await evaluation
+                    yield {"type": "evaluation", "evaluation": turn["evaluation"]}
+            finally:
+                if evaluation is not None and not evaluation.done():
+                    evaluation.cancel()
+
+    with tracing.trace("turn", session_id=encounter.id, turn_id=len(encounter.turns)):
+        return await _respond(request, events(), body.get("stream", True))
+
+
+async def evaluate(request: web.Request) -> web.Response:
+    """
+    Score a question. `contexts` may be passed in; otherwise they are retrieved
+    (within `pmc_id` when given).
+    """
+    body = await _body(request)
+    question = _text_field(body, "question")
+    contexts = body.get("contexts")
+    if contexts is not None and (
+        not isinstance(contexts, list) or not all(isinstance(c, dict) and isinstance(c.get("text"), str) for c in contexts)
+    ):
+        raise _error(web.HTTPBadRequest, "'contexts' must be a list of objects with a 'text' string")
+    top_k = _top_k(body)
+    with tracing.trace("evaluation") as t:
+        if contexts is None:
+            retriever = await _run(request, runtime.get_retriever)
+            contexts = await _run(request, retriever.retrieve, question, top_k=top_k, pmc_id=body.get("pmc_id"))
+        try:
+            result = await evaluate_question_async(
+                question, contexts, request.app[SCHEDULER], use_cache=not body.get("bypass_cache", False)
+            )
+        except SchedulerBusy as exc:
+            raise _error(web.HTTPServiceUnavailable, str(exc))
+    return web.json_response({"evaluation": result, "contexts": contexts, "trace_id": t.id})
+
+
+# -- app ----------------------------------------------------------------------
+
+
+def create_app(workers: int = SERVICE_WORKERS, max_encounters: int = SERVICE_MAX_ENCOUNTERS) -> web.Application:
+    app = web.Application()
+    app[POOL] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="service")
+    app[SCHEDULER] = AsyncOllamaScheduler()
+    app[ENCOUNTERS] = OrderedDict()
+    app[MAX_ENCOUNTERS] = max_encounters
+
+    async def on_startup(app: web.Application):
+        loop = asyncio.get_running_loop()
+        if WARMUP_ON_START:
+            timings = await loop.run_in_executor(app[POOL], runtime.warm_up, ["retriever", "embedder", "response_cache"])
+            logger.info("warm-up %s", {k: round(v, 2) for k, v in timings.items()})
+        # Shares the process-wide response cache; its stream methods return async iterables.
+        cache = await loop.run_in_executor(app[POOL], runtime.get_response_cache)
+        app[LLM] = OllamaLLM(cache=cache, scheduler=app[SCHEDULER])
+
+    async def on_cleanup(app: web.Application):
+        await app[SCHEDULER].close()
+        app[POOL].shutdown(wait=False)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes([
+        web.get("/health", health),
+        web.get("/metrics", metrics),
+        web.get("/metrics/prometheus", prometheus),
+        web.get("/traces", traces),
+        web.post("/retrieve", retrieve),
+        web.post("/generate", generate),
+        web.post("/evaluate", evaluate),
+        web.post("/encounters", create_encounter),
+        web.get("/encounters/{encounter_id}", get_encounter),
+        web.delete("/encounters/{encounter_id}", delete_encounter),
+        web.post("/encounters/{encounter_id}/reply", reply),
+    ])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless MedSimuli HTTP service")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Threads for embedding and vector search")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    web.run_app(create_app(workers=args.workers), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,33 @@
 import os
-import random
+import uuid
 import streamlit as st
 
-from src.config import DEFAULT_TOP_K, ETHICS_POLICY
-from src.rag.evaluator import evaluate_question
-from src.rag.retriever import ChromaRetriever
-from src.rag.llm import OllamaLLM
+from src.config import (
+    DEFAULT_TOP_K,
+    ETHICS_POLICY,
+    WARMUP_ON_START,
+    EVAL_DEFERRED,
+    PATIENT_SESSION,
+    HISTORY_PAGE_SIZE,
+    HISTORY_MAX_MESSAGES,
+)
+from src.rag.eval_jobs import EvaluationQueue
+from src.rag.evaluator import CRITERIA, with_overall
+from src.rag.history import TranscriptStore, chunk_refs, compact_evaluation
+from src.rag.llm import random_persona
+from src.rag import runtime, tracing
+from src.rag.scheduler import SchedulerBusy
 
 
 st.set_page_config(page_title="MedSimuli – Virtual Patient", page_icon="🩺", layout="wide")
 st.title("MedSimuli: Virtual Patient (RAG + Ollama)")
 # st.caption("Prototype for demonstration only. Not medical advice.")
 
+# Shared resources live for the whole server process; only the first session pays for them.
+if WARMUP_ON_START and not runtime.registry.is_ready("retriever"):
+    with st.spinner("Loading index and models…"):
+        runtime.warm_up()
+
 if "history" not in st.session_state:
     st.session_state.history = []
 if "mode" not in st.session_state:
@@ -20,6 +36,123 @@ if "patient_pmc_id" not in st.session_state:
     st.session_state.patient_pmc_id = None
 if "patient_persona" not in st.session_state:
     st.session_state.patient_persona = None
+if "case_context" not in st.session_state:
+    st.session_state.case_context = None
+if "patient_session" not in st.session_state:
+    st.session_state.patient_session = None
+if "pending_opening" not in st.session_state:
+    st.session_state.pending_opening = None
+if "eval_queue" not in st.session_state:
+    st.session_state.eval_queue = EvaluationQueue(runtime.get_eval_executor())
+if "transcript_job" not in st.session_state:
+    st.session_state.transcript_job = None
+if "trace_session" not in st.session_state:
+    st.session_state.trace_session = uuid.uuid4().hex[:12]
+if "last_trace" not in st.session_state:
+    st.session_state.last_trace = None
+if "message_seq" not in st.session_state:
+    st.session_state.message_seq = 0
+if "spilled" not in st.session_state:
+    st.session_state.spilled = 0
+if "saved_transcript" not in st.session_state:
+    st.session_state.saved_transcript = None
+
+transcripts = TranscriptStore()
+
+
+def next_message_id():
+    """
+    Stable number of a history message (widget keys, trace turn ids); unlike its
+    position it does not shift when older messages leave memory.
+    """
+    n = st.session_state.message_seq
+    st.session_state.message_seq += 1
+    return n
+
+
+def spill_history():
+    """
+    Keep at most HISTORY_MAX_MESSAGES messages in memory: the oldest ones whose
+    evaluation has settled are appended to the session's transcript file.
+    """
+    history = st.session_state.history
+    excess = len(history) - HISTORY_MAX_MESSAGES
+    n = 0
+    while n < excess and not history[n].get("eval_job") and not history[n].get("eval_deferred"):
+        n += 1
+    if n:
+        transcripts.append(st.session_state.trace_session, history[:n])
+        del history[:n]
+        st.session_state.spilled += n
+
+
+def collect_evaluations(turns):
+    """
+    Move finished background evaluations into their turns. Turns scored together by
+    a deferred transcript job share one job id and take results in order.
+    """
+    queue = st.session_state.eval_queue
+    job = st.session_state.transcript_job
+    if job is not None and queue.done(job):
+        results = queue.result(job)
+        batch = [t for t in turns if t.get("eval_job") == job]
+        if isinstance(results, dict):  # the whole job failed
+            results = [results] * len(batch)
+        for t, ev in zip(batch, results):
+            t["evaluation"] = compact_evaluation(ev)
+            t.pop("eval_job", None)
+        st.session_state.transcript_job = None
+    for t in turns:
+        if t.get("eval_job") and t["eval_job"] != job:
+            ev = queue.result(t["eval_job"])
+            if ev is not None:
+                t["evaluation"] = compact_evaluation(ev)
+                t.pop("eval_job", None)
+
+
+def end_session():
+    """
+    Save the full transcript (messages still in memory after those already spilled)
+    and start a fresh session.
+    """
+    collect_evaluations(st.session_state.history)
+    st.session_state.saved_transcript = transcripts.append(st.session_state.trace_session, st.session_state.history)
+    st.session_state.eval_queue.cancel_all()
+    st.session_state.history = []
+    st.session_state.spilled = 0
+    st.session_state.transcript_job = None
+    st.session_state.patient_pmc_id = None
+    st.session_state.patient_persona = None
+    st.session_state.case_context = None
+    st.session_state.patient_session = None
+    st.session_state.pending_opening = None
+    st.session_state.last_trace = None
+    st.session_state.trace_session = uuid.uuid4().hex[:12]
+
+
+def score_encounter(top_k):
+    """
+    Deferred evaluation: submit every not-yet-scored question of the encounter as one
+    batch job, with the retrieved contexts pooled across turns.
+    """
+    waiting = [t for t in st.session_state.history if t.get("eval_deferred")]
+    if not waiting or st.session_state.transcript_job is not None:
+        return
+    questions, pooled, seen = [], [], set()
+    for t in waiting:
+        questions.append(t["question"])
+        for c in t.get("contexts") or []:
+            key = (c.get("pmc_id"), c.get("chunk_index"))
+            if key not in seen:
+                seen.add(key)
+                pooled.append(c)
+    pooled = runtime.get_chunk_texts().resolve(pooled[:2 * top_k])
+    job = st.session_state.eval_queue.submit_transcript(questions, pooled)
+    st.session_state.transcript_job = job
+    for t in waiting:
+        t["eval_deferred"] = False
+        t["eval_job"] = job
+
 
 with st.sidebar:
     st.header("Settings")
@@ -30,30 +163,70 @@ with st.sidebar:
     )
     top_k = st.slider("Top K", min_value=1, max_value=10, value=DEFAULT_TOP_K)
     temperature = st.slider("Temperature", min_value=0.0, max_value=1.0, value=0.2, step=0.05)
+    bypass_cache = st.checkbox("Bypass response cache", value=False, help="Always call the model, even for repeated questions.")
+    deferred_eval = st.checkbox(
+        "Deferred evaluation",
+        value=EVAL_DEFERRED,
+        help="Skip per-turn scoring and evaluate the whole transcript in one batch at the end of the encounter.",
+    )
+    if deferred_eval:
+        waiting = [t for t in st.session_state.history if t.get("eval_deferred")]
+        if st.button("Score encounter", disabled=not waiting or st.session_state.transcript_job is not None):
+            score_encounter(top_k)
+    if st.button("End session", disabled=not st.session_state.history, help="Save the transcript to disk and start over."):
+        end_session()
+    if st.session_state.saved_transcript:
+        st.caption(f"Transcript saved: {st.session_state.saved_transcript}")
 
     if st.session_state.mode == "Virtual Patient":
         st.markdown("---")
         st.subheader("Virtual Patient")
         current = st.session_state.patient_pmc_id or "None"
         st.text(f"Current case: {current}")
+        if st.session_state.patient_session is not None:
+            summary = st.session_state.patient_session.summary()
+            if summary["first_turn_tokens"] is not None:
+                later = summary["later_turn_mean"]
+                st.caption(
+                    f"Prompt tokens: {summary['first_turn_tokens']} on the first turn"
+                    + (f", ~{later:.0f} per later turn" if later is not None else "")
+                )
+        catalog = runtime.get_retriever().catalog
+        case_filter = {}
+        if catalog is not None:
+            counts = catalog.specialty_counts()
+            choice = st.selectbox(
+                "Case specialty",
+                ["Any", "Balanced across specialties"] + sorted(counts),
+                format_func=lambda s: f"{s} ({counts[s]})" if s in counts else s,
+            )
+            min_chunks = st.number_input("Minimum chunks", min_value=1, max_value=50, value=1)
+            case_filter = {
+                "specialty": choice if choice in counts else None,
+                "stratified": choice == "Balanced across specialties",
+                "min_chunks": int(min_chunks) if min_chunks > 1 else None,
+            }
         if st.button("New patient"):
-            retriever = ChromaRetriever()
-            pmc = retriever.sample_pmc_id()
+            # Switching cases ends the encounter; score what was deferred.
+            score_encounter(top_k)
+            retriever = runtime.get_retriever()
+            pmc = retriever.sample_pmc_id(**case_filter)
             st.session_state.patient_pmc_id = pmc
-            # simple synthetic persona
-            st.session_state.patient_persona = {
-                "name": random.choice(["Alex", "Jordan", "Taylor", "Casey", "Riley", "Morgan"]),
-                "sex": random.choice(["male", "female"]),
-                "age": random.choice([22, 35, 47, 60, 72]),
-                "notes": "Cooperative, answers succinctly."
-            }
+            st.session_state.patient_persona = random_persona()
             if pmc:
-                contexts = retriever.retrieve("chief complaint presenting symptoms", top_k=top_k, pmc_id=pmc)
+                # Load the whole case once; every turn of the encounter ranks these chunks in memory.
+                st.session_state.case_context = retriever.load_case(pmc)
+                contexts = st.session_state.case_context.retrieve("chief complaint presenting symptoms", top_k=top_k)
             else:
+                st.session_state.case_context = None
                 contexts = []
-            llm = OllamaLLM()
-            opening = llm.generate_patient_reply("What brings you in today?", contexts, st.session_state.patient_persona)
-            st.session_state.history.append({"role": "assistant", "content": opening, "contexts": contexts, "pmc_id": pmc})
+            # One append-only conversation per encounter so Ollama reuses the prompt prefix.
+            st.session_state.patient_session = (
+                runtime.get_llm().start_patient_session(st.session_state.patient_persona, st.session_state.case_context)
+                if PATIENT_SESSION and pmc else None
+            )
+            # The opening line is streamed in the chat area below.
+            st.session_state.pending_opening = {"contexts": contexts, "pmc_id": pmc}
 
     st.markdown("---")
     st.subheader("Index")
@@ -61,86 +234,273 @@ with st.sidebar:
         from src.config import PERSIST_DIR
         st.info(f"Chroma path: {os.path.abspath(PERSIST_DIR)}")
 
+    with st.expander("Runtime"):
+        if st.button("Health check"):
+            st.json(runtime.health())
+        stats = runtime.metrics()
+        for name, m in stats.items():
+            state = "ready" if m["ready"] else "cold"
+            st.caption(
+                f"{name}: {state} · setup {m['build_seconds'] + m['warm_seconds']:.2f}s · "
+                f"reused {m['hits']}× · saved {m['saved_seconds']:.1f}s"
+            )
+        per_turn = stats["retriever"]["build_seconds"] + stats["retriever"]["warm_seconds"] + stats["llm"]["build_seconds"]
+        st.caption(f"Setup avoided per turn: ~{per_turn:.2f}s")
+        if stats["embedder"]["ready"]:
+            qc = runtime.get_embedder().cache_info()
+            st.caption(f"Query cache: {qc['size']}/{qc['capacity']} · hit rate {qc['hit_rate']:.0%}")
+        sched = runtime.scheduler_metrics()
+        waits = " · ".join(f"{name} wait p95 {w['p95_s']:.1f}s" for name, w in sched["wait"].items())
+        st.caption(
+            f"Ollama queue: {sched['queue_depth']} waiting, {sched['in_flight']} in flight"
+            f" on {len(sched['endpoints'])} endpoint(s) · {sched['dedup_hits']} merged · {sched['rejected']} rejected"
+            + (f" · {waits}" if waits else "")
+        )
+        if stats["chunk_texts"]["ready"]:
+            ct = runtime.get_chunk_texts().stats()
+            st.caption(f"Chunk text cache: {ct['size']}/{ct['capacity']} · hit rate {ct['hit_rate']:.0%}")
+        if stats["response_cache"]["ready"]:
+            rc = runtime.get_response_cache().stats()
+            st.caption(
+                f"Response cache: {rc['hits']} exact + {rc['semantic_hits']} semantic hits, "
+                f"{rc['misses']} misses · hit rate {rc['hit_rate']:.0%}"
+            )
+
     st.markdown("---")
     with st.expander("Ethics/HIPAA policy in effect"):
         st.write(ETHICS_POLICY)
 
+def render_metrics(metrics):
+    if not metrics:
+        return
+    parts = []
+    if metrics.get("ttft_s") is not None:
+        parts.append(f"first token {metrics['ttft_s']:.2f}s")
+    if metrics.get("tokens_per_s"):
+        parts.append(f"{metrics['tokens_per_s']:.1f} tok/s")
+    if metrics.get("prompt_eval_count"):
+        parts.append(f"{metrics['prompt_eval_count']} prompt tok")
+    parts.append(f"{metrics.get('total_s', 0.0):.1f}s total")
+    if metrics.get("cancelled"):
+        parts.append("cancelled")
+    if metrics.get("cached"):
+        parts = ["served from cache"]
+    st.caption(" · ".join(parts))
+
+
+def render_turn_details(turn):
+    render_metrics(turn.get("metrics"))
+    if turn.get("contexts"):
+        # History keeps chunk references only; texts are fetched when the sources are opened.
+        if st.toggle(f"Sources ({len(turn['contexts'])})", key=f"sources-{turn['n']}"):
+            for c in runtime.get_chunk_texts().resolve(turn["contexts"]):
+                score = f", score {c['score']:.3f}" if c.get("score") is not None else ""
+                st.markdown(f"- **[PMC_id]**: {c.get('pmc_id')} (chunk {c.get('chunk_index')}{score})")
+                st.write(c.get("text"))
+                st.markdown("---")
+    if turn.get("eval_job"):
+        st.caption("Evaluating…")
+    elif turn.get("eval_deferred"):
+        st.caption("Evaluation deferred to the end of the encounter")
+    if turn.get("evaluation"):
+        with st.expander("Evaluation"):
+            ev = turn["evaluation"]
+            if "overall" not in ev:
+                ev = with_overall(ev)
+            scores = ev.get("scores", {})
+            reasoning = ev.get("reasoning", {})
+            phase_guess = ev.get("phase_guess")
+            risk_flags = ev.get("risk_flags", [])
+            overall, band = ev["overall"], ev["band"]
+            # Brief rationale: the compact one-liner, else diagnostic utility, then relevance
+            brief = ev.get("rationale") or reasoning.get("diagnostic_utility") or reasoning.get("relevance") or ""
+            st.markdown(f"**Overall score:** {overall:.1f}/5 · {band}")
+            if brief:
+                st.caption(brief)
+            if phase_guess:
+                st.caption(f"Phase: {phase_guess}")
+            if risk_flags:
+                st.caption(f"Flags: {', '.join(risk_flags)}")
+            # Optional detailed breakdown
+            with st.expander("Show breakdown"):
+                st.markdown("**Scores (0–5)**")
+                for k in CRITERIA:
+                    if k in scores:
+                        st.write(f"- {k.replace('_',' ').title()}: {scores[k]}/5")
+                if reasoning:
+                    st.markdown("**Reasoning**")
+                for k in CRITERIA:
+                    if k in reasoning:
+                        st.write(f"- {k.replace('_',' ').title()}: {reasoning[k]}")
+
+
+def render_trace_panel():
+    """
+    Sidebar debug panel: where the last turn's time went, stage by stage, plus its
+    background evaluation once that has finished.
+    """
+    last = st.session_state.last_trace
+    with st.sidebar.expander("Debug: last turn timing"):
+        if last is None:
+            st.caption("No turn traced yet.")
+        else:
+            st.caption(f"Turn {last.turn_id} · {last.total_s:.2f}s total · trace {last.id}")
+            for name, seconds in sorted(last.breakdown().items(), key=lambda kv: -kv[1]):
+                st.caption(f"{name}: {seconds * 1000:.0f} ms")
+            for t in tracing.recent(last.session_id, last.turn_id):
+                if t.name == "evaluation":
+                    stages = ", ".join(f"{n} {s * 1000:.0f} ms" for n, s in t.breakdown().items())
+                    st.caption(f"evaluation (background): {t.total_s:.2f}s · {stages}")
+        st.download_button("Prometheus metrics", tracing.prometheus_text(), file_name="medsim_metrics.prom")
+        st.download_button(
+            "Traces (JSONL)", tracing.traces_jsonl(st.session_state.trace_session), file_name="medsim_traces.jsonl"
+        )
+
+
+def patient_stream(utterance, contexts, pmc):
+    """
+    Patient reply for the current encounter: through its prefix-stable session when
+    one is open for this case, else a one-off prompt.
+    """
+    session = st.session_state.patient_session
+    if session is not None and session.pmc_id == pmc:
+        return session.stream_reply(utterance, contexts, use_cache=not bypass_cache)
+    return runtime.get_llm().stream_patient_reply(
+        utterance, contexts, st.session_state.patient_persona, use_cache=not bypass_cache
+    )
+
+
+def stream_reply(token_stream):
+    """
+    Render tokens as they arrive. When the run is interrupted mid-reply (a resubmit,
+    a click, the session closing) Streamlit raises into this frame; the stream is
+    cancelled and its iterator closed there, so the Ollama connection and the
+    scheduler slot are released at once rather than when the generator is collected.
+    """
+    tokens = iter(token_stream)
+    try:
+        st.write_stream(tokens)
+    except SchedulerBusy as exc:
+        st.warning(f"The model is busy right now ({exc}). Please ask again in a moment.")
+    except BaseException:
+        token_stream.cancel()
+        tokens.close()
+        raise
+    return token_stream.text, token_stream.stats
+
+
+def render_message(message):
+    with st.chat_message(message["role"]):
+        st.write(message["content"])
+        render_turn_details(message)
+
+
+def render_history():
+    """
+    The last HISTORY_PAGE_SIZE messages; earlier ones one page at a time on request,
+    so a rerun costs the same however long the encounter gets.
+    """
+    history = st.session_state.history
+    older = history[:-HISTORY_PAGE_SIZE] if len(history) > HISTORY_PAGE_SIZE else []
+    earlier = len(older) + st.session_state.spilled
+    if earlier and st.toggle(f"Show {earlier} earlier messages", key="show_earlier"):
+        if st.session_state.spilled:
+            st.caption(
+                f"{st.session_state.spilled} messages saved to {transcripts.path(st.session_state.trace_session)}"
+            )
+        if older:
+            pages = -(-len(older) // HISTORY_PAGE_SIZE)
+            page = st.number_input("Page", min_value=1, max_value=pages, value=pages, key="history_page")
+            for message in older[(page - 1) * HISTORY_PAGE_SIZE:page * HISTORY_PAGE_SIZE]:
+                render_message(message)
+        st.markdown("---")
+    for message in history[-HISTORY_PAGE_SIZE:]:
+        render_message(message)
+
+
+collect_evaluations(st.session_state.history)
+render_history()
+
+if st.session_state.pending_opening is not None:
+    opening_turn = st.session_state.pending_opening
+    st.session_state.pending_opening = None
+    n = next_message_id()
+    with tracing.trace("turn", session_id=st.session_state.trace_session, turn_id=n) as turn_trace:
+        with st.chat_message("assistant"):
+            opening, metrics = stream_reply(
+                patient_stream("What brings you in today?", opening_turn["contexts"], opening_turn["pmc_id"])
+            )
+            runtime.get_chunk_texts().put(opening_turn["contexts"])
+            turn = {
+                "n": n,
+                "role": "assistant",
+                "content": opening,
+                "contexts": chunk_refs(opening_turn["contexts"]),
+                "pmc_id": opening_turn["pmc_id"],
+                "metrics": metrics,
+            }
+            render_turn_details(turn)
+    st.session_state.history.append(turn)
+    st.session_state.last_trace = turn_trace
+    spill_history()
+
 placeholder = "Ask about a case, symptoms, labs, or differential…" if st.session_state.mode == "Study (RAG QA)" else "Ask the patient a question…"
 prompt = st.chat_input(placeholder)
 
 if prompt:
-    retriever = ChromaRetriever()
-    llm = OllamaLLM()
-    if st.session_state.mode == "Virtual Patient":
-        pmc = st.session_state.patient_pmc_id
-        contexts = retriever.retrieve(prompt, top_k=top_k, pmc_id=pmc)
-        reply = llm.generate_patient_reply(prompt, contexts, st.session_state.patient_persona)
-        eval_json = evaluate_question(prompt, contexts)
-        st.session_state.history.append({"role": "user", "content": prompt})
-        st.session_state.history.append({"role": "assistant", "content": reply, "contexts": contexts, "pmc_id": pmc, "evaluation": eval_json})
-    else:
-        contexts = retriever.retrieve(prompt, top_k=top_k)
-        answer = llm.generate(prompt, contexts)
-        eval_json = evaluate_question(prompt, contexts)
-        st.session_state.history.append({"role": "user", "content": prompt})
-        st.session_state.history.append({"role": "assistant", "content": answer, "contexts": contexts, "evaluation": eval_json})
-
-for turn in st.session_state.history:
-    with st.chat_message(turn["role"]):
-        st.write(turn["content"]) 
-        if turn.get("contexts"):
-            with st.expander("Sources"):
-                for c in turn["contexts"]:
-                    st.markdown(f"- **[PMC_id]**: {c.get('pmc_id')} (chunk {c.get('chunk_index')}, score {c.get('score'):.3f})")
-                    st.write(c.get("text"))
-                    st.markdown("---")
-        if turn.get("evaluation"):
-            with st.expander("Evaluation"):
-                ev = turn["evaluation"]
-                scores = ev.get("scores", {})
-                reasoning = ev.get("reasoning", {})
-                phase_guess = ev.get("phase_guess")
-                risk_flags = ev.get("risk_flags", [])
-                # Overall score (weighted)
-                weights = {
-                    "relevance": 0.30,
-                    "diagnostic_utility": 0.30,
-                    "clarity_specificity": 0.20,
-                    "empathy_professionalism": 0.10,
-                    "hipaa_ethics": 0.10,
-                }
-                overall = 0.0
-                total_w = 0.0
-                for k, w in weights.items():
-                    if k in scores:
-                        overall += float(scores[k]) * w
-                        total_w += w
-                overall = overall / total_w if total_w > 0 else 0.0
-                band = (
-                    "Excellent" if overall >= 4.5 else
-                    "Good" if overall >= 3.5 else
-                    "Needs focus" if overall >= 2.5 else
-                    "Off-track"
-                )
-                # Brief rationale: prefer diagnostic utility, then relevance, else any
-                brief = reasoning.get("diagnostic_utility") or reasoning.get("relevance") or ""
-                st.markdown(f"**Overall score:** {overall:.1f}/5 · {band}")
-                if brief:
-                    st.caption(brief)
-                if phase_guess:
-                    st.caption(f"Phase: {phase_guess}")
-                if risk_flags:
-                    st.caption(f"Flags: {', '.join(risk_flags)}")
-                # Optional detailed breakdown
-                with st.expander("Show breakdown"):
-                    st.markdown("**Scores (0–5)**")
-                    for k in ["relevance","diagnostic_utility","clarity_specificity","empathy_professionalism","hipaa_ethics"]:
-                        if k in scores:
-                            st.write(f"- {k.replace('_',' ').title()}: {scores[k]}/5")
-                    st.markdown("**Reasoning**")
-                    for k in ["relevance","diagnostic_utility","clarity_specificity","empathy_professionalism","hipaa_ethics"]:
-                        if k in reasoning:
-                            st.write(f"- {k.replace('_',' ').title()}: {reasoning[k]}")
+    # One trace per turn; the background evaluation is traced separately under the same turn id.
+    user_n, n = next_message_id(), next_message_id()
+    with tracing.trace("turn", session_id=st.session_state.trace_session, turn_id=user_n, mode=st.session_state.mode) as turn_trace:
+        retriever = runtime.get_retriever()
+        llm = runtime.get_llm()
+        if st.session_state.mode == "Virtual Patient":
+            pmc = st.session_state.patient_pmc_id
+            case = st.session_state.case_context
+            if case is not None and case.pmc_id == pmc:
+                contexts = case.retrieve(prompt, top_k=top_k)
+            else:
+                contexts = retriever.retrieve(prompt, top_k=top_k, pmc_id=pmc)
+            token_stream = patient_stream(prompt, contexts, pmc)
+        else:
+            pmc = None
+            contexts = retriever.retrieve(prompt, top_k=top_k)
+            token_stream = llm.stream(prompt, contexts, use_cache=not bypass_cache)
+        runtime.get_chunk_texts().put(contexts)
+        turn = {"n": n, "role": "assistant", "contexts": chunk_refs(contexts), "question": prompt}
+        if pmc:
+            turn["pmc_id"] = pmc
+        if deferred_eval:
+            turn["eval_deferred"] = True
+        else:
+            # Scoring starts now and runs alongside the reply instead of after it.
+            turn["eval_job"] = st.session_state.eval_queue.submit(prompt, contexts, use_cache=not bypass_cache)
+        with st.chat_message("user"):
+            st.write(prompt)
+        with st.chat_message("assistant"):
+            reply, metrics = stream_reply(token_stream)
+            turn["content"] = reply
+            turn["metrics"] = metrics
+            collect_evaluations([turn])
+            render_turn_details(turn)
+        st.session_state.history.append({"n": user_n, "role": "user", "content": prompt})
+        st.session_state.history.append(turn)
+    st.session_state.last_trace = turn_trace
+    spill_history()
+
+
+@st.fragment(run_every=1.0)
+def poll_evaluations():
+    queue = st.session_state.eval_queue
+    jobs = {t["eval_job"] for t in st.session_state.history if t.get("eval_job")}
+    if any(queue.done(job) for job in jobs):
+        st.rerun()
+
+
+if any(t.get("eval_job") for t in st.session_state.history):
+    poll_evaluations()
+
+# Rendered last so it reflects the turn that just ran.
+render_trace_panel()
 
 st.markdown("---")
 st.caption("Dataset: https://huggingface.co/datasets/chaoyi-wu/PMC-CaseReport | LLM: Ollama llama3.2:3b")
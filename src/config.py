@@ -8,22 +8,96 @@ COLLECTION_NAME = os.getenv("CHROMA_COLLECTION", "pmc_casereport")
 EMBEDDING_MODEL_NAME = os.getenv(
     "EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
 )
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))   # cached query vectors
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")               # torch, int8 (dynamic-quantized torch) or onnx
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "")                # e.g. onnx/model_qint8_avx512_vnni.onnx; "" = model.onnx
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))              # encoding processes for indexing (0 = in-process)
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))              # torch threads per process (0 = cores / processes)
+EMBED_ENCODE_BATCH = int(os.getenv("EMBED_ENCODE_BATCH", "64"))   # texts per forward pass
+EMBED_MIN_COSINE = float(os.getenv("EMBED_MIN_COSINE", "0.98"))   # int8/onnx vs the fp32 model; 0 skips the check
 
 # Dataset
 HF_DATASET = os.getenv("HF_DATASET", "chaoyi-wu/PMC-CaseReport")
 HF_SPLIT = os.getenv("HF_SPLIT", "train")
+DATASET_STREAMING = os.getenv("DATASET_STREAMING", "1") == "1"          # stream from the Hub instead of downloading the split
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", "data/dataset_cache")  # Parquet shards of PMC_id/context; "" = off
+DATASET_CACHE_PART_ROWS = int(os.getenv("DATASET_CACHE_PART_ROWS", "20000"))  # rows per cached Parquet part
+DATASET_BATCH_ROWS = int(os.getenv("DATASET_BATCH_ROWS", "1000"))         # rows per column batch
+DATASET_OFFLINE = os.getenv("DATASET_OFFLINE", os.getenv("HF_DATASETS_OFFLINE", "0")) == "1"  # read the cache only
 
 # Chunking
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))          # characters
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))     # characters
 
+# Ingestion pipeline
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "2"))             # chunking processes (0 = inline)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))     # chunks per encode/write batch
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", "ingest_checkpoint.json")  # inside CHROMA_DIR
+MANIFEST_FILE = os.getenv("MANIFEST_FILE", "index_manifest.jsonl")         # inside CHROMA_DIR
+CASE_CATALOG_FILE = os.getenv("CASE_CATALOG_FILE", "case_catalog.npy")     # inside CHROMA_DIR
+
+# Vector store backend for retrieval: "chroma", or "numpy" (read-only memory-mapped export, see export_vectors.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "data/vectors")
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16")            # float16 or int8
+
 # Retrieval / Generation defaults
 DEFAULT_TOP_K = int(os.getenv("TOP_K", "4"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.2"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))          # prompt tokens for case context; 0 = unlimited
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))   # 3-gram containment; 0 keeps near-duplicates
 
 # Ollama
 OLLAMA_ENDPOINT = os.getenv("OLLAMA_ENDPOINT", "http://localhost:11434")
+# Comma-separated pool of Ollama servers (same models on each); defaults to OLLAMA_ENDPOINT alone
+OLLAMA_ENDPOINTS = [u.strip() for u in os.getenv("OLLAMA_ENDPOINTS", OLLAMA_ENDPOINT).split(",") if u.strip()]
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))              # seconds
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "16"))             # keep-alive connections
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))   # requests per endpoint at once (OLLAMA_NUM_PARALLEL)
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "64"))               # waiting requests before rejecting
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "60"))     # seconds a request may wait for a slot
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "1"))                   # retries on another endpoint after a connection error/5xx
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")                # keep the model (and its KV cache) loaded
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))                # context window for patient sessions
+
+# Virtual Patient sessions: fixed per-encounter prefix, append-only chat so Ollama reuses its KV cache
+PATIENT_SESSION = os.getenv("PATIENT_SESSION", "1") == "1"
+PATIENT_CORE_CHUNKS = int(os.getenv("PATIENT_CORE_CHUNKS", "3"))        # leading case chunks placed in the prefix
+
+# Evaluation
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "2"))      # background evaluations in flight per process
+EVAL_DEFERRED = os.getenv("EVAL_DEFERRED", "0") == "1"           # score the whole transcript at the end instead
+EVAL_COMPACT = os.getenv("EVAL_COMPACT", "1") == "1"             # schema-constrained integer scores + one rationale
+EVAL_NUM_PREDICT = int(os.getenv("EVAL_NUM_PREDICT", "160"))     # token cap per compact evaluation
+EVAL_REPAIR_RETRIES = int(os.getenv("EVAL_REPAIR_RETRIES", "1")) # follow-up calls for missing/invalid fields only
+
+# Response cache (LLM generations and evaluations)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "data/cache/responses.sqlite")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))    # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "50000"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))   # cosine; 0 disables (opt-in, e.g. 0.95)
+EVAL_SEMANTIC_CACHE = os.getenv("EVAL_SEMANTIC_CACHE", "0") == "1"               # let evaluations use the semantic tier too
+
+# Runtime (process-wide shared resources)
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+
+# Chat history: chunk references per turn, text from a shared cache; full transcripts on disk
+CHUNK_TEXT_CACHE_SIZE = int(os.getenv("CHUNK_TEXT_CACHE_SIZE", "5000"))   # chunk texts shared by all sessions
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))            # messages rendered per page
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "200"))     # older messages move to the transcript file
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "data/transcripts")
+
+# Tracing: per-stage spans per turn; TRACE_LOG appends one JSON line per trace (empty = off)
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "200"))                         # finished traces kept in memory
+
+# Headless HTTP service (python -m src.app.service)
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8600"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "4"))                 # threads for embedding / vector search
+SERVICE_MAX_ENCOUNTERS = int(os.getenv("SERVICE_MAX_ENCOUNTERS", "1000")) # open encounters kept in memory
 
 SYSTEM_PROMPT = (
     "You are a helpful virtual patient simulator for medical students. "
@@ -0,0 +1,209 @@
+from typing import Any, Dict, Iterable, Optional, Tuple
+import json
+import os
+import random
+import re
+import threading
+
+import numpy as np
+
+SPECIALTIES = [
+    "general",
+    "cardiology",
+    "neurology",
+    "oncology",
+    "infectious_disease",
+    "gastroenterology",
+    "pulmonology",
+    "nephrology",
+    "endocrinology",
+    "obstetrics_gynecology",
+    "pediatrics",
+    "rheumatology",
+    "dermatology",
+]
+
+_SPECIALTY_PATTERNS = {
+    "cardiology": r"cardi|myocard|coronary|arrhythm|atrial|ventric|endocardit|heart failure",
+    "neurology": r"seizure|stroke|neurolog|cerebr|encephal|mening|neuropath",
+    "oncology": r"tumou?r|carcinoma|cancer|lymphoma|metasta|malignan|sarcoma",
+    "infectious_disease": r"infect|sepsis|bacter|viral|tubercul|\bhiv\b|fung",
+    "gastroenterology": r"hepat|liver|pancrea|colon|gastr|bowel|biliar",
+    "pulmonology": r"pulmonar|lung|pneumon|respirator|pleura|asthma",
+    "nephrology": r"renal|kidney|nephr|dialysis",
+    "endocrinology": r"diabet|thyroid|adrenal|pituitar|insulin",
+    "obstetrics_gynecology": r"pregnan|uter|ovar|gestation|obstetric",
+    "pediatrics": r"infant|neonat|pediatric|paediatric|\bchild",
+    "rheumatology": r"lupus|arthritis|vasculitis|rheumat",
+    "dermatology": r"dermat|\bskin\b|\brash\b|cutaneous",
+}
+_COMPILED = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in _SPECIALTY_PATTERNS.items()}
+
+CATALOG_DTYPE = np.dtype([
+    ("pmc_id", "S32"),
+    ("n_chunks", "<i4"),
+    ("text_len", "<i4"),
+    ("specialty", "u1"),
+])
+
+
+def guess_specialty(text: str, scan_chars: int = 5000) -> str:
+    """
+    Coarse keyword tag used for stratified/filtered case sampling; "general" when nothing matches.
+    """
+    head = text[:scan_chars]
+    counts = {name: len(rx.findall(head)) for name, rx in _COMPILED.items()}
+    best = max(counts, key=counts.get)
+    return best if counts[best] else "general"
+
+
+class CaseCatalog:
+    """
+    Compact per-case table written at index-build time: one row per PMC_id with its
+    chunk count, text length and specialty tag, saved as a structured `.npy` that is
+    memory-mapped on load. Sampling a case is a random index into this array, so
+    "New patient" never touches Chroma and reaches every case in the index.
+    """
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self._filters: Dict[Tuple, np.ndarray] = {}
+        self._specialty_counts: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return int(self.data.shape[0])
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]]) -> "CaseCatalog":
+        rows = [
+            (
+                str(e["pmc_id"]).encode("utf-8")[:32],
+                int(e.get("n_chunks", 0)),
+                int(e.get("text_len", 0)),
+                SPECIALTIES.index(e.get("specialty") or "general"),
+            )
+            for e in entries
+        ]
+        return cls(np.array(rows, dtype=CATALOG_DTYPE))
+
+    @classmethod
+    def from_manifest(cls, manifest) -> "CaseCatalog":
+        """
+        One row per case in the index manifest; repeated PMC_ids (several rows in the
+        dataset) are summed into one case.
+        """
+        entries = []
+        for pmc_id, hashes in manifest.cases.items():
+            infos = list(hashes.values())
+            entries.append({
+                "pmc_id": pmc_id,
+                "n_chunks": sum(int(i.get("chunks", 0)) for i in infos),
+                "text_len": sum(int(i.get("chars", 0)) for i in infos),
+                "specialty": next((i["specialty"] for i in infos if i.get("specialty")), "general"),
+            })
+        return cls.from_entries(entries)
+
+    @classmethod
+    def from_collection(cls, collection, page_size: int = 5000) -> "CaseCatalog":
+        """
+        Rebuild from the chunks stored in Chroma (slow; for indexes without a manifest).
+        """
+        stats: Dict[str, Dict[str, Any]] = {}
+        offset = 0
+        while True:
+            res = collection.get(include=["metadatas", "documents"], limit=page_size, offset=offset)
+            metas = res.get("metadatas") or []
+            if not metas:
+                break
+            for meta, text in zip(metas, res.get("documents") or []):
+                pmc_id = (meta or {}).get("pmc_id")
+                if not pmc_id:
+                    continue
+                entry = stats.setdefault(pmc_id, {"pmc_id": pmc_id, "n_chunks": 0, "text_len": 0, "specialty": None})
+                entry["n_chunks"] += 1
+                entry["text_len"] += len(text or "")
+                if meta.get("chunk_index") == 0:
+                    entry["specialty"] = guess_specialty(text or "")
+            offset += len(metas)
+        return cls.from_entries(stats.values())
+
+    def save(self, path: str):
+        tmp = f"{path}.tmp.npy"
+        np.save(tmp, self.data)
+        os.replace(tmp, path)
+        with open(_sidecar(path), "w", encoding="utf-8") as f:
+            json.dump({"specialties": SPECIALTIES, "cases": len(self)}, f)
+
+    @classmethod
+    def open(cls, path: str) -> Optional["CaseCatalog"]:
+        if not os.path.exists(path):
+            return None
+        data = np.load(path, mmap_mode="r")
+        if data.dtype != CATALOG_DTYPE:
+            return None
+        return cls(data)
+
+    def specialty_counts(self) -> Dict[str, int]:
+        if self._specialty_counts is None:
+            counts = np.bincount(self.data["specialty"], minlength=len(SPECIALTIES))
+            self._specialty_counts = {name: int(counts[i]) for i, name in enumerate(SPECIALTIES) if counts[i]}
+        return self._specialty_counts
+
+    def _indices(self, specialty: Optional[str], min_chunks: Optional[int], min_chars: Optional[int]) -> np.ndarray:
+        key = (specialty, min_chunks, min_chars)
+        with self._lock:
+            cached = self._filters.get(key)
+        if cached is not None:
+            return cached
+        mask = np.ones(len(self), dtype=bool)
+        if specialty:
+            if specialty not in SPECIALTIES:
+                raise ValueError(f"unknown specialty {specialty!r}")
+            mask &= self.data["specialty"] == SPECIALTIES.index(specialty)
+        if min_chunks:
+            mask &= self.data["n_chunks"] >= min_chunks
+        if min_chars:
+            mask &= self.data["text_len"] >= min_chars
+        indices = np.flatnonzero(mask)
+        with self._lock:
+            self._filters[key] = indices
+        return indices
+
+    def sample(
+        self,
+        specialty: Optional[str] = None,
+        min_chunks: Optional[int] = None,
+        min_chars: Optional[int] = None,
+        stratified: bool = False,
+        rng: Optional[random.Random] = None,
+    ) -> Optional[str]:
+        """
+        Random PMC_id. Unfiltered sampling is a single random index; filters
+        (specialty, minimum chunks/characters) are resolved once to an index array
+        and cached. `stratified` first picks a specialty uniformly, then a case in it.
+        """
+        rng = rng or random
+        if not len(self):
+            return None
+        if stratified and not specialty:
+            present = list(self.specialty_counts().keys())
+            rng.shuffle(present)
+            for name in present:
+                found = self.sample(specialty=name, min_chunks=min_chunks, min_chars=min_chars, rng=rng)
+                if found:
+                    return found
+            return None
+        if not (specialty or min_chunks or min_chars):
+            return self._pmc_id(rng.randrange(len(self)))
+        indices = self._indices(specialty, min_chunks, min_chars)
+        if not len(indices):
+            return None
+        return self._pmc_id(int(indices[rng.randrange(len(indices))]))
+
+    def _pmc_id(self, i: int) -> str:
+        return self.data["pmc_id"][i].decode("utf-8")
+
+
+def _sidecar(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
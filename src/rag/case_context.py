@@ -0,0 +1,91 @@
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from src.config import DEFAULT_TOP_K
+from src.rag import tracing
+
+
+class CaseContext:
+    """
+    All chunks of one case held in memory with their (normalized) embeddings.
+
+    Virtual Patient turns only ever retrieve within the current case, which has a
+    handful of chunks, so ranking them with one dot product beats an HNSW query with
+    a metadata filter over the whole collection and needs no Chroma round trip.
+    Results have the same shape as ChromaRetriever.retrieve; `score` is the squared
+    L2 distance Chroma reports for normalized vectors (2 - 2·cosine), lower is closer.
+    """
+
+    def __init__(
+        self,
+        pmc_id: str,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        embeddings: np.ndarray,
+        encoder,
+    ):
+        self.pmc_id = pmc_id
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.encoder = encoder
+
+    @classmethod
+    def load(cls, store, pmc_id: str, encoder) -> "CaseContext":
+        """
+        Fetch the case's chunks from a VectorStore (one call) ordered by chunk_index.
+        """
+        ids, texts, metas, embeddings = store.get_case(pmc_id)
+        if not ids or len(embeddings) == 0:
+            return cls(pmc_id, [], [], [], np.zeros((0, encoder.dimension), dtype=np.float32), encoder)
+        order = sorted(range(len(ids)), key=lambda i: (metas[i] or {}).get("chunk_index", 0))
+        matrix = np.asarray(embeddings, dtype=np.float32)[order]
+        return cls(pmc_id, [ids[i] for i in order], [texts[i] for i in order], [metas[i] for i in order], matrix, encoder)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def leading(self, n: int) -> List[Dict[str, Any]]:
+        """
+        The case's first `n` chunks in document order (same shape as retrieve, no score).
+        """
+        return [
+            {
+                "id": self.ids[i],
+                "text": self.texts[i],
+                "pmc_id": self.pmc_id,
+                "chunk_index": (self.metadatas[i] or {}).get("chunk_index"),
+            }
+            for i in range(min(n, len(self)))
+        ]
+
+    def retrieve(self, query: str, top_k: int = DEFAULT_TOP_K) -> List[Dict[str, Any]]:
+        return self.retrieve_many([query], top_k=top_k)[0]
+
+    def retrieve_many(self, queries: Sequence[str], top_k: int = DEFAULT_TOP_K) -> List[List[Dict[str, Any]]]:
+        if not queries:
+            return []
+        if not len(self):
+            return [[] for _ in queries]
+        with tracing.span("embed", queries=len(queries)):
+            vectors = self.encoder.encode_many(queries)
+        with tracing.span("case_rank", chunks=len(self)):
+            sims = vectors @ self.embeddings.T
+        k = min(top_k, len(self))
+        out: List[List[Dict[str, Any]]] = []
+        for row in sims:
+            top = np.argsort(-row)[:k]
+            out.append([
+                {
+                    "id": self.ids[i],
+                    "text": self.texts[i],
+                    "pmc_id": self.pmc_id,
+                    "chunk_index": (self.metadatas[i] or {}).get("chunk_index"),
+                    "score": float(2.0 - 2.0 * row[i]),
+                }
+                for i in top
+            ])
+        return out
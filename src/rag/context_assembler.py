@@ -0,0 +1,172 @@
+from typing import Any, Dict, List, Optional, Set
+import logging
+import re
+
+from src.config import CHUNK_OVERLAP, CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD
+from src.rag import tracing
+
+logger = logging.getLogger(__name__)
+
+# Shortest suffix/prefix match accepted as chunk overlap when the exact overlap does not line up.
+_MIN_OVERLAP = 20
+# Passages trimmed to fit the budget are only kept if at least this many tokens remain.
+_MIN_PASSAGE_TOKENS = 48
+_WORD = re.compile(r"\w+")
+
+
+def approx_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English with a Llama tokenizer).
+    """
+    return (len(text) + 3) // 4
+
+
+def _strip_overlap(prev: str, nxt: str, overlap: int) -> str:
+    """
+    `nxt` without the leading text it shares with the end of `prev`. split_text makes
+    consecutive chunks share exactly `overlap` characters; fall back to searching
+    shorter matches in case the chunk settings changed since indexing.
+    """
+    if overlap and prev.endswith(nxt[:overlap]):
+        return nxt[overlap:]
+    for k in range(min(len(prev), len(nxt), max(overlap, _MIN_OVERLAP) * 2), _MIN_OVERLAP - 1, -1):
+        if prev.endswith(nxt[:k]):
+            return nxt[k:]
+    return nxt
+
+
+def _shingles(text: str, n: int = 3) -> Set[int]:
+    words = _WORD.findall(text.lower())
+    if len(words) < n:
+        return {hash(" ".join(words))}
+    return {hash(" ".join(words[i:i + n])) for i in range(len(words) - n + 1)}
+
+
+def _trim(text: str, tokens: int) -> str:
+    # Cut at the last sentence (or word) boundary that fits.
+    cut = text[: tokens * 4]
+    end = max(cut.rfind(". "), cut.rfind(".\n"))
+    if end > len(cut) // 2:
+        return cut[: end + 1]
+    space = cut.rfind(" ")
+    return cut[:space] if space > 0 else cut
+
+
+def merge_adjacent(contexts: List[Dict], overlap: int = CHUNK_OVERLAP) -> List[Dict[str, Any]]:
+    """
+    Join chunks of the same case with consecutive chunk_index into one passage,
+    dropping the overlap text the chunker repeated. Passages keep the rank of their
+    best-ranked chunk (first in `contexts`); `ids` lists the merged chunk ids.
+    """
+    ranked = [dict(c, _rank=i) for i, c in enumerate(contexts)]
+    by_case: Dict[Any, List[Dict]] = {}
+    for c in ranked:
+        by_case.setdefault(c.get("pmc_id"), []).append(c)
+
+    passages: List[Dict[str, Any]] = []
+    for pmc_id, chunks in by_case.items():
+        chunks.sort(key=lambda c: (c.get("chunk_index") is None, c.get("chunk_index") or 0))
+        current: Optional[Dict[str, Any]] = None
+        for c in chunks:
+            idx = c.get("chunk_index")
+            text = c.get("text") or ""
+            if current is not None and idx is not None and current["_last"] is not None:
+                if idx == current["_last"]:
+                    continue  # the same chunk retrieved twice
+                if idx == current["_last"] + 1:
+                    current["text"] += _strip_overlap(current["text"], text, overlap)
+                    current["ids"].append(c.get("id"))
+                    current["_last"] = idx
+                    current["_rank"] = min(current["_rank"], c["_rank"])
+                    if c.get("score") is not None:
+                        current["score"] = min(current.get("score", c["score"]), c["score"])
+                    continue
+            current = {
+                "id": c.get("id"),
+                "ids": [c.get("id")],
+                "pmc_id": pmc_id,
+                "chunk_index": idx,
+                "text": text,
+                "_last": idx,
+                "_rank": c["_rank"],
+            }
+            if c.get("score") is not None:
+                current["score"] = c["score"]
+            passages.append(current)
+
+    passages.sort(key=lambda p: p["_rank"])
+    for p in passages:
+        del p["_last"], p["_rank"]
+    return passages
+
+
+def drop_near_duplicates(passages: List[Dict], threshold: float = CONTEXT_DEDUP_THRESHOLD) -> List[Dict]:
+    """
+    Remove passages whose word 3-grams are at least `threshold` contained in a
+    higher-ranked passage (the dataset repeats some case text across rows, and a
+    merged span can already cover a shorter passage).
+    """
+    if threshold <= 0:
+        return passages
+    kept: List[Dict] = []
+    seen: List[Set[int]] = []
+    for p in passages:
+        sh = _shingles(p.get("text") or "")
+        duplicate = any(len(sh & other) / max(len(sh), 1) >= threshold for other in seen)
+        if not duplicate:
+            kept.append(p)
+            seen.append(sh)
+    return kept
+
+
+def _pack(passages: List[Dict[str, Any]], token_budget: int) -> List[Dict[str, Any]]:
+    packed, used = [], 0
+    for p in passages:
+        cost = approx_tokens(p["text"])
+        if used + cost <= token_budget:
+            packed.append(p)
+            used += cost
+            continue
+        remaining = token_budget - used
+        if remaining >= _MIN_PASSAGE_TOKENS:
+            packed.append(dict(p, text=_trim(p["text"], remaining), truncated=True))
+        break
+    return packed
+
+
+def assemble_contexts(
+    contexts: List[Dict],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    overlap: int = CHUNK_OVERLAP,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    Turn retrieved chunks into the passages a prompt should carry: adjacent chunks
+    merged into continuous spans, near-duplicates dropped, and the result packed in
+    rank order into `token_budget` (the passage that crosses the budget is trimmed,
+    the rest are left out). A budget of 0 disables packing.
+    """
+    if not contexts:
+        return []
+    with tracing.span("context_assembly", chunks=len(contexts)) as attrs:
+        passages = drop_near_duplicates(merge_adjacent(contexts, overlap), dedup_threshold)
+        if token_budget > 0:
+            passages = _pack(passages, token_budget)
+        attrs["passages"] = len(passages)
+    if logger.isEnabledFor(logging.INFO):
+        before = sum(approx_tokens(c.get("text") or "") for c in contexts)
+        after = sum(approx_tokens(p["text"]) for p in passages)
+        logger.info(
+            "context tokens %d -> %d (%d chunks -> %d passages, budget %d)",
+            before, after, len(contexts), len(passages), token_budget,
+        )
+    return passages
+
+
+def format_context_block(contexts: List[Dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Prompt-ready context: assembled passages, each under a `[Source: PMC_id]` header.
+    """
+    return "\n\n".join(
+        f"[Source: {p.get('pmc_id')}]\n{p.get('text')}" for p in assemble_contexts(contexts, token_budget)
+    )
@@ -1,32 +1,243 @@
-from typing import Iterable, Dict, Any, Optional
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Dict, Any, List, Optional, Tuple
+import json
 import os
+import zlib
 
-from datasets import load_dataset
+from src.config import (
+    HF_DATASET,
+    HF_SPLIT,
+    DATASET_STREAMING,
+    DATASET_CACHE_DIR,
+    DATASET_CACHE_PART_ROWS,
+    DATASET_BATCH_ROWS,
+    DATASET_OFFLINE,
+)
 
-from src.config import HF_DATASET, HF_SPLIT
+# The only dataset columns RAG needs; everything else is never downloaded into the cache.
+COLUMNS = ["PMC_id", "context"]
 
+Batch = Tuple[List[Any], List[Any]]
 
-def load_pmc_dataset(limit: Optional[int] = None, hf_token: Optional[str] = None) -> Iterable[Dict[str, Any]]:
+
+def parse_shard(spec: str) -> Tuple[int, int]:
     """
-    Stream rows from the PMC-CaseReport dataset. We read fields needed for RAG:
-    - PMC_id (string)
-    - context (case report text)
+    "i/n" -> (i, n), with 0 <= i < n.
+    """
+    try:
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/n (e.g. 0/4), got {spec!r}") from None
+    if n < 1:
+        raise ValueError(f"Shard count must be at least 1, got {spec!r}")
+    if not 0 <= i < n:
+        raise ValueError(f"Shard index must be in 0..{n - 1}, got {spec!r}")
+    return i, n
+
 
-    Optionally limit to first N rows for quick prototyping.
+def in_shard(pmc_id: str, shard: Optional[Tuple[int, int]]) -> bool:
     """
-    token = hf_token or os.getenv("HF_TOKEN") or None
-    ds = load_dataset(HF_DATASET, split=HF_SPLIT, token=token)
+    Stable assignment of a case to one of n shards (by PMC_id, so every row of a case
+    lands in the same shard and the split does not move when rows are added).
+    """
+    if shard is None:
+        return True
+    i, n = shard
+    return zlib.crc32(pmc_id.encode("utf-8")) % n == i
+
+
+class ShardCache:
+    """
+    Local copy of the dataset's PMC_id and context columns as numbered Parquet parts,
+    in source row order, plus a small JSON index of the parts. It is filled while rows
+    are streamed from the Hub, so a limited build caches only what it read; later runs
+    read the parts first and continue from the Hub where they end. Once `complete`,
+    the dataset can be read without network access.
+    """
+
+    def __init__(self, root: str = DATASET_CACHE_DIR, dataset: str = HF_DATASET, split: str = HF_SPLIT):
+        self.dir = os.path.join(root, dataset.replace("/", "__"), split)
+        self.index_path = os.path.join(self.dir, "parts.json")
+        self.dataset = dataset
+        self.split = split
+        self.meta = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"dataset": self.dataset, "split": self.split, "columns": COLUMNS, "parts": [], "complete": False}
+
+    def _save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.index_path)
+
+    @property
+    def rows(self) -> int:
+        return sum(p["rows"] for p in self.meta["parts"])
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.meta["complete"])
+
+    def clear(self):
+        for part in self.meta["parts"]:
+            path = os.path.join(self.dir, part["file"])
+            if os.path.exists(path):
+                os.remove(path)
+        self.meta = dict(self.meta, parts=[], complete=False)
+        self._save()
+
+    def batches(self, batch_size: int = DATASET_BATCH_ROWS) -> Iterator[Batch]:
+        """
+        Cached rows as (PMC_id list, context list) column batches.
+        """
+        import pyarrow.parquet as pq
+
+        for part in self.meta["parts"]:
+            pf = pq.ParquetFile(os.path.join(self.dir, part["file"]))
+            for rb in pf.iter_batches(batch_size=batch_size, columns=COLUMNS):
+                yield rb.column(0).to_pylist(), rb.column(1).to_pylist()
+
+    @contextmanager
+    def appender(self, part_rows: int = DATASET_CACHE_PART_ROWS):
+        """
+        Yield an `append(ids, contexts)` function that buffers rows and writes a part
+        every `part_rows`. The buffer is flushed when the block exits, however it
+        exits (an early stop under --limit keeps what was read); call
+        `append.finish()` after the last source batch to mark the cache complete.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buffer: Dict[str, List[Any]] = {c: [] for c in COLUMNS}
 
+        def flush():
+            n = len(buffer[COLUMNS[0]])
+            if not n:
+                return
+            name = f"part-{len(self.meta['parts']):05d}.parquet"
+            os.makedirs(self.dir, exist_ok=True)
+            tmp = os.path.join(self.dir, f"{name}.tmp")
+            table = pa.table({c: pa.array(buffer[c], type=pa.string()) for c in COLUMNS})
+            pq.write_table(table, tmp)
+            os.replace(tmp, os.path.join(self.dir, name))
+            self.meta["parts"].append({"file": name, "rows": n})
+            self._save()
+            for c in COLUMNS:
+                buffer[c].clear()
+
+        def append(ids: List[Any], contexts: List[Any]):
+            buffer["PMC_id"].extend(None if v is None else str(v) for v in ids)
+            buffer["context"].extend(None if v is None else str(v) for v in contexts)
+            if len(buffer["PMC_id"]) >= part_rows:
+                flush()
+
+        def finish():
+            flush()
+            self.meta["complete"] = True
+            self._save()
+
+        append.finish = finish
+        try:
+            yield append
+        finally:
+            flush()
+
+
+def _hub_batches(start: int, batch_size: int, streaming: bool, token: Optional[str]) -> Iterator[Batch]:
+    from datasets import load_dataset
+
+    ds = load_dataset(HF_DATASET, split=HF_SPLIT, token=token, streaming=streaming).select_columns(COLUMNS)
+    if start:
+        ds = ds.skip(start) if streaming else ds.select(range(start, len(ds)))
+    for batch in ds.iter(batch_size=batch_size):
+        yield batch["PMC_id"], batch["context"]
+
+
+def _source_batches(
+    cache: Optional[ShardCache], streaming: bool, offline: bool, token: Optional[str], batch_size: int
+) -> Iterator[Batch]:
+    if cache is not None:
+        yield from cache.batches(batch_size)
+        if cache.complete:
+            return
+    if offline:
+        if cache is None or not cache.rows:
+            where = cache.dir if cache is not None else "(cache disabled)"
+            raise RuntimeError(f"Offline mode and no cached dataset rows in {where}; run once online first")
+        return  # offline with a partial cache: only what was cached
+    start = cache.rows if cache is not None else 0
+    if cache is None:
+        yield from _hub_batches(start, batch_size, streaming, token)
+        return
+    with cache.appender() as append:
+        for ids, contexts in _hub_batches(start, batch_size, streaming, token):
+            append(ids, contexts)
+            yield ids, contexts
+        append.finish()
+
+
+def iter_pmc_batches(
+    limit: Optional[int] = None,
+    hf_token: Optional[str] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    streaming: bool = DATASET_STREAMING,
+    offline: bool = DATASET_OFFLINE,
+    cache_dir: Optional[str] = DATASET_CACHE_DIR,
+    batch_size: int = DATASET_BATCH_ROWS,
+) -> Iterator[Tuple[List[str], List[str]]]:
+    """
+    Column batches (PMC_id list, context list) of usable rows: rows missing either
+    field are dropped, `shard` (i, n) keeps only this shard's cases, and `limit`
+    caps the rows returned (after sharding). Rows come from the local shard cache
+    first, then from the Hub (streamed unless `streaming` is False), filling the
+    cache as they arrive; `offline` reads the cache only.
+    """
+    token = hf_token or os.getenv("HF_TOKEN") or None
+    cache = ShardCache(cache_dir) if cache_dir else None
     count = 0
-    for row in ds:  # Hugging Face returns dict-like rows
-        pmc_id = row.get("PMC_id")
-        context = row.get("context")
-        if not pmc_id or not context:
-            continue
-        yield {
-            "pmc_id": str(pmc_id),
-            "context": str(context),
-        }
-        count += 1
+    for ids, contexts in _source_batches(cache, streaming, offline, token, batch_size):
+        keep_ids: List[str] = []
+        keep_contexts: List[str] = []
+        for pmc_id, context in zip(ids, contexts):
+            if not pmc_id or not context:
+                continue
+            pmc_id = str(pmc_id)
+            if in_shard(pmc_id, shard):
+                keep_ids.append(pmc_id)
+                keep_contexts.append(str(context))
+        if limit is not None:
+            keep_ids, keep_contexts = keep_ids[: limit - count], keep_contexts[: limit - count]
+        if keep_ids:
+            count += len(keep_ids)
+            yield keep_ids, keep_contexts
         if limit is not None and count >= limit:
-            break
+            return
+
+
+def load_pmc_dataset(
+    limit: Optional[int] = None,
+    hf_token: Optional[str] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    streaming: bool = DATASET_STREAMING,
+    offline: bool = DATASET_OFFLINE,
+    cache_dir: Optional[str] = DATASET_CACHE_DIR,
+) -> Iterable[Dict[str, Any]]:
+    """
+    Stream rows from the PMC-CaseReport dataset. We read fields needed for RAG:
+    - PMC_id (string)
+    - context (case report text)
+
+    Optionally limit to first N rows for quick prototyping; see `iter_pmc_batches`
+    for sharding, the local cache and offline use.
+    """
+    for ids, contexts in iter_pmc_batches(limit, hf_token, shard, streaming, offline, cache_dir):
+        for pmc_id, context in zip(ids, contexts):
+            yield {
+                "pmc_id": pmc_id,
+                "context": context,
+            }
@@ -0,0 +1,283 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from src.config import (
+    EMBEDDING_MODEL_NAME,
+    QUERY_CACHE_SIZE,
+    EMBED_BACKEND,
+    EMBED_ONNX_FILE,
+    EMBED_WORKERS,
+    EMBED_THREADS,
+    EMBED_ENCODE_BATCH,
+    EMBED_MIN_COSINE,
+)
+
+BACKENDS = ("torch", "int8", "onnx")
+
+# Fixed texts for the fidelity check of approximate backends: short questions and chunk-length passages.
+FIDELITY_TEXTS = [
+    "What brings you in today?",
+    "Do you have any allergies to medications?",
+    "When did the chest pain start, and does it spread anywhere?",
+    "Any family history of heart disease or diabetes?",
+    "A 54-year-old man presented with a two-day history of progressive dyspnea, orthopnea and bilateral "
+    "lower-extremity edema. He had a history of hypertension and type 2 diabetes mellitus treated with "
+    "metformin. Examination revealed jugular venous distension and bibasilar crackles.",
+    "Laboratory studies showed a hemoglobin of 9.8 g/dL, elevated lactate dehydrogenase and a low haptoglobin. "
+    "The peripheral smear demonstrated schistocytes, and the platelet count was 42,000 per microliter.",
+    "Magnetic resonance imaging of the brain revealed a ring-enhancing lesion in the left parietal lobe with "
+    "surrounding vasogenic edema. The patient was started on dexamethasone and referred for stereotactic biopsy.",
+    "The rash began on the trunk and spread to the extremities over three days, sparing the palms and soles.",
+]
+
+
+def load_model(model_name: str, backend: str = "torch", onnx_file: str = "", threads: int = 0):
+    """
+    SentenceTransformer for `backend`: "torch" as is, "int8" with its Linear layers
+    dynamically quantized (CPU), "onnx" through ONNX Runtime (sentence-transformers
+    >= 3.2 with its onnx extra; `onnx_file` picks e.g. a pre-quantized export).
+    """
+    import torch
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r} (expected one of {', '.join(BACKENDS)})")
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if backend == "onnx":
+        try:
+            return SentenceTransformer(
+                model_name, device="cpu", backend="onnx", model_kwargs={"file_name": onnx_file} if onnx_file else None
+            )
+        except TypeError:
+            raise RuntimeError("EMBED_BACKEND=onnx needs sentence-transformers>=3.2 (pip install 'sentence-transformers[onnx]')") from None
+    if backend == "int8":
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return SentenceTransformer(model_name)
+
+
+def _dimension_of(model) -> int:
+    # Renamed to get_embedding_dimension in sentence-transformers 5.
+    get = getattr(model, "get_embedding_dimension", None) or model.get_sentence_embedding_dimension
+    return int(get())
+
+
+# Model of an encoding worker process, loaded once by its initializer.
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, onnx_file: str, threads: int):
+    global _worker_model
+    _worker_model = load_model(model_name, backend, onnx_file, threads)
+
+
+def _encode_in_worker(texts: List[str], batch_size: int, normalize: bool) -> np.ndarray:
+    return _worker_model.encode(
+        texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=normalize
+    ).astype(np.float32)
+
+
+def _dimension_in_worker() -> int:
+    return _dimension_of(_worker_model)
+
+
+class EmbeddingEngine:
+    """
+    The embedder used for both indexing and queries, with the `encode` /
+    `get_sentence_embedding_dimension` interface of SentenceTransformer.
+
+    Texts are sorted by length before batching, so each forward pass pads to similar
+    lengths. With `workers` > 0, large inputs are split into length-sorted slices of
+    at most one batch and spread over a pool of processes, each holding its own copy
+    of the model and `threads` torch threads. `backend` "int8" or "onnx" trades a
+    little accuracy for CPU speed; unless `min_cosine` is 0 the engine checks on
+    start-up that its vectors stay within `min_cosine` of the fp32 model's.
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        backend: str = EMBED_BACKEND,
+        workers: int = EMBED_WORKERS,
+        threads: int = EMBED_THREADS,
+        batch_size: int = EMBED_ENCODE_BATCH,
+        onnx_file: str = EMBED_ONNX_FILE,
+        min_cosine: float = EMBED_MIN_COSINE,
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = max(0, workers)
+        self.batch_size = batch_size
+        cores = os.cpu_count() or 1
+        self.threads = threads if threads > 0 else max(1, cores // max(1, self.workers))
+        self.model = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.workers:
+            # Spawned, not forked: torch thread pools do not survive fork.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, backend, onnx_file, self.threads),
+            )
+        else:
+            self.model = load_model(model_name, backend, onnx_file, threads)
+        self._dimension: Optional[int] = None
+        self.fidelity: Optional[Dict[str, Any]] = None
+        if backend != "torch" and min_cosine > 0:
+            self.verify(min_cosine)
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = True,
+        batch_size: Optional[int] = None,
+        **kwargs,
+    ) -> np.ndarray:
+        """
+        (n, dim) float32 array in input order.
+        """
+        texts = list(texts)
+        batch_size = batch_size or self.batch_size
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        ordered = [texts[i] for i in order]
+        if self.model is not None:
+            vectors = self.model.encode(
+                ordered, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=normalize_embeddings
+            ).astype(np.float32)
+        else:
+            step = max(1, min(batch_size, -(-len(ordered) // self.workers)))
+            futures = [
+                self._pool.submit(_encode_in_worker, ordered[i:i + step], batch_size, normalize_embeddings)
+                for i in range(0, len(ordered), step)
+            ]
+            vectors = np.vstack([f.result() for f in futures])
+        out = np.empty_like(vectors)
+        out[order] = vectors
+        return out
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dimension is None:
+            if self.model is not None:
+                self._dimension = _dimension_of(self.model)
+            else:
+                self._dimension = self._pool.submit(_dimension_in_worker).result()
+        return self._dimension
+
+    def verify(self, min_cosine: float = EMBED_MIN_COSINE, texts: Sequence[str] = FIDELITY_TEXTS) -> Dict[str, Any]:
+        """
+        Compare this engine's vectors with the fp32 reference model on `texts`; raise
+        if any cosine similarity falls below `min_cosine`.
+        """
+        reference = SentenceTransformer(self.model_name, device="cpu")
+        expected = reference.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+        got = self.encode(texts)
+        cosines = np.sum(expected * got, axis=1)
+        self.fidelity = {
+            "backend": self.backend,
+            "min_cosine": float(cosines.min()),
+            "mean_cosine": float(cosines.mean()),
+            "threshold": min_cosine,
+        }
+        if self.fidelity["min_cosine"] < min_cosine:
+            raise RuntimeError(
+                f"Embedding backend {self.backend!r} drifts from {self.model_name}: "
+                f"min cosine {self.fidelity['min_cosine']:.4f} < {min_cosine} (lower EMBED_MIN_COSINE or use torch)"
+            )
+        return self.fidelity
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class QueryEncoder:
+    """
+    Encodes retrieval queries with the same SentenceTransformer the index was built with.
+    Vectors are normalized (as in ChromaIndexer) and kept in an LRU cache keyed by the
+    normalized query text, so repeated questions skip the forward pass entirely.
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        model: Optional[SentenceTransformer] = None,
+        cache_size: int = QUERY_CACHE_SIZE,
+    ):
+        self.model_name = model_name
+        # Queries are short and latency-bound: encode in-process, no pool.
+        self.model = model or EmbeddingEngine(model_name, workers=0)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, query: str) -> np.ndarray:
+        return self.encode_many([query])[0]
+
+    def encode_many(self, queries: Sequence[str]) -> np.ndarray:
+        """
+        Return an (n, dim) float32 array. Cache misses are encoded together in one batch.
+        """
+        keys = [normalize_query(q) for q in queries]
+        found: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for key in keys:
+                vec = self._cache.get(key)
+                if vec is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                found.append(vec)
+
+        # The first query seen for each uncached key is encoded as written; the
+        # normalized key only decides which queries share a vector.
+        missing: Dict[str, str] = {}
+        for query, key, vec in zip(queries, keys, found):
+            if vec is None:
+                missing.setdefault(key, query)
+        if missing:
+            vectors = self.model.encode(list(missing.values()), convert_to_numpy=True, normalize_embeddings=True)
+            encoded = dict(zip(missing, vectors.astype(np.float32)))
+            with self._lock:
+                for key, vec in encoded.items():
+                    self._cache[key] = vec
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            found = [v if v is not None else encoded[k] for k, v in zip(keys, found)]
+
+        return np.vstack(found) if found else np.zeros((0, self.dimension), dtype=np.float32)
+
+    @property
+    def dimension(self) -> int:
+        return int(self.model.get_sentence_embedding_dimension())
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            size = len(self._cache)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "capacity": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
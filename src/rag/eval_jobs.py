@@ -0,0 +1,76 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+import threading
+import uuid
+
+from src.rag import tracing
+from src.rag.evaluator import evaluate_question, evaluate_transcript, fallback_evaluation
+
+
+class EvaluationQueue:
+    """
+    Background evaluation jobs for one chat session.
+
+    Jobs run on a process-wide executor whose worker count caps how many evaluator
+    generations hit Ollama at once, whatever the number of sessions. The queue only
+    tracks this session's futures so the UI can poll for finished results.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+        self._jobs: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, fn: Callable[..., Any], *args) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        # Traced separately (the turn's trace closes before scoring ends), under the same session and turn.
+        future = self.executor.submit(tracing.run_traced, "evaluation", fn, *args, parent=tracing.current())
+        with self._lock:
+            self._jobs[job_id] = future
+        return job_id
+
+    def submit(self, question: str, contexts: List[Dict], use_cache: bool = True) -> str:
+        return self._submit(evaluate_question, question, list(contexts), use_cache)
+
+    def submit_transcript(self, questions: List[str], contexts: List[Dict]) -> str:
+        return self._submit(evaluate_transcript, list(questions), list(contexts))
+
+    def done(self, job_id: str) -> bool:
+        future = self._jobs.get(job_id)
+        return future is None or future.done()
+
+    def result(self, job_id: str) -> Optional[Any]:
+        """
+        Finished result, or None while the job is still queued or running.
+        A job that raised yields a fallback evaluation flagged `eval_error`.
+        """
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is None or not future.done():
+            return None
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        if future.cancelled():
+            return fallback_evaluation("eval_cancelled", "Evaluation was cancelled.")
+        exc = future.exception()
+        if exc is not None:
+            return fallback_evaluation("eval_error", f"Evaluation failed: {exc}")
+        return future.result()
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return any(not f.done() for f in self._jobs.values())
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for f in self._jobs.values() if not f.done())
+
+    def cancel_all(self):
+        """
+        Drop jobs that have not started yet (e.g. when the session resets). Jobs
+        already talking to Ollama run to completion and are discarded.
+        """
+        with self._lock:
+            for future in self._jobs.values():
+                future.cancel()
+            self._jobs.clear()
@@ -1,75 +1,478 @@
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Tuple
+import asyncio
 import json
-import requests
 
-from src.config import OLLAMA_ENDPOINT, OLLAMA_MODEL, ETHICS_POLICY
+from src.config import (
+    OLLAMA_MODEL,
+    OLLAMA_KEEP_ALIVE,
+    ETHICS_POLICY,
+    EVAL_COMPACT,
+    EVAL_NUM_PREDICT,
+    EVAL_REPAIR_RETRIES,
+    EVAL_SEMANTIC_CACHE,
+)
+from src.rag import ollama_client, tracing
+from src.rag.context_assembler import format_context_block
+from src.rag.response_cache import ResponseCache, get_cache, case_of
+from src.rag.scheduler import PRIORITY_EVALUATION, PRIORITY_BATCH, get_scheduler
 
+# Bump when the evaluation prompt or schema changes so cached scores are not reused.
+EVAL_PROMPT_VERSION = "3"
 
-def _ollama_generate(prompt: str, temperature: float = 0.1) -> str:
-    resp = requests.post(
-        f"{OLLAMA_ENDPOINT.rstrip('/')}/api/generate",
-        json={"model": OLLAMA_MODEL, "prompt": prompt, "temperature": temperature, "stream": False},
-        timeout=120,
+
+def _ollama_generate(prompt: str, temperature: float = 0.1, priority: int = PRIORITY_EVALUATION) -> str:
+    data = get_scheduler().generate(
+        {"model": OLLAMA_MODEL, "prompt": prompt, "temperature": temperature, "stream": False},
+        priority=priority,
     )
-    resp.raise_for_status()
-    return resp.json().get("response", "")
+    return data.get("response", "")
 
 
-def build_context_block(contexts: List[Dict]) -> str:
-    return "\n\n".join([f"[Source: {c.get('pmc_id')}]\n{c.get('text')}" for c in contexts])
+def _generate_json(payload: Dict[str, Any], priority: int = PRIORITY_EVALUATION) -> Any:
+    return _loads(get_scheduler().generate(payload, priority=priority).get("response", ""))
 
 
-def evaluate_question(question: str, contexts: List[Dict]) -> Dict:
-    """
-    Evaluate a student's question against a rubric using the provided retrieval contexts.
-    Returns a dict with scores, reasoning, phase_guess, risk_flags.
-    (No guardrails; pure feedback only.)
-    """
-    context_block = build_context_block(contexts)
-    prompt = f"""System: You are a clinical educator evaluating a medical student's question to a virtual patient.
-Use the RAG context (case snippets) and the policy below. Score 0–5 for each criterion.
-Explain briefly why. Return ONLY JSON following the schema.
+def _loads(raw: str) -> Any:
+    try:
+        return json.loads(raw)
+    except Exception:
+        return None
 
-Policy:
-{ETHICS_POLICY}
 
-Case context:
-{context_block}
+CRITERIA = ["relevance", "diagnostic_utility", "clarity_specificity", "empathy_professionalism", "hipaa_ethics"]
 
-Student question:
-{question}
+# Weights of the overall score (criteria missing from a result are left out of the average).
+RUBRIC_WEIGHTS = {
+    "relevance": 0.30,
+    "diagnostic_utility": 0.30,
+    "clarity_specificity": 0.20,
+    "empathy_professionalism": 0.10,
+    "hipaa_ethics": 0.10,
+}
+# Lowest overall score for each band, best first.
+BANDS = [(4.5, "Excellent"), (3.5, "Good"), (2.5, "Needs focus"), (0.0, "Off-track")]
 
-JSON schema (fill all fields with appropriate values):
-{{
-  "scores": {{
+# Enumerations for the compact output.
+PHASES = [
+    "introduction", "chief_complaint", "hpi", "pmh", "medications", "allergies", "family_history",
+    "social_history", "ros", "exam", "diagnosis_plan", "closing", "other",
+]
+FLAG_CODES = [
+    "leading_question", "multiple_questions", "medical_jargon", "closed_question", "privacy_risk",
+    "unprofessional_tone", "off_topic", "unsafe_advice",
+]
+# Every field a compact result must carry; missing ones are requested again by name.
+COMPACT_FIELDS = [f"scores.{c}" for c in CRITERIA] + ["rationale", "phase", "flags"]
+
+EVAL_SCHEMA = """{
+  "scores": {
     "relevance": 0,
     "diagnostic_utility": 0,
     "clarity_specificity": 0,
     "empathy_professionalism": 0,
     "hipaa_ethics": 0
-  }},
-  "reasoning": {{
+  },
+  "reasoning": {
     "relevance": "",
     "diagnostic_utility": "",
     "clarity_specificity": "",
     "empathy_professionalism": "",
     "hipaa_ethics": ""
-  }},
+  },
   "phase_guess": "",
   "risk_flags": []
-}}
+}"""
+
+
+def compact_schema(fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    JSON schema passed as Ollama's `format` so generation is constrained to integer
+    scores, one short rationale and enumerated phase and flag codes. `fields` (names
+    from COMPACT_FIELDS) restricts it to the fields a repair call should fill.
+    """
+    fields = fields or COMPACT_FIELDS
+    criteria = [f.split(".", 1)[1] for f in fields if f.startswith("scores.")]
+    properties: Dict[str, Any] = {}
+    if criteria:
+        properties["scores"] = {
+            "type": "object",
+            "properties": {c: {"type": "integer", "minimum": 0, "maximum": 5} for c in criteria},
+            "required": criteria,
+        }
+    if "rationale" in fields:
+        properties["rationale"] = {"type": "string", "maxLength": 200}
+    if "phase" in fields:
+        properties["phase"] = {"type": "string", "enum": PHASES}
+    if "flags" in fields:
+        properties["flags"] = {"type": "array", "items": {"type": "string", "enum": FLAG_CODES}}
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+def build_context_block(contexts: List[Dict]) -> str:
+    return format_context_block(contexts)
+
+
+def _evaluation_prompt(question: str, contexts: List[Dict]) -> str:
+    context_block = build_context_block(contexts)
+    return f"""System: You are a clinical educator evaluating a medical student's question to a virtual patient.
+Use the RAG context (case snippets) and the policy below. Score 0–5 for each criterion.
+Explain briefly why. Return ONLY JSON following the schema.
+
+Policy:
+{ETHICS_POLICY}
+
+Case context:
+{context_block}
+
+Student question:
+{question}
+
+JSON schema (fill all fields with appropriate values):
+{EVAL_SCHEMA}
+"""
+
+
+def _compact_prompt(
+    question: str, contexts: List[Dict], fields: Optional[List[str]] = None, partial: Optional[Dict] = None
+) -> str:
+    prompt = f"""System: You are a clinical educator scoring a medical student's question to a virtual patient.
+Use the case context and the policy below. Score each criterion 0–5: {", ".join(CRITERIA)}.
+Give one short rationale (at most 25 words), the interview phase, and any flags (empty list if none).
+
+Policy:
+{ETHICS_POLICY}
+
+Case context:
+{build_context_block(contexts)}
+
+Student question:
+{question}
+"""
+    if fields:
+        # Appended after the unchanged prompt so Ollama can reuse the cached prefix.
+        prompt += f"\nAlready answered: {json.dumps(partial or {})}\nReturn only: {', '.join(fields)}.\n"
+    return prompt
+
+
+def _compact_payload(
+    question: str, contexts: List[Dict], fields: Optional[List[str]] = None, partial: Optional[Dict] = None
+) -> Dict[str, Any]:
+    return {
+        "model": OLLAMA_MODEL,
+        "prompt": _compact_prompt(question, contexts, fields, partial),
+        "format": compact_schema(fields),
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {"temperature": 0.1, "num_predict": EVAL_NUM_PREDICT},
+        "stream": False,
+    }
+
+
+def overall_score(scores: Dict[str, Any], weights: Dict[str, float] = RUBRIC_WEIGHTS) -> float:
+    """
+    Weighted mean of the 0–5 criterion scores present in `scores`.
+    """
+    overall = total = 0.0
+    for k, w in weights.items():
+        try:
+            overall += float(scores[k]) * w
+            total += w
+        except (KeyError, TypeError, ValueError):
+            continue
+    return overall / total if total > 0 else 0.0
+
+
+def score_band(overall: float) -> str:
+    return next(name for floor, name in BANDS if overall >= floor)
+
+
+def with_overall(evaluation: Dict) -> Dict:
+    """
+    The evaluation with `overall` (weighted by RUBRIC_WEIGHTS) and its `band` added.
+    """
+    overall = overall_score(evaluation.get("scores") or {})
+    return dict(evaluation, overall=round(overall, 2), band=score_band(overall))
+
+
+def fallback_evaluation(flag: str, reason: str) -> Dict:
+    return with_overall({
+        "scores": {k: 3 for k in CRITERIA},
+        "reasoning": {k: reason for k in CRITERIA},
+        "rationale": reason,
+        "phase_guess": "hpi",
+        "risk_flags": [flag],
+    })
+
+
+def _as_score(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    try:
+        score = int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+    return score if 0 <= score <= 5 else None
+
+
+def validate_evaluation(data: Any) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Split a compact result into its valid fields (scores rounded to integers, those
+    outside 0–5 treated as invalid; unknown flag codes dropped) and the names of the fields that are missing or
+    invalid, from COMPACT_FIELDS.
+    """
+    data = data if isinstance(data, dict) else {}
+    valid: Dict[str, Any] = {"scores": {}}
+    missing: List[str] = []
+    scores = data.get("scores") if isinstance(data.get("scores"), dict) else {}
+    for c in CRITERIA:
+        score = _as_score(scores.get(c))
+        if score is None:
+            missing.append(f"scores.{c}")
+        else:
+            valid["scores"][c] = score
+    rationale = data.get("rationale")
+    if isinstance(rationale, str) and rationale.strip():
+        valid["rationale"] = rationale.strip()[:300]
+    else:
+        missing.append("rationale")
+    if data.get("phase") in PHASES:
+        valid["phase"] = data["phase"]
+    else:
+        missing.append("phase")
+    if isinstance(data.get("flags"), list):
+        valid["flags"] = [f for f in data["flags"] if f in FLAG_CODES]
+    else:
+        missing.append("flags")
+    return valid, missing
+
+
+def _merge(valid: Dict[str, Any], repair: Any) -> Dict[str, Any]:
+    merged = dict(valid, scores=dict(valid.get("scores") or {}))
+    if isinstance(repair, dict):
+        if isinstance(repair.get("scores"), dict):
+            merged["scores"].update(repair["scores"])
+        merged.update({k: v for k, v in repair.items() if k != "scores"})
+    return merged
+
+
+def _finish(valid: Dict[str, Any], missing: List[str]) -> Dict:
+    # Fields still missing after the repair get neutral defaults and the result is flagged.
+    flags = list(valid.get("flags") or [])
+    if missing:
+        flags.append("eval_incomplete")
+    return with_overall({
+        "scores": {c: valid["scores"].get(c, 3) for c in CRITERIA},
+        "rationale": valid.get("rationale", ""),
+        "phase_guess": valid.get("phase", "other"),
+        "risk_flags": flags,
+    })
+
+
+def parse_evaluation(raw: str) -> Dict:
+    """
+    Evaluation dict from the model's raw text, compact or verbose; unparseable text
+    yields the all-3 fallback flagged `parse_error`.
+    """
+    data = _loads(raw)
+    if not isinstance(data, dict):
+        return fallback_evaluation("parse_error", "Auto-fallback (could not parse JSON).")
+    if "reasoning" not in data and "risk_flags" not in data:
+        return _finish(*validate_evaluation(data))
+    return with_overall(data)
+
+
+def _evaluate_compact(question: str, contexts: List[Dict]) -> Dict:
+    valid, missing = validate_evaluation(_generate_json(_compact_payload(question, contexts)))
+    for _ in range(EVAL_REPAIR_RETRIES):
+        if not missing:
+            break
+        with tracing.span("evaluate_repair", fields=len(missing)):
+            repair = _generate_json(_compact_payload(question, contexts, missing, valid))
+        valid, missing = validate_evaluation(_merge(valid, repair))
+    return _finish(valid, missing)
+
+
+async def _evaluate_compact_async(question: str, contexts: List[Dict], scheduler) -> Dict:
+    async def generate_json(payload: Dict[str, Any]) -> Any:
+        data = await scheduler.generate(payload, priority=PRIORITY_EVALUATION)
+        return _loads(data.get("response", ""))
+
+    valid, missing = validate_evaluation(await generate_json(_compact_payload(question, contexts)))
+    for _ in range(EVAL_REPAIR_RETRIES):
+        if not missing:
+            break
+        with tracing.span("evaluate_repair", fields=len(missing)):
+            repair = await generate_json(_compact_payload(question, contexts, missing, valid))
+        valid, missing = validate_evaluation(_merge(valid, repair))
+    return _finish(valid, missing)
+
+
+def _eval_cache_entry(question: str, contexts: List[Dict]) -> Tuple[ResponseCache, str, str, Optional[str]]:
+    scope = ResponseCache.scope("evaluation", OLLAMA_MODEL, EVAL_PROMPT_VERSION, 0.1, compact=EVAL_COMPACT)
+    context_ids = [c.get("id") or f"{c.get('pmc_id')}:{c.get('chunk_index')}" for c in contexts]
+    return get_cache(), scope, ResponseCache.make_key(scope, context_ids, question), case_of(contexts)
+
+
+def _cached_evaluation(entry, question: str) -> Optional[Dict]:
+    cache, scope, key, pmc_id = entry
+    # The semantic tier ignores the contexts and would reuse scores across paraphrases.
+    cached = cache.get(scope, key, question, pmc_id, semantic=EVAL_SEMANTIC_CACHE)
+    return json.loads(cached) if cached is not None else None
+
+
+def _store_evaluation(entry, question: str, result: Dict):
+    cache, scope, key, pmc_id = entry
+    if not {"parse_error", "eval_incomplete"} & set(result.get("risk_flags") or []):
+        cache.put(scope, key, json.dumps(result), question, pmc_id, semantic=EVAL_SEMANTIC_CACHE)
+
+
+def evaluate_question(question: str, contexts: List[Dict], use_cache: bool = True) -> Dict:
+    """
+    Evaluate a student's question against a rubric using the provided retrieval contexts.
+    Returns a dict with scores, reasoning, phase_guess, risk_flags.
+    (No guardrails; pure feedback only.)
+    """
+    with tracing.span("evaluate") as attrs:
+        entry = _eval_cache_entry(question, contexts) if use_cache else None
+        if entry is not None:
+            cached = _cached_evaluation(entry, question)
+            attrs["cached"] = cached is not None
+            if cached is not None:
+                return cached
+        if EVAL_COMPACT:
+            result = _evaluate_compact(question, contexts)
+        else:
+            result = parse_evaluation(_ollama_generate(_evaluation_prompt(question, contexts), temperature=0.1))
+        attrs["flags"] = result.get("risk_flags")
+        if entry is not None:
+            _store_evaluation(entry, question, result)
+        return result
+
+
+async def evaluate_question_async(question: str, contexts: List[Dict], scheduler, use_cache: bool = True) -> Dict:
+    """
+    `evaluate_question` for the async service: the Ollama call goes through the given
+    AsyncOllamaScheduler and the SQLite cache is read and written off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with tracing.span("evaluate") as attrs:
+        entry = _eval_cache_entry(question, contexts) if use_cache else None
+        if entry is not None:
+            cached = await loop.run_in_executor(None, _cached_evaluation, entry, question)
+            attrs["cached"] = cached is not None
+            if cached is not None:
+                return cached
+        if EVAL_COMPACT:
+            result = await _evaluate_compact_async(question, contexts, scheduler)
+        else:
+            data = await scheduler.generate(
+                {"model": OLLAMA_MODEL, "prompt": _evaluation_prompt(question, contexts), "temperature": 0.1, "stream": False},
+                priority=PRIORITY_EVALUATION,
+            )
+            result = parse_evaluation(data.get("response", ""))
+        attrs["flags"] = result.get("risk_flags")
+        if entry is not None:
+            await loop.run_in_executor(None, _store_evaluation, entry, question, result)
+        return result
+
+
+def stream_evaluation(question: str, contexts: List[Dict]) -> ollama_client.TokenStream:
+    """
+    Streaming variant of `evaluate_question`: yields raw JSON tokens as they are
+    generated. Pass the finished stream's `.text` to `parse_evaluation` for the dict
+    (no repair call on this path).
+    """
+    if EVAL_COMPACT:
+        payload = _compact_payload(question, contexts)
+    else:
+        payload = {"model": OLLAMA_MODEL, "prompt": _evaluation_prompt(question, contexts), "temperature": 0.1}
+    return get_scheduler().stream(payload, priority=PRIORITY_EVALUATION)
+
+
+def _transcript_prompt(questions: List[str], contexts: List[Dict]) -> str:
+    context_block = build_context_block(contexts)
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, start=1))
+    return f"""System: You are a clinical educator reviewing a medical student's full interview with a virtual patient.
+Use the RAG context (case snippets) and the policy below. Score 0–5 for each criterion, for EACH question.
+Explain briefly why. Return ONLY a JSON array with one object per question, in order.
+
+Policy:
+{ETHICS_POLICY}
+
+Case context:
+{context_block}
+
+Student questions:
+{numbered}
+
+JSON schema of each array element (fill all fields with appropriate values):
+{EVAL_SCHEMA}
 """
-    raw = _ollama_generate(prompt, temperature=0.1)
+
+
+def evaluate_transcript(questions: List[str], contexts: List[Dict]) -> List[Dict]:
+    """
+    Deferred evaluation: score a whole encounter in one LLM call instead of one call
+    per question. `contexts` is the pooled case context for the encounter. Returns
+    one evaluation dict per question, in order; unparseable entries fall back as in
+    `evaluate_question`.
+    """
+    if not questions:
+        return []
+    if EVAL_COMPACT:
+        return _evaluate_transcript_compact(questions, contexts)
+    with tracing.span("evaluate_transcript", questions=len(questions)):
+        raw = _ollama_generate(_transcript_prompt(questions, contexts), temperature=0.1, priority=PRIORITY_BATCH)
     try:
-        return json.loads(raw)
+        parsed = json.loads(raw)
     except Exception:
-        return {
-            "scores": {k: 3 for k in [
-                "relevance","diagnostic_utility","clarity_specificity","empathy_professionalism","hipaa_ethics"
-            ]},
-            "reasoning": {k: "Auto-fallback (could not parse JSON)." for k in [
-                "relevance","diagnostic_utility","clarity_specificity","empathy_professionalism","hipaa_ethics"
-            ]},
-            "phase_guess": "hpi",
-            "risk_flags": ["parse_error"]
-        }
+        parsed = None
+    if isinstance(parsed, dict):
+        # Some models wrap the array in an object.
+        parsed = next((v for v in parsed.values() if isinstance(v, list)), None)
+    if not isinstance(parsed, list):
+        return [fallback_evaluation("parse_error", "Auto-fallback (could not parse JSON).") for _ in questions]
+    out = []
+    for i in range(len(questions)):
+        item = parsed[i] if i < len(parsed) else None
+        if isinstance(item, dict) and "scores" in item:
+            out.append(with_overall(item))
+        else:
+            out.append(fallback_evaluation("parse_error", "Auto-fallback (missing from batch result)."))
+    return out
+
+
+def _evaluate_transcript_compact(questions: List[str], contexts: List[Dict]) -> List[Dict]:
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, start=1))
+    prompt = f"""System: You are a clinical educator reviewing a medical student's full interview with a virtual patient.
+Use the case context and the policy below. For EACH question, in order, score each criterion 0–5: {", ".join(CRITERIA)}.
+Give one short rationale (at most 25 words), the interview phase, and any flags (empty list if none).
+
+Policy:
+{ETHICS_POLICY}
+
+Case context:
+{build_context_block(contexts)}
+
+Student questions:
+{numbered}
+"""
+    n = len(questions)
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "format": {
+            "type": "object",
+            "properties": {"evaluations": {"type": "array", "items": compact_schema(), "minItems": n, "maxItems": n}},
+            "required": ["evaluations"],
+        },
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {"temperature": 0.1, "num_predict": EVAL_NUM_PREDICT * n},
+        "stream": False,
+    }
+    with tracing.span("evaluate_transcript", questions=n):
+        data = _generate_json(payload, priority=PRIORITY_BATCH)
+    items = data.get("evaluations") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return [fallback_evaluation("parse_error", "Auto-fallback (could not parse JSON).") for _ in questions]
+    # No per-field repair here: a batch result is already the cheap path.
+    return [_finish(*validate_evaluation(items[i] if i < n and i < len(items) else None)) for i in range(n)]
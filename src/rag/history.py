@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+import gzip
+import json
+import os
+import threading
+import time
+
+from src.config import CHUNK_TEXT_CACHE_SIZE, TRANSCRIPT_DIR
+
+# Evaluation fields kept in history and transcripts (per-criterion reasoning is dropped).
+EVALUATION_FIELDS = ("scores", "overall", "band", "rationale", "phase_guess", "risk_flags")
+# Reply metrics kept in transcripts.
+METRIC_FIELDS = ("ttft_s", "total_s", "tokens_per_s", "prompt_eval_count", "cached", "cancelled")
+
+
+def chunk_refs(contexts: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    What a history entry keeps of its retrieved contexts: ids and scores, no text.
+    """
+    return [
+        {k: c.get(k) for k in ("id", "pmc_id", "chunk_index", "score") if c.get(k) is not None}
+        for c in contexts
+    ]
+
+
+def compact_evaluation(evaluation: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not evaluation:
+        return evaluation
+    out = {k: evaluation[k] for k in EVALUATION_FIELDS if k in evaluation}
+    if "rationale" not in out and isinstance(evaluation.get("reasoning"), dict):
+        # Verbose evaluations: keep the one line the panel shows.
+        reasoning = evaluation["reasoning"]
+        out["rationale"] = reasoning.get("diagnostic_utility") or reasoning.get("relevance") or ""
+    return out
+
+
+class ChunkTextCache:
+    """
+    Process-wide LRU of chunk text by id, shared by every session. History entries
+    hold only chunk references; a turn's texts are put here when it is retrieved and
+    looked up (or re-read from the vector store after eviction) when its sources
+    are shown.
+    """
+
+    def __init__(self, store, capacity: int = CHUNK_TEXT_CACHE_SIZE):
+        self.store = store
+        self.capacity = capacity
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, contexts: Iterable[Dict[str, Any]]):
+        with self._lock:
+            for c in contexts:
+                if c.get("id") and c.get("text") is not None:
+                    self._texts[c["id"]] = c["text"]
+                    self._texts.move_to_end(c["id"])
+            while len(self._texts) > self.capacity:
+                self._texts.popitem(last=False)
+
+    def resolve(self, refs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        The references as context dicts with their `text` filled in (empty when the
+        chunk is no longer in the store).
+        """
+        refs = list(refs)
+        found: Dict[str, str] = {}
+        with self._lock:
+            for r in refs:
+                text = self._texts.get(r.get("id"))
+                if text is not None:
+                    self._texts.move_to_end(r["id"])
+                    found[r["id"]] = text
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        missing = [(r["id"], r.get("pmc_id")) for r in refs if r.get("id") and r["id"] not in found]
+        if missing:
+            fetched = self.store.get_texts(missing)
+            self.put({"id": k, "text": v} for k, v in fetched.items())
+            found.update(fetched)
+        return [dict(r, text=found.get(r.get("id"), "")) for r in refs]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._texts)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class TranscriptStore:
+    """
+    Full session transcripts on disk, one gzipped JSONL file per session with one
+    compact line per message (chunk references, not texts). Messages are appended
+    as they leave memory and when the session ends.
+    """
+
+    def __init__(self, root: str = TRANSCRIPT_DIR):
+        self.root = root
+
+    def path(self, session_id: str) -> str:
+        return os.path.join(self.root, f"{session_id}.jsonl.gz")
+
+    @staticmethod
+    def record(message: Dict[str, Any]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"n": message.get("n"), "role": message.get("role"), "content": message.get("content", "")}
+        for key in ("question", "pmc_id"):
+            if message.get(key):
+                out[key] = message[key]
+        if message.get("contexts"):
+            out["refs"] = [[c.get("id"), c.get("score")] for c in message["contexts"]]
+        if message.get("evaluation"):
+            out["evaluation"] = compact_evaluation(message["evaluation"])
+        elif message.get("eval_job") or message.get("eval_deferred"):
+            out["evaluation_pending"] = True
+        if message.get("metrics"):
+            out["metrics"] = {k: message["metrics"][k] for k in METRIC_FIELDS if message["metrics"].get(k) is not None}
+        return out
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]], **meta) -> str:
+        path = self.path(session_id)
+        if not messages:
+            return path
+        os.makedirs(self.root, exist_ok=True)
+        saved_at = time.time()
+        lines = "".join(
+            json.dumps(dict(self.record(m), session=session_id, saved_at=saved_at, **meta), separators=(",", ":")) + "\n"
+            for m in messages
+        )
+        # Each append adds a gzip member; readers see one continuous stream.
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.write(lines)
+        return path
+
+    def load(self, session_id: str) -> List[Dict[str, Any]]:
+        path = self.path(session_id)
+        if not os.path.exists(path):
+            return []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
@@ -1,57 +1,64 @@
-from typing import Iterable, Dict, Any
+from typing import Iterable, Dict, Any, Optional
 import os
 
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-
 from src.config import (
     PERSIST_DIR,
     COLLECTION_NAME,
     EMBEDDING_MODEL_NAME,
-    CHUNK_SIZE,
-    CHUNK_OVERLAP,
+    EMBED_BATCH_SIZE,
 )
-from src.rag.chunker import split_text
+from src.rag.embeddings import EmbeddingEngine
+from src.rag.pipeline import IngestionPipeline
+from src.rag.vector_store import ChromaStore
+from src.rag import tracing
 
 
 class ChromaIndexer:
-    def __init__(self, persist_dir: str = PERSIST_DIR, collection_name: str = COLLECTION_NAME):
+    def __init__(
+        self,
+        persist_dir: str = PERSIST_DIR,
+        collection_name: str = COLLECTION_NAME,
+        embedder: Optional[EmbeddingEngine] = None,
+    ):
         os.makedirs(persist_dir, exist_ok=True)
-        self.client = chromadb.PersistentClient(path=persist_dir, settings=Settings(allow_reset=True))
-        self.collection = self.client.get_or_create_collection(collection_name)
-        self.embedder = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        self.persist_dir = persist_dir
+        self.embedding_model = EMBEDDING_MODEL_NAME
+        self.store = ChromaStore(persist_dir, collection_name, metadata={"embedding_model": self.embedding_model})
+        self.store.record_embedding_model(self.embedding_model)
+        self.embedder = embedder or EmbeddingEngine(self.embedding_model)
+
+    @property
+    def collection(self):
+        return self.store.collection
 
     def reset_collection(self):
-        self.client.delete_collection(self.collection.name)
-        self.collection = self.client.get_or_create_collection(self.collection.name)
-
-    def add_documents(self, rows: Iterable[Dict[str, Any]]):
-        batch_texts = []
-        batch_ids = []
-        batch_metadatas = []
-
-        row_counter = 0
-        for row in rows:
-            pmc_id = row["pmc_id"]
-            context = row["context"]
-            chunks = split_text(context, CHUNK_SIZE, CHUNK_OVERLAP)
-            for idx, chunk in enumerate(chunks):
-                doc_id = f"{pmc_id}-{row_counter}-{idx}"
-                batch_texts.append(chunk)
-                batch_ids.append(doc_id)
-                batch_metadatas.append({"pmc_id": pmc_id, "chunk_index": idx, "row_index": row_counter})
-
-            row_counter += 1
-
-            # flush in moderate batches to avoid memory spikes
-            if len(batch_texts) >= 256:
-                self._flush(batch_texts, batch_ids, batch_metadatas)
-                batch_texts, batch_ids, batch_metadatas = [], [], []
-
-        if batch_texts:
-            self._flush(batch_texts, batch_ids, batch_metadatas)
+        self.store.reset()
+
+    def add_documents(self, rows: Iterable[Dict[str, Any]], workers: int = 0, batch_size: int = EMBED_BATCH_SIZE):
+        """
+        Chunk, embed and store rows. For large builds use IngestionPipeline directly
+        (parallel chunking, checkpoints); this runs the same stages with inline chunking.
+        """
+        return IngestionPipeline(self, workers=workers, batch_size=batch_size).run(rows)
+
+    def _embed(self, texts):
+        with tracing.span("index.embed", chunks=len(texts)):
+            return self.embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+
+    def _write(self, texts, ids, metadatas, embeddings):
+        with tracing.span("index.write", chunks=len(ids)):
+            self.store.upsert(ids, texts, metadatas, embeddings)
+
+    def close(self):
+        """
+        Stop the embedding engine's worker processes, if it has any.
+        """
+        close = getattr(self.embedder, "close", None)
+        if close is not None:
+            close()
+
+    def _delete_ids(self, ids, batch_size: int = 500):
+        self.store.delete_ids(ids, batch_size=batch_size)
 
     def _flush(self, texts, ids, metadatas):
-        embeddings = self.embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
-        self.collection.add(documents=texts, ids=ids, metadatas=metadatas, embeddings=embeddings)
+        self._write(texts, ids, metadatas, self._embed(texts))
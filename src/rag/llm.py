@@ -1,20 +1,84 @@
-from typing import List, Dict, Optional
-import requests
+from typing import TYPE_CHECKING, List, Dict, Optional, Any, Tuple, Union
 import os
+import random
 
-from src.config import OLLAMA_ENDPOINT, OLLAMA_MODEL, SYSTEM_PROMPT, TEMPERATURE, ETHICS_POLICY
+from src.config import (
+    OLLAMA_MODEL,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_NUM_CTX,
+    PATIENT_CORE_CHUNKS,
+    SYSTEM_PROMPT,
+    TEMPERATURE,
+    ETHICS_POLICY,
+)
+from src.rag import ollama_client, tracing
+from src.rag.context_assembler import format_context_block
+from src.rag.response_cache import ResponseCache, get_cache, case_of
+from src.rag.scheduler import OllamaScheduler, get_scheduler
+
+if TYPE_CHECKING:
+    from src.rag.ollama_async import AsyncOllamaScheduler
+
+# Bump when a prompt template below changes so cached responses are not reused.
+PROMPT_VERSION = "2"
+
+_PATIENT_INSTRUCTIONS = (
+    "You are roleplaying as a cooperative patient. Answer only with subjective information a patient would say.\n"
+    "If the clinician asks for data you wouldn't know (labs, imaging), respond with uncertainty or what you were told.\n"
+    "If not sure, say you don't know. Keep responses concise and natural.\n"
+)
+
+
+def _persona_block(persona: Optional[Dict]) -> str:
+    if not persona:
+        return ""
+    p = []
+    if persona.get("name"): p.append(f"Name: {persona['name']}")
+    if persona.get("age"): p.append(f"Age: {persona['age']}")
+    if persona.get("sex"): p.append(f"Sex: {persona['sex']}")
+    if persona.get("notes"): p.append(f"Notes: {persona['notes']}")
+    return "\n".join(p)
+
+
+def random_persona() -> Dict[str, Any]:
+    """
+    Simple synthetic persona for a new encounter.
+    """
+    return {
+        "name": random.choice(["Alex", "Jordan", "Taylor", "Casey", "Riley", "Morgan"]),
+        "sex": random.choice(["male", "female"]),
+        "age": random.choice([22, 35, 47, 60, 72]),
+        "notes": "Cooperative, answers succinctly.",
+    }
+
+
+def _context_id(c: Dict) -> str:
+    return c.get("id") or f"{c.get('pmc_id')}:{c.get('chunk_index')}"
 
 
 class OllamaLLM:
-    def __init__(self, endpoint: str = OLLAMA_ENDPOINT, model: str = OLLAMA_MODEL, temperature: float = TEMPERATURE):
-        self.endpoint = endpoint.rstrip('/')
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        model: str = OLLAMA_MODEL,
+        temperature: float = TEMPERATURE,
+        cache: Optional[ResponseCache] = None,
+        scheduler: Optional[Union[OllamaScheduler, "AsyncOllamaScheduler"]] = None,
+    ):
+        # All calls go through a scheduler: the shared one over OLLAMA_ENDPOINTS unless
+        # a single endpoint (or a scheduler) is given explicitly. With an
+        # AsyncOllamaScheduler the stream methods return async iterables (the
+        # blocking generate methods are not available).
+        if scheduler is None:
+            scheduler = OllamaScheduler([endpoint]) if endpoint else get_scheduler()
+        self.scheduler = scheduler
+        self.endpoint = scheduler.endpoint
         self.model = model
         self.temperature = temperature
+        self.cache = cache if cache is not None else get_cache()
 
-    def generate(self, question: str, contexts: List[Dict]) -> str:
-        context_block = "\n\n".join([
-            f"[Source: {c.get('pmc_id')}]\n{c.get('text')}" for c in contexts
-        ])
+    def _qa_payload(self, question: str, contexts: List[Dict]) -> Dict[str, Any]:
+        context_block = format_context_block(contexts)
 
         prompt = (
             f"System: {SYSTEM_PROMPT}\n\n"
@@ -24,39 +88,19 @@ class OllamaLLM:
             f"Answer concisely. Include citations like [PMC_id] where relevant."
         )
 
-        url = f"{self.endpoint}/api/generate"
-        payload = {
+        return {
             "model": self.model,
             "prompt": prompt,
             "temperature": self.temperature,
             "stream": False,
         }
-        resp = requests.post(url, json=payload, timeout=120)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("response", "")
 
-    def generate_patient_reply(self, user_utterance: str, contexts: List[Dict], persona: Optional[Dict] = None) -> str:
-        """
-        Generate a roleplay patient's reply. Persona may include age, sex, name, baseline traits.
-        """
-        context_block = "\n\n".join([
-            f"[Source: {c.get('pmc_id')}]\n{c.get('text')}" for c in contexts
-        ])
-
-        persona_desc = ""
-        if persona:
-            p = []
-            if persona.get("name"): p.append(f"Name: {persona['name']}")
-            if persona.get("age"): p.append(f"Age: {persona['age']}")
-            if persona.get("sex"): p.append(f"Sex: {persona['sex']}")
-            if persona.get("notes"): p.append(f"Notes: {persona['notes']}")
-            persona_desc = "\n".join(p)
+    def _patient_payload(self, user_utterance: str, contexts: List[Dict], persona: Optional[Dict] = None) -> Dict[str, Any]:
+        context_block = format_context_block(contexts)
+        persona_desc = _persona_block(persona)
 
         prompt = (
-            f"System: You are roleplaying as a cooperative patient. Answer only with subjective information a patient would say.\n"
-            f"If the clinician asks for data you wouldn't know (labs, imaging), respond with uncertainty or what you were told.\n"
-            f"If not sure, say you don't know. Keep responses concise and natural.\n"
+            f"System: {_PATIENT_INSTRUCTIONS}"
             f"Policy: {ETHICS_POLICY}\n\n"
             f"Patient persona (optional):\n{persona_desc}\n\n"
             f"Relevant case snippets for consistency (not shown to user):\n{context_block}\n\n"
@@ -64,14 +108,225 @@ class OllamaLLM:
             f"Patient reply:"
         )
 
-        url = f"{self.endpoint}/api/generate"
-        payload = {
+        return {
             "model": self.model,
             "prompt": prompt,
             "temperature": max(0.2, self.temperature),
             "stream": False,
         }
-        resp = requests.post(url, json=payload, timeout=120)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("response", "")
+
+    def _cache_entry(
+        self, kind: str, payload: Dict[str, Any], question: str, contexts: List[Dict], persona: Optional[Dict]
+    ) -> Tuple[str, str, Optional[str]]:
+        scope = ResponseCache.scope(kind, self.model, PROMPT_VERSION, payload["temperature"], persona=persona)
+        context_ids = [_context_id(c) for c in contexts]
+        return scope, ResponseCache.make_key(scope, context_ids, question), case_of(contexts)
+
+    def _complete(
+        self, kind: str, payload: Dict[str, Any], question: str, contexts: List[Dict], persona: Optional[Dict], use_cache: bool
+    ) -> str:
+        if not use_cache:
+            return self.scheduler.generate(payload).get("response", "")
+        scope, key, pmc_id = self._cache_entry(kind, payload, question, contexts, persona)
+        with tracing.span("cache_lookup", kind=kind) as attrs:
+            cached = self.cache.get(scope, key, question, pmc_id)
+            attrs["hit"] = cached is not None
+        if cached is not None:
+            return cached
+        text = self.scheduler.generate(payload).get("response", "")
+        if text:
+            self.cache.put(scope, key, text, question, pmc_id)
+        return text
+
+    def _stream(
+        self, kind: str, payload: Dict[str, Any], question: str, contexts: List[Dict], persona: Optional[Dict], use_cache: bool
+    ) -> Union[ollama_client.TokenStream, ollama_client.CachedStream]:
+        if not use_cache:
+            return self.scheduler.stream(payload)
+        scope, key, pmc_id = self._cache_entry(kind, payload, question, contexts, persona)
+        with tracing.span("cache_lookup", kind=kind) as attrs:
+            cached = self.cache.get(scope, key, question, pmc_id)
+            attrs["hit"] = cached is not None
+        if cached is not None:
+            return ollama_client.CachedStream(cached)
+
+        def store(text: str):
+            if text:
+                self.cache.put(scope, key, text, question, pmc_id)
+
+        return self.scheduler.stream(payload, on_complete=store)
+
+    def generate(self, question: str, contexts: List[Dict], use_cache: bool = True) -> str:
+        return self._complete("qa", self._qa_payload(question, contexts), question, contexts, None, use_cache)
+
+    def stream(self, question: str, contexts: List[Dict], use_cache: bool = True):
+        """
+        Streaming variant of `generate`: iterate the result for tokens; `.text` and
+        `.stats` (TTFT, tokens/s) are available once iteration finishes. A cache hit
+        yields the stored reply in one piece.
+        """
+        return self._stream("qa", self._qa_payload(question, contexts), question, contexts, None, use_cache)
+
+    def generate_patient_reply(
+        self, user_utterance: str, contexts: List[Dict], persona: Optional[Dict] = None, use_cache: bool = True
+    ) -> str:
+        """
+        Generate a roleplay patient's reply. Persona may include age, sex, name, baseline traits.
+        """
+        payload = self._patient_payload(user_utterance, contexts, persona)
+        return self._complete("patient", payload, user_utterance, contexts, persona, use_cache)
+
+    def stream_patient_reply(
+        self, user_utterance: str, contexts: List[Dict], persona: Optional[Dict] = None, use_cache: bool = True
+    ):
+        """
+        Streaming variant of `generate_patient_reply`.
+        """
+        payload = self._patient_payload(user_utterance, contexts, persona)
+        return self._stream("patient", payload, user_utterance, contexts, persona, use_cache)
+
+    def start_patient_session(
+        self, persona: Optional[Dict] = None, case=None, core_chunks: int = PATIENT_CORE_CHUNKS
+    ) -> "PatientSession":
+        """
+        Begin a Virtual Patient encounter whose prompt prefix (instructions, policy,
+        persona and the case's first `core_chunks` chunks) stays fixed across turns.
+        `case` is the encounter's CaseContext, if one was loaded.
+        """
+        core = case.leading(core_chunks) if case is not None else []
+        return PatientSession(self, persona, core, pmc_id=getattr(case, "pmc_id", None))
+
+
+class PatientSession:
+    """
+    One Virtual Patient encounter as an append-only /api/chat conversation.
+
+    The system message is fixed for the encounter and each turn only appends the
+    clinician's line (with any retrieved snippet not already in the prefix) and the
+    patient's reply. With the model kept loaded (`keep_alive`), Ollama reuses its KV
+    cache for the unchanged prefix, so after the first turn only the new exchange is
+    prompt-evaluated; `turns` records the per-turn prompt_eval_count.
+    """
+
+    def __init__(
+        self,
+        llm: OllamaLLM,
+        persona: Optional[Dict],
+        core_contexts: List[Dict],
+        pmc_id: Optional[str] = None,
+        num_ctx: int = OLLAMA_NUM_CTX,
+    ):
+        self.llm = llm
+        self.persona = persona
+        self.pmc_id = pmc_id
+        self.num_ctx = num_ctx
+        self.core_ids = {_context_id(c) for c in core_contexts}
+        self.messages: List[Dict[str, str]] = [{
+            "role": "system",
+            "content": (
+                f"{_PATIENT_INSTRUCTIONS}"
+                f"Policy: {ETHICS_POLICY}\n\n"
+                f"Patient persona (optional):\n{_persona_block(persona)}\n\n"
+                f"Case notes for consistency (not shown to user):\n{format_context_block(core_contexts)}"
+            ),
+        }]
+        self.turns: List[Dict[str, Any]] = []
+        # ~3 characters per token, leaving room for the reply.
+        self.max_chars = num_ctx * 3
+        self._pending: Optional[Tuple[Dict[str, str], Any]] = None
+
+    def _commit(self, force: bool = False):
+        """
+        Append the previous exchange once its stream has finished (or was abandoned).
+        A reply that produced no text is dropped so the history matches the chat.
+        """
+        if self._pending is None:
+            return
+        user_msg, token_stream = self._pending
+        if not force and not (token_stream.done or token_stream.cancelled):
+            return
+        self._pending = None
+        reply = token_stream.text
+        if not reply:
+            return
+        self.messages += [user_msg, {"role": "assistant", "content": reply}]
+        stats = token_stream.stats or {}
+        self.turns.append({
+            "prompt_eval_count": stats.get("prompt_eval_count"),
+            "prompt_eval_s": stats.get("prompt_eval_s"),
+            "cached": bool(stats.get("cached")),
+        })
+        self._trim()
+
+    def _trim(self):
+        # Dropping old exchanges invalidates the cached suffix, so drop down to 2/3 of
+        # the budget at once rather than one exchange per turn. The system message stays.
+        total = sum(len(m["content"]) for m in self.messages)
+        if total <= self.max_chars:
+            return
+        while len(self.messages) > 3 and total > self.max_chars * 2 // 3:
+            total -= len(self.messages[1]["content"]) + len(self.messages[2]["content"])
+            del self.messages[1:3]
+
+    def _user_message(self, utterance: str, contexts: List[Dict]) -> Dict[str, str]:
+        extra = [c for c in contexts if _context_id(c) not in self.core_ids]
+        if not extra:
+            return {"role": "user", "content": f"Clinician says: {utterance}"}
+        return {
+            "role": "user",
+            "content": (
+                f"Additional case notes (not shown to user):\n{format_context_block(extra)}\n\n"
+                f"Clinician says: {utterance}"
+            ),
+        }
+
+    def stream_reply(self, utterance: str, contexts: List[Dict], use_cache: bool = True):
+        """
+        Streaming patient reply for the next turn; same return type as
+        OllamaLLM.stream_patient_reply.
+        """
+        self._commit(force=True)
+        user_msg = self._user_message(utterance, contexts)
+        temperature = max(0.2, self.llm.temperature)
+        payload = {
+            "model": self.llm.model,
+            "messages": self.messages + [user_msg],
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"temperature": temperature, "num_ctx": self.num_ctx},
+        }
+        store = None
+        if use_cache:
+            scope = ResponseCache.scope(
+                "patient_session", self.llm.model, PROMPT_VERSION, temperature, history=self.messages
+            )
+            key = ResponseCache.make_key(scope, [_context_id(c) for c in contexts], utterance)
+            with tracing.span("cache_lookup", kind="patient_session") as attrs:
+                cached = self.llm.cache.get(scope, key, utterance, self.pmc_id)
+                attrs["hit"] = cached is not None
+            if cached is not None:
+                token_stream = ollama_client.CachedStream(cached)
+                self._pending = (user_msg, token_stream)
+                return token_stream
+
+            def store(text: str):
+                if text:
+                    self.llm.cache.put(scope, key, text, utterance, self.pmc_id)
+
+        token_stream = self.llm.scheduler.stream(payload, on_complete=store, api="chat")
+        self._pending = (user_msg, token_stream)
+        return token_stream
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Prompt tokens evaluated per turn; after the first turn these should cover only
+        the new exchange rather than the whole prompt.
+        """
+        self._commit()
+        counts = [t["prompt_eval_count"] for t in self.turns if t["prompt_eval_count"] is not None]
+        return {
+            "turns": len(self.turns),
+            "prompt_eval_counts": counts,
+            "first_turn_tokens": counts[0] if counts else None,
+            "later_turn_mean": (sum(counts[1:]) / len(counts[1:])) if len(counts) > 1 else None,
+            "history_chars": sum(len(m["content"]) for m in self.messages),
+        }
@@ -0,0 +1,300 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import heapq
+import json
+import time
+
+import aiohttp
+
+from src.rag import tracing
+from src.rag.ollama_client import stream_stats, token_of, trace_stream
+from src.rag.scheduler import (
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NAMES,
+    SchedulerBusy,
+    _Endpoint,
+    _SchedulerBase,
+    _Waiter,
+    dedup_key,
+)
+
+
+def _retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(exc, aiohttp.ClientResponseError) and exc.status >= 500
+
+
+class AsyncOllamaScheduler(_SchedulerBase):
+    """
+    asyncio counterpart of OllamaScheduler for the headless service: the same
+    endpoint pool, priority queue, bounded waiting, in-flight dedup, retries and
+    metrics, but waiting is an awaited future and requests go through one shared
+    aiohttp session, so a single event loop can hold many open Ollama streams.
+
+    Create and use it from one event loop; call `close()` on shutdown.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            limit = sum(e.limit for e in self.endpoints) + len(self.endpoints)  # + one slot per endpoint for pings
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # -- slots -------------------------------------------------------------
+
+    def _dispatch(self):
+        for waiter in self._hand_out():
+            if not waiter.future.done():
+                waiter.future.set_result(waiter.endpoint)
+
+    async def _acquire(self, priority: int, exclude: Optional[str] = None) -> _Endpoint:
+        self.counters["requests"] += 1
+        if not self._heap:
+            endpoint = self._pick(time.time(), exclude)
+            if endpoint is not None:
+                endpoint.active += 1
+                self._waits[priority].append(0.0)
+                tracing.record("ollama.queue_wait", 0.0, priority=PRIORITY_NAMES[priority])
+                return endpoint
+        if self._waiting >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise SchedulerBusy(f"Ollama queue is full ({self._waiting} waiting)")
+        waiter = _Waiter(priority, exclude)
+        waiter.future = asyncio.get_running_loop().create_future()
+        self._push(waiter)
+        deadline = waiter.enqueued + self.queue_timeout
+        try:
+            while waiter.endpoint is None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    waiter.abandoned = True
+                    self._waiting -= 1
+                    self.counters["timeouts"] += 1
+                    raise SchedulerBusy(f"No Ollama slot free after {self.queue_timeout:.0f}s")
+                try:
+                    # Wake periodically so cooldowns expire.
+                    await asyncio.wait_for(asyncio.shield(waiter.future), min(remaining, 0.5))
+                except asyncio.TimeoutError:
+                    self._dispatch()
+        except asyncio.CancelledError:
+            # The client went away while queued (or just as a slot was handed over).
+            if waiter.endpoint is not None:
+                waiter.endpoint.active -= 1
+                self._dispatch()
+            elif not waiter.abandoned:
+                waiter.abandoned = True
+                self._waiting -= 1
+            raise
+        wait = time.perf_counter() - waiter.enqueued
+        self._waits[priority].append(wait)
+        tracing.record("ollama.queue_wait", wait, priority=PRIORITY_NAMES[priority])
+        return waiter.endpoint
+
+    def _push(self, waiter: _Waiter):
+        heapq.heappush(self._heap, (waiter.priority, next(self._seq), waiter))
+        self._waiting += 1
+        self.counters["peak_queue"] = max(self.counters["peak_queue"], self._waiting)
+        self._dispatch()
+
+    def _release(self, endpoint: _Endpoint, error: Optional[BaseException] = None):
+        self._settle(endpoint, error, _retryable)
+        self._dispatch()
+
+    # -- calls -------------------------------------------------------------
+
+    async def _call(self, fn: Callable[[str], Awaitable[Any]], priority: int) -> Any:
+        exclude = None
+        for attempt in range(self.retries + 1):
+            endpoint = await self._acquire(priority, exclude)
+            try:
+                result = await fn(endpoint.url)
+            except Exception as exc:
+                self._release(endpoint, exc)
+                if attempt < self.retries and _retryable(exc):
+                    self.counters["retries"] += 1
+                    exclude = endpoint.url
+                    continue
+                raise
+            except asyncio.CancelledError:
+                self._release(endpoint)
+                raise
+            self._release(endpoint)
+            return result
+
+    async def _post(self, url: str, api: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        session = await self.session()
+        with tracing.span("ollama.request", api=api):
+            async with session.post(
+                f"{url}/api/{api}", json=payload, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as resp:
+                resp.raise_for_status()
+                body = await resp.json(content_type=None)
+        tracing.record_ollama(body, api)
+        return body
+
+    async def generate(
+        self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE, api: str = "generate"
+    ) -> Dict[str, Any]:
+        """
+        Non-streaming /api/generate (or /api/chat) through the queue; identical
+        requests already in flight share one upstream call.
+        """
+        payload = dict(payload, stream=False)
+        key = dedup_key(payload, api)
+        leader = self._inflight.get(key)
+        if leader is not None:
+            self.counters["dedup_hits"] += 1
+            return await asyncio.shield(leader)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._call(lambda url: self._post(url, api, payload), priority)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # followers re-raise it; don't log it as unretrieved
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stream(
+        self,
+        payload: Dict[str, Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        on_complete: Optional[Callable[[str], None]] = None,
+        api: str = "generate",
+    ) -> "AsyncTokenStream":
+        """
+        Streaming call through the queue; iterate the result with `async for`.
+        """
+        return AsyncTokenStream(self, priority, payload, on_complete=on_complete, api=api)
+
+    async def ping(self) -> bool:
+        session = await self.session()
+
+        async def one(url: str) -> bool:
+            try:
+                async with session.get(f"{url}/api/tags", timeout=aiohttp.ClientTimeout(total=5.0)) as resp:
+                    return resp.status < 400
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+
+        return any(await asyncio.gather(*(one(e.url) for e in self.endpoints)))
+
+
+class AsyncTokenStream:
+    """
+    Async iterable over tokens from a streaming /api/generate (or /api/chat) call,
+    with the same `text`, `done`, `cancelled` and `stats` as TokenStream (plus
+    `queue_wait_s` and `endpoint`). The slot is taken when iteration starts; a
+    failure before the first token is retried on another endpoint. `on_complete`
+    runs in the default executor since it usually writes the response cache.
+    """
+
+    def __init__(
+        self,
+        scheduler: AsyncOllamaScheduler,
+        priority: int,
+        payload: Dict[str, Any],
+        on_complete: Optional[Callable[[str], None]] = None,
+        api: str = "generate",
+    ):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.payload = dict(payload, stream=True)
+        self.endpoint = scheduler.endpoint
+        self.api = api
+        self.timeout = scheduler.timeout
+        self.on_complete = on_complete
+        self.cancelled = False
+        self.done = False
+        self.stats: Dict[str, Any] = {}
+        self._parts: List[str] = []
+        self._resp: Optional[aiohttp.ClientResponse] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def cancel(self):
+        self.cancelled = True
+        if self._resp is not None:
+            self._resp.close()
+
+    async def __aiter__(self):
+        exclude = None
+        for attempt in range(self.scheduler.retries + 1):
+            if self.cancelled:
+                return
+            queued_at = time.perf_counter()
+            endpoint = await self.scheduler._acquire(self.priority, exclude)
+            wait = time.perf_counter() - queued_at
+            self.endpoint = endpoint.url
+            error: Optional[Exception] = None
+            tokens = self._tokens(endpoint.url)
+            try:
+                async for token in tokens:
+                    yield token
+                return
+            except Exception as exc:
+                error = exc
+                if self._parts or attempt >= self.scheduler.retries or not _retryable(exc):
+                    raise
+                self.scheduler.counters["retries"] += 1
+                exclude = endpoint.url
+            finally:
+                await tokens.aclose()  # close the HTTP response before giving the slot back
+                self.scheduler._release(endpoint, error)
+                self.stats = dict(self.stats, queue_wait_s=wait, endpoint=endpoint.url)
+
+    async def _tokens(self, url: str):
+        started = time.perf_counter()
+        first_at = None
+        session = await self.scheduler.session()
+        try:
+            async with session.post(
+                f"{url}/api/{self.api}", json=self.payload, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as resp:
+                self._resp = resp
+                resp.raise_for_status()
+                async for line in resp.content:
+                    if self.cancelled:
+                        break
+                    line = line.strip()
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    token = token_of(chunk)
+                    if token:
+                        if first_at is None:
+                            first_at = time.perf_counter()
+                        self._parts.append(token)
+                        yield token
+                    if chunk.get("done"):
+                        self.done = True
+                        self.stats = stream_stats(chunk, started, first_at, len(self._parts), self.cancelled)
+                        trace_stream(self.stats, chunk, self.api)
+                        if self.on_complete:
+                            await asyncio.get_running_loop().run_in_executor(None, self.on_complete, self.text)
+        except Exception:
+            if not self.cancelled:
+                raise
+        finally:
+            if not self.done:
+                self.stats = stream_stats({}, started, first_at, len(self._parts), self.cancelled)
+                trace_stream(self.stats, {}, self.api)
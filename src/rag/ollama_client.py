@@ -0,0 +1,227 @@
+from typing import Callable, Dict, Any, Iterator, List, Optional
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import OLLAMA_ENDPOINT, OLLAMA_TIMEOUT, OLLAMA_POOL_SIZE
+from src.rag import tracing
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Process-wide keep-alive HTTP session for Ollama. Reusing it avoids a new TCP
+    connection per generation; the adapter pool bounds open connections.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=OLLAMA_POOL_SIZE, pool_maxsize=OLLAMA_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def generate(payload: Dict[str, Any], endpoint: str = OLLAMA_ENDPOINT, timeout: float = OLLAMA_TIMEOUT) -> Dict[str, Any]:
+    """
+    POST a non-streaming request to Ollama's /api/generate and return the decoded JSON body.
+    """
+    with tracing.span("ollama.request", api="generate"):
+        resp = get_session().post(f"{endpoint.rstrip('/')}/api/generate", json=payload, timeout=timeout)
+        resp.raise_for_status()
+        body = resp.json()
+    tracing.record_ollama(body, "generate")
+    return body
+
+
+def chat(payload: Dict[str, Any], endpoint: str = OLLAMA_ENDPOINT, timeout: float = OLLAMA_TIMEOUT) -> Dict[str, Any]:
+    """
+    POST a non-streaming request to Ollama's /api/chat and return the decoded JSON body.
+    """
+    with tracing.span("ollama.request", api="chat"):
+        resp = get_session().post(f"{endpoint.rstrip('/')}/api/chat", json=payload, timeout=timeout)
+        resp.raise_for_status()
+        body = resp.json()
+    tracing.record_ollama(body, "chat")
+    return body
+
+
+def ping(endpoint: str = OLLAMA_ENDPOINT, timeout: float = 5.0) -> bool:
+    """
+    Cheap readiness probe: Ollama answers /api/tags without loading a model.
+    """
+    try:
+        resp = get_session().get(f"{endpoint.rstrip('/')}/api/tags", timeout=timeout)
+        return resp.ok
+    except requests.RequestException:
+        return False
+
+
+def stream_stats(
+    final: Dict[str, Any], started: float, first_at: Optional[float], n_parts: int, cancelled: bool
+) -> Dict[str, Any]:
+    """
+    Timing summary for a finished (or cancelled) stream from Ollama's final chunk,
+    falling back to wall-clock measurements when the chunk is missing.
+    """
+    total = time.perf_counter() - started
+    eval_count = final.get("eval_count") or n_parts
+    eval_ns = final.get("eval_duration")
+    if eval_ns:
+        rate = eval_count / (eval_ns / 1e9)
+    elif first_at is not None and total > first_at - started:
+        rate = eval_count / (total - (first_at - started))
+    else:
+        rate = 0.0
+    return {
+        "ttft_s": (first_at - started) if first_at is not None else None,
+        "total_s": total,
+        "tokens": eval_count,
+        "tokens_per_s": rate,
+        "prompt_eval_count": final.get("prompt_eval_count"),
+        "prompt_eval_s": final["prompt_eval_duration"] / 1e9 if final.get("prompt_eval_duration") else None,
+        "cancelled": cancelled,
+    }
+
+
+def trace_stream(stats: Dict[str, Any], final: Dict[str, Any], api: str):
+    """
+    Feed a finished stream's timings (and Ollama's own, from the final chunk) to tracing.
+    """
+    if stats.get("ttft_s") is not None:
+        tracing.record("ollama.ttft", stats["ttft_s"], api=api)
+    tracing.record("ollama.stream", stats["total_s"], api=api, tokens=stats["tokens"], cancelled=stats["cancelled"])
+    tracing.record_ollama(final, api)
+
+
+def token_of(chunk: Dict[str, Any]) -> str:
+    # /api/generate sends "response"; /api/chat sends {"message": {"content": ...}}.
+    if "message" in chunk:
+        return (chunk.get("message") or {}).get("content", "")
+    return chunk.get("response", "")
+
+
+class TokenStream:
+    """
+    Iterable over tokens from a streaming /api/generate (or /api/chat) call.
+
+    Tokens are yielded as Ollama sends them; `text` accumulates the full reply and
+    `stats` is filled with time-to-first-token and generation rate. `cancel()` may be
+    called from another thread: it closes the HTTP response, which drops the
+    connection so Ollama stops generating for an abandoned turn.
+    """
+
+    def __init__(
+        self,
+        payload: Dict[str, Any],
+        endpoint: str = OLLAMA_ENDPOINT,
+        timeout: float = OLLAMA_TIMEOUT,
+        on_complete: Optional[Callable[[str], None]] = None,
+        api: str = "generate",
+    ):
+        self.payload = dict(payload, stream=True)
+        self.endpoint = endpoint.rstrip('/')
+        self.api = api
+        self.timeout = timeout
+        self.on_complete = on_complete
+        self.cancelled = False
+        self.done = False
+        self.stats: Dict[str, Any] = {}
+        self._parts: List[str] = []
+        self._resp: Optional[requests.Response] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __iter__(self) -> Iterator[str]:
+        started = time.perf_counter()
+        first_at = None
+        resp = get_session().post(
+            f"{self.endpoint}/api/{self.api}", json=self.payload, stream=True, timeout=self.timeout
+        )
+        self._resp = resp
+        try:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if self.cancelled:
+                    break
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                token = token_of(chunk)
+                if token:
+                    if first_at is None:
+                        first_at = time.perf_counter()
+                    self._parts.append(token)
+                    yield token
+                if chunk.get("done"):
+                    # Keep reading to the end of the body so the connection returns to the pool.
+                    self.done = True
+                    self._finish(chunk, started, first_at)
+                    if self.on_complete:
+                        self.on_complete(self.text)
+        except Exception:
+            if not self.cancelled:
+                raise
+        finally:
+            resp.close()
+            if not self.done:
+                self._finish({}, started, first_at)
+
+    def _finish(self, final: Dict[str, Any], started: float, first_at: Optional[float]):
+        self.stats = stream_stats(final, started, first_at, len(self._parts), self.cancelled)
+        trace_stream(self.stats, final, self.api)
+
+    def cancel(self):
+        self.cancelled = True
+        if self._resp is not None:
+            self._resp.close()
+
+
+class CachedStream:
+    """
+    TokenStream stand-in for a reply served from the response cache: yields the whole
+    text at once and reports it as cached.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.done = True
+        self.cancelled = False
+        self.stats: Dict[str, Any] = {}
+
+    def __iter__(self) -> Iterator[str]:
+        self.stats = {"ttft_s": 0.0, "total_s": 0.0, "tokens": 0, "tokens_per_s": 0.0, "cached": True}
+        yield self.text
+
+    async def __aiter__(self):
+        for token in self:
+            yield token
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def stream(
+    payload: Dict[str, Any],
+    endpoint: str = OLLAMA_ENDPOINT,
+    timeout: float = OLLAMA_TIMEOUT,
+    on_complete: Optional[Callable[[str], None]] = None,
+    api: str = "generate",
+) -> TokenStream:
+    """
+    Streaming counterpart of `generate` (or `chat` with api="chat"): returns a TokenStream
+    that yields tokens as they arrive. `on_complete` receives the full text once the
+    stream finishes (not on cancel).
+    """
+    return TokenStream(payload, endpoint=endpoint, timeout=timeout, on_complete=on_complete, api=api)
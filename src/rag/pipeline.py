@@ -0,0 +1,368 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from src.config import CHUNK_SIZE, CHUNK_OVERLAP, INDEX_WORKERS, EMBED_BATCH_SIZE
+from src.rag.chunker import split_text
+from src.rag.case_catalog import guess_specialty
+
+# Rows handed to a chunking worker per task; large enough to amortize pickling.
+ROWS_PER_TASK = 32
+
+# (row_index, pmc_id, content_hash, {"chars", "specialty"}, chunks)
+ChunkedRow = Tuple[int, str, str, Dict[str, Any], List[str]]
+
+
+def content_hash(text: str) -> str:
+    """
+    Stable identity of a case's indexed content. Chunking parameters are part of the
+    hash because they change every chunk even when the text does not.
+    """
+    h = hashlib.sha1(f"{CHUNK_SIZE}:{CHUNK_OVERLAP}:".encode("utf-8"))
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def chunk_id(pmc_id: str, h: str, index: int) -> str:
+    return f"{pmc_id}-{h}-{index}"
+
+
+def chunk_block(block: List[Tuple[int, Dict[str, Any]]]) -> List[ChunkedRow]:
+    """
+    Worker entry point: hash, tag and split each (row_index, row). Kept free of heavy
+    imports so worker processes start quickly.
+    """
+    return [
+        (
+            row_index,
+            row["pmc_id"],
+            content_hash(row["context"]),
+            {"chars": len(row["context"]), "specialty": guess_specialty(row["context"])},
+            split_text(row["context"], CHUNK_SIZE, CHUNK_OVERLAP),
+        )
+        for row_index, row in block
+    ]
+
+
+def _blocks(items: Iterable, size: int) -> Iterator[List]:
+    block = []
+    for item in items:
+        block.append(item)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+class Checkpoint:
+    """
+    JSON file recording the first dataset row not yet committed to the collection.
+    Written atomically after every batch the writer commits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, state: Dict[str, Any]):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Manifest:
+    """
+    Record of what the collection holds: pmc_id -> {content_hash: {"chunks", "chars", "specialty"}}.
+
+    Stored as an append-only JSONL log so each committed batch costs one small append;
+    `compact()` rewrites it to one line per live entry at the end of a build.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.cases: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.load()
+
+    def load(self):
+        self.cases = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn final line after a crash
+                self._apply(entry)
+
+    def _apply(self, entry: Dict[str, Any]):
+        pmc_id, h = entry["pmc_id"], entry["hash"]
+        if entry.get("deleted"):
+            hashes = self.cases.get(pmc_id, {})
+            hashes.pop(h, None)
+            if not hashes:
+                self.cases.pop(pmc_id, None)
+        else:
+            self.cases.setdefault(pmc_id, {})[h] = {k: v for k, v in entry.items() if k not in ("pmc_id", "hash")}
+
+    def _append(self, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                self._apply(entry)
+                f.write(json.dumps(entry) + "\n")
+
+    def contains(self, pmc_id: str, h: str) -> bool:
+        return h in self.cases.get(pmc_id, {})
+
+    def record(self, entries: List[Dict[str, Any]]):
+        self._append(entries)
+
+    def remove(self, pairs: Iterable[Tuple[str, str]]):
+        self._append([{"pmc_id": p, "hash": h, "deleted": True} for p, h in pairs])
+
+    def chunk_count(self, pmc_id: str, h: str) -> int:
+        return int(self.cases.get(pmc_id, {}).get(h, {}).get("chunks", 0))
+
+    def compact(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for pmc_id, hashes in self.cases.items():
+                for h, info in hashes.items():
+                    f.write(json.dumps({"pmc_id": pmc_id, "hash": h, **info}) + "\n")
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        self.cases = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self) -> int:
+        return len(self.cases)
+
+
+class IngestionPipeline:
+    """
+    Staged indexing: chunking runs in a process pool, embedding runs in the calling
+    thread in batches of `batch_size` chunks, and a writer thread commits each batch
+    to Chroma while the next one is being encoded. Batches end on row boundaries so
+    the checkpoint always names a clean resume point.
+
+    Chunk IDs are `{pmc_id}-{content_hash}-{chunk_index}`, so re-indexing the same
+    text overwrites rather than duplicates. With `incremental=True`, cases already in
+    the manifest with the same hash skip chunk embedding entirely; changed cases are
+    re-embedded and their old chunks deleted; with `prune_missing=True` (a complete
+    pass over the dataset) cases no longer present are deleted as well.
+    """
+
+    def __init__(
+        self,
+        indexer,
+        workers: int = INDEX_WORKERS,
+        batch_size: int = EMBED_BATCH_SIZE,
+        checkpoint: Optional[Checkpoint] = None,
+        manifest: Optional[Manifest] = None,
+        incremental: bool = False,
+        prune_missing: bool = False,
+        progress_every: float = 10.0,
+        log: Optional[Callable[[str], None]] = None,
+    ):
+        self.indexer = indexer
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.manifest = manifest
+        self.incremental = incremental and manifest is not None
+        self.prune_missing = prune_missing
+        self.progress_every = progress_every
+        self.log = log
+        self._error: Optional[BaseException] = None
+        self.rows_committed = 0
+        self.chunks_committed = 0
+        self.next_row = 0
+        self.counts = {
+            "new": 0, "changed": 0, "unchanged": 0, "duplicate_rows": 0, "skipped_embeddings": 0, "deleted_chunks": 0
+        }
+        self._seen: Dict[str, Set[str]] = {}
+        self._status: Dict[str, str] = {}
+
+    def run(self, rows: Iterable[Dict[str, Any]], start_row: int = 0) -> Dict[str, Any]:
+        """
+        Index `rows`, numbering them from `start_row` (pass the checkpoint's next_row
+        together with the remaining rows to resume). Returns throughput stats.
+        """
+        self.next_row = start_row
+        started = time.perf_counter()
+        last_report = started
+        write_q: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=2)
+        writer = threading.Thread(target=self._write_loop, args=(write_q,), daemon=True)
+        writer.start()
+        try:
+            for batch in self._batches(self._chunked(rows, start_row)):
+                batch["embeddings"] = self.indexer._embed(batch["texts"]) if batch["texts"] else []
+                write_q.put(batch)
+                if self._error:
+                    break
+                now = time.perf_counter()
+                if self.log and now - last_report >= self.progress_every:
+                    self.log(self._progress_line(now - started))
+                    last_report = now
+        finally:
+            write_q.put(None)
+            writer.join()
+        if self._error:
+            raise self._error
+        if self.manifest is not None:
+            self._delete_stale()
+            self.manifest.compact()
+
+        elapsed = time.perf_counter() - started
+        stats = {
+            "rows": self.rows_committed,
+            "chunks": self.chunks_committed,
+            "next_row": self.next_row,
+            "seconds": elapsed,
+            "rows_per_s": self.rows_committed / elapsed if elapsed else 0.0,
+            "chunks_per_s": self.chunks_committed / elapsed if elapsed else 0.0,
+            **self.counts,
+        }
+        if self.log:
+            self.log(self._progress_line(elapsed))
+        return stats
+
+    def _progress_line(self, elapsed: float) -> str:
+        elapsed = max(elapsed, 1e-9)
+        return (
+            f"  rows {self.rows_committed} ({self.rows_committed / elapsed:.1f}/s) · "
+            f"chunks {self.chunks_committed} ({self.chunks_committed / elapsed:.1f}/s) · "
+            f"next row {self.next_row}"
+        )
+
+    def _delete_stale(self):
+        """
+        Drop manifest entries superseded in this run: older hashes of every case seen,
+        plus (on a complete pass) every case not seen at all.
+        """
+        stale: List[Tuple[str, str]] = []
+        for pmc_id, hashes in self.manifest.cases.items():
+            seen = self._seen.get(pmc_id)
+            if seen is None and not self.prune_missing:
+                continue
+            stale.extend((pmc_id, h) for h in hashes if not seen or h not in seen)
+        if not stale:
+            return
+        # By id, not by hash alone: cases with identical text share a content hash.
+        ids = [chunk_id(p, h, i) for p, h in stale for i in range(self.manifest.chunk_count(p, h))]
+        self.counts["deleted_chunks"] += len(ids)
+        self.indexer._delete_ids(ids)
+        self.manifest.remove(stale)
+
+    def _count_case(self, pmc_id: str, known: bool, first: bool):
+        """
+        `new`/`changed`/`unchanged` count cases, not rows: a case is new when the
+        manifest had no entry for it, changed when any of its rows in this run has
+        text the manifest lacks, and unchanged otherwise.
+        """
+        if first:
+            if self.manifest is None or pmc_id not in self.manifest.cases:
+                status = "new"
+            else:
+                status = "unchanged" if known else "changed"
+            self._status[pmc_id] = status
+            self.counts[status] += 1
+        elif not known and self._status[pmc_id] == "unchanged":
+            self._status[pmc_id] = "changed"
+            self.counts["unchanged"] -= 1
+            self.counts["changed"] += 1
+
+    def _chunked(self, rows: Iterable[Dict[str, Any]], start_row: int) -> Iterator[ChunkedRow]:
+        blocks = _blocks(enumerate(rows, start=start_row), ROWS_PER_TASK)
+        if self.workers <= 0:
+            for block in blocks:
+                yield from chunk_block(block)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # Bounded look-ahead keeps the dataset streaming instead of materializing it.
+            pending = deque()
+            for block in blocks:
+                pending.append(pool.submit(chunk_block, block))
+                if len(pending) >= self.workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def _batches(self, chunked: Iterator[ChunkedRow]) -> Iterator[Dict[str, Any]]:
+        texts, ids, metadatas, entries = [], [], [], []
+        rows = 0
+        last_row = None
+        for row_index, pmc_id, h, info, chunks in chunked:
+            rows += 1
+            last_row = row_index
+            seen = self._seen.setdefault(pmc_id, set())
+            if h in seen:
+                # A case's text repeats across dataset rows; its chunks (same ids)
+                # are already queued in this run.
+                self.counts["duplicate_rows"] += 1
+            else:
+                known = self.manifest is not None and self.manifest.contains(pmc_id, h)
+                self._count_case(pmc_id, known, first=not seen)
+                if self.incremental and known:
+                    self.counts["skipped_embeddings"] += len(chunks)
+                else:
+                    for idx, chunk in enumerate(chunks):
+                        texts.append(chunk)
+                        ids.append(chunk_id(pmc_id, h, idx))
+                        metadatas.append({"pmc_id": pmc_id, "chunk_index": idx, "content_hash": h})
+                    entries.append({"pmc_id": pmc_id, "hash": h, "chunks": len(chunks), **info})
+                seen.add(h)
+            # Row cap keeps the checkpoint moving through long runs of skipped cases.
+            if len(texts) >= self.batch_size or rows >= self.batch_size:
+                yield {"texts": texts, "ids": ids, "metadatas": metadatas, "entries": entries, "rows": rows, "last_row": last_row}
+                texts, ids, metadatas, entries = [], [], [], []
+                rows = 0
+        if rows:
+            yield {"texts": texts, "ids": ids, "metadatas": metadatas, "entries": entries, "rows": rows, "last_row": last_row}
+
+    def _write_loop(self, write_q: "queue.Queue[Optional[Dict[str, Any]]]"):
+        while True:
+            batch = write_q.get()
+            if batch is None:
+                return
+            if self._error:
+                continue  # drain so the producer never blocks on a dead writer
+            try:
+                if batch["texts"]:
+                    self.indexer._write(batch["texts"], batch["ids"], batch["metadatas"], batch["embeddings"])
+                self.rows_committed += batch["rows"]
+                self.chunks_committed += len(batch["texts"])
+                self.next_row = batch["last_row"] + 1
+                if self.manifest is not None:
+                    self.manifest.record(batch["entries"])
+                if self.checkpoint:
+                    self.checkpoint.save({
+                        "collection": self.indexer.store.name,
+                        "next_row": self.next_row,
+                    })
+            except BaseException as e:
+                self._error = e
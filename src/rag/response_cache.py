@@ -0,0 +1,192 @@
+from typing import Any, Dict, Iterable, List, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from src.config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+
+# Puts between expiry/size sweeps; keeps eviction off the hot path.
+_SWEEP_EVERY = 200
+
+
+def _digest(parts: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def case_of(contexts: Iterable[Dict]) -> Optional[str]:
+    """
+    The single pmc_id all contexts belong to, or None when they span several cases.
+    """
+    ids = {c.get("pmc_id") for c in contexts}
+    return ids.pop() if len(ids) == 1 else None
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache for LLM generations and evaluations.
+
+    Exact tier: the key covers kind, model, prompt template version, temperature,
+    the retrieved context IDs and the question, so any change to what the model
+    would see is a miss. Semantic tier (optional, needs a query encoder): for the
+    same scope (everything except contexts and question) and the same pmc_id, a
+    cached answer is reused when the question embeddings have cosine similarity
+    at or above `semantic_threshold` (0, the default, disables it). Callers pass
+    `semantic=False` for entries that must only ever match exactly.
+    """
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        semantic_threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+        encoder=None,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self.enabled = enabled
+        self.encoder = encoder
+        self.counters = {"hits": 0, "semantic_hits": 0, "misses": 0, "puts": 0, "bypassed": 0}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, scope TEXT, pmc_id TEXT, question TEXT,"
+                " embedding BLOB, value TEXT, created REAL, last_hit REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses(scope, pmc_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_hit ON responses(last_hit)")
+            self._conn = conn
+        return self._conn
+
+    def attach_encoder(self, encoder):
+        self.encoder = encoder
+
+    @staticmethod
+    def scope(kind: str, model: str, template_version: str, temperature: float, **extra) -> str:
+        return _digest({"kind": kind, "model": model, "template": template_version, "temperature": temperature, **extra})
+
+    @staticmethod
+    def make_key(scope: str, context_ids: List[str], question: str) -> str:
+        return _digest({"scope": scope, "contexts": list(context_ids), "question": " ".join(question.split())})
+
+    def get(
+        self, scope: str, key: str, question: str, pmc_id: Optional[str] = None, semantic: bool = True
+    ) -> Optional[str]:
+        if not self.enabled:
+            self.counters["bypassed"] += 1
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._db().execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._db().execute("UPDATE responses SET last_hit = ? WHERE key = ?", (now, key))
+                self._db().commit()
+                self.counters["hits"] += 1
+                return row[0]
+        value = self._get_similar(scope, pmc_id, question, now) if semantic else None
+        with self._lock:
+            self.counters["semantic_hits" if value is not None else "misses"] += 1
+        return value
+
+    def _get_similar(self, scope: str, pmc_id: Optional[str], question: str, now: float) -> Optional[str]:
+        if not pmc_id or self.encoder is None or self.semantic_threshold <= 0:
+            return None
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT key, embedding, value FROM responses"
+                " WHERE scope = ? AND pmc_id = ? AND embedding IS NOT NULL AND created >= ?",
+                (scope, pmc_id, now - self.ttl),
+            ).fetchall()
+        if not rows:
+            return None
+        query = self.encoder.encode(question)
+        matrix = np.vstack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+        sims = matrix @ query
+        best = int(np.argmax(sims))
+        if sims[best] < self.semantic_threshold:
+            return None
+        with self._lock:
+            self._db().execute("UPDATE responses SET last_hit = ? WHERE key = ?", (now, rows[best][0]))
+            self._db().commit()
+        return rows[best][2]
+
+    def put(
+        self, scope: str, key: str, value: str, question: str, pmc_id: Optional[str] = None, semantic: bool = True
+    ):
+        if not self.enabled:
+            return
+        embedding = None
+        if semantic and pmc_id and self.encoder is not None and self.semantic_threshold > 0:
+            embedding = self.encoder.encode(question).astype(np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO responses (key, scope, pmc_id, question, embedding, value, created, last_hit)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, scope, pmc_id, question, embedding, value, now, now),
+            )
+            self._db().commit()
+            self.counters["puts"] += 1
+            if self.counters["puts"] % _SWEEP_EVERY == 0:
+                self._sweep(now)
+
+    def _sweep(self, now: float):
+        db = self._db()
+        db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        count = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            db.execute(
+                "DELETE FROM responses WHERE key IN"
+                " (SELECT key FROM responses ORDER BY last_hit ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db().execute("DELETE FROM responses")
+            self._db().commit()
+
+    def stats(self) -> Dict[str, Any]:
+        c = dict(self.counters)
+        lookups = c["hits"] + c["semantic_hits"] + c["misses"]
+        c["hit_rate"] = (c["hits"] + c["semantic_hits"]) / lookups if lookups else 0.0
+        c["enabled"] = self.enabled
+        return c
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """
+    Process-wide response cache shared by OllamaLLM and the evaluator.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -1,51 +1,82 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
+import os
 import random
 
-import chromadb
-from chromadb.config import Settings
-
-from src.config import PERSIST_DIR, COLLECTION_NAME, DEFAULT_TOP_K
+from src.config import COLLECTION_NAME, DEFAULT_TOP_K, EMBEDDING_MODEL_NAME, CASE_CATALOG_FILE
+from src.rag.embeddings import QueryEncoder
+from src.rag.case_context import CaseContext
+from src.rag.case_catalog import CaseCatalog
+from src.rag import tracing
+from src.rag.vector_store import VectorStore, open_store
 
 
 class ChromaRetriever:
-    def __init__(self, persist_dir: str = PERSIST_DIR, collection_name: str = COLLECTION_NAME):
-        self.client = chromadb.PersistentClient(path=persist_dir, settings=Settings(allow_reset=True))
-        self.collection = self.client.get_or_create_collection(collection_name)
+    """
+    Query-side view of the index. Searches go through a VectorStore: the Chroma
+    collection by default, or the read-only NumPy export when VECTOR_BACKEND=numpy
+    (or when a store is passed in).
+    """
+
+    def __init__(
+        self,
+        persist_dir: Optional[str] = None,
+        collection_name: str = COLLECTION_NAME,
+        encoder: Optional[QueryEncoder] = None,
+        store: Optional[VectorStore] = None,
+        backend: Optional[str] = None,
+    ):
+        self.store = store or open_store(backend, persist_dir, collection_name)
+        # Indexes built before the model was recorded used the configured default.
+        self.embedding_model = self.store.embedding_model or EMBEDDING_MODEL_NAME
+        if encoder is not None and encoder.model_name != self.embedding_model:
+            raise ValueError(
+                f"Query encoder '{encoder.model_name}' does not match index model '{self.embedding_model}'"
+            )
+        self.encoder = encoder or QueryEncoder(self.embedding_model)
+        # Memory-mapped case catalog written next to the store; None for indexes built without one.
+        self.catalog = CaseCatalog.open(os.path.join(self.store.path, CASE_CATALOG_FILE))
 
     def retrieve(self, query: str, top_k: int = DEFAULT_TOP_K, pmc_id: Optional[str] = None) -> List[Dict[str, Any]]:
-        where = {"pmc_id": pmc_id} if pmc_id else None
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=top_k,
-            include=["metadatas", "documents", "distances"],
-            where=where,
-        )
-        docs: List[Dict[str, Any]] = []
-        if not results or not results.get("documents"):
-            return docs
-        docs_list = results["documents"][0]
-        metas_list = results.get("metadatas", [[]])[0]
-        dists_list = results.get("distances", [[]])[0]
-        for text, meta, dist in zip(docs_list, metas_list, dists_list):
-            docs.append({
-                "text": text,
-                "pmc_id": meta.get("pmc_id"),
-                "chunk_index": meta.get("chunk_index"),
-                "score": float(dist),
-            })
-        return docs
-
-    def sample_pmc_id(self, sample_limit: int = 1000) -> Optional[str]:
+        return self.retrieve_many([query], top_k=top_k, pmc_id=pmc_id)[0]
+
+    def retrieve_many(
+        self, queries: Sequence[str], top_k: int = DEFAULT_TOP_K, pmc_id: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve for several queries at once: one batched encode and one multi-query store call.
+        Returns one result list per query, in input order.
+        """
+        if not queries:
+            return []
+        with tracing.span("embed", queries=len(queries)):
+            embeddings = self.encoder.encode_many(queries)
+        with tracing.span("vector_search", backend=self.store.backend, top_k=top_k, filtered=pmc_id is not None):
+            return self.store.query(embeddings, top_k=top_k, pmc_id=pmc_id)
+
+    def load_case(self, pmc_id: str) -> CaseContext:
+        """
+        Fetch every chunk of one case with its embedding (a single store call) so that
+        later turns can be ranked in memory via CaseContext.retrieve.
         """
-        Sample a random case by selecting a random metadata row among first-chunk entries.
+        with tracing.span("case_load", backend=self.store.backend):
+            return CaseContext.load(self.store, pmc_id, self.encoder)
+
+    def sample_pmc_id(
+        self,
+        sample_limit: int = 1000,
+        specialty: Optional[str] = None,
+        min_chunks: Optional[int] = None,
+        stratified: bool = False,
+    ) -> Optional[str]:
         """
+        Sample a random case. Uses the case catalog (uniform, filtered or stratified by
+        specialty) when the index has one; otherwise falls back to a random first-chunk
+        row among the first `sample_limit` stored, and filters are ignored.
+        """
+        if self.catalog is not None:
+            return self.catalog.sample(specialty=specialty, min_chunks=min_chunks, stratified=stratified)
         try:
-            res = self.collection.get(where={"chunk_index": 0}, include=["metadatas"], limit=sample_limit)
-            metas = res.get("metadatas") or []
-            if not metas:
-                return None
-            flat = metas  # already a flat list per chroma get
-            candidates = [m.get("pmc_id") for m in flat if m and m.get("pmc_id")]
+            candidates = self.store.first_chunk_pmc_ids(sample_limit)
             if not candidates:
                 return None
             return random.choice(candidates)
@@ -0,0 +1,204 @@
+from typing import Any, Callable, Dict, Iterable, Optional
+import threading
+import time
+
+from src.config import EVAL_CONCURRENCY
+from src.rag.scheduler import get_scheduler
+
+
+class _Resource:
+    def __init__(self, factory: Callable[[], Any], warm: Optional[Callable[[Any], None]] = None):
+        self.factory = factory
+        self.warm = warm
+        self.instance: Any = None
+        self.build_seconds = 0.0
+        self.warm_seconds = 0.0
+        self.warmed = False
+        self.hits = 0
+        self.lock = threading.Lock()
+
+
+class RuntimeRegistry:
+    """
+    Process-wide registry of long-lived resources (retriever, LLM client, embedder).
+
+    Streamlit re-executes the app script on every interaction, but imported modules
+    stay loaded for the life of the server process, so instances held here are shared
+    by every rerun and every browser session. Each resource is built at most once;
+    later lookups count as hits and accumulate the setup time they avoided.
+    """
+
+    def __init__(self):
+        self._resources: Dict[str, _Resource] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], warm: Optional[Callable[[Any], None]] = None):
+        with self._lock:
+            self._resources[name] = _Resource(factory, warm)
+
+    def get(self, name: str) -> Any:
+        res = self._resources[name]
+        if res.instance is None:
+            with res.lock:
+                if res.instance is None:
+                    start = time.perf_counter()
+                    instance = res.factory()
+                    res.build_seconds = time.perf_counter() - start
+                    res.instance = instance
+                    return instance
+        with self._lock:
+            res.hits += 1
+        return res.instance
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        Build the named resources (all by default) and run their warm-up hooks once.
+        Returns seconds spent per resource; already-warm resources report 0.
+        """
+        timings: Dict[str, float] = {}
+        for name in list(names or self._resources.keys()):
+            res = self._resources[name]
+            if res.warmed:
+                timings[name] = 0.0
+                continue
+            start = time.perf_counter()
+            instance = self.get(name)
+            with res.lock:
+                if not res.warmed:
+                    if res.warm:
+                        warm_start = time.perf_counter()
+                        res.warm(instance)
+                        res.warm_seconds = time.perf_counter() - warm_start
+                    res.warmed = True
+            timings[name] = time.perf_counter() - start
+        return timings
+
+    def is_ready(self, name: str) -> bool:
+        return self._resources[name].instance is not None
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-resource setup cost and reuse counts. `saved_seconds` is the construction
+        time that reused lookups would otherwise have paid again.
+        """
+        out: Dict[str, Dict[str, float]] = {}
+        for name, res in self._resources.items():
+            setup = res.build_seconds + res.warm_seconds
+            out[name] = {
+                "ready": res.instance is not None,
+                "build_seconds": res.build_seconds,
+                "warm_seconds": res.warm_seconds,
+                "hits": res.hits,
+                "saved_seconds": setup * res.hits,
+            }
+        return out
+
+
+def _build_retriever():
+    from src.rag.retriever import ChromaRetriever
+    return ChromaRetriever()
+
+
+def _warm_retriever(retriever) -> None:
+    # First query loads the encoder weights and the HNSW segment (or mapped pages) into memory.
+    if retriever.store.count() > 0:
+        retriever.retrieve("chief complaint", top_k=1)
+
+
+def _build_llm():
+    from src.rag.llm import OllamaLLM
+    return OllamaLLM(cache=get_response_cache())
+
+
+def _warm_llm(llm) -> None:
+    # Opens the pooled keep-alive connections; does not load the model.
+    llm.scheduler.ping()
+
+
+def _build_embedder():
+    # The retriever owns the query encoder matching the index model; share that one.
+    return get_retriever().encoder
+
+
+def _warm_embedder(embedder) -> None:
+    embedder.encode_many(["warm-up"])
+
+
+def _build_response_cache():
+    from src.rag.response_cache import get_cache
+    cache = get_cache()
+    # Semantic matching reuses the retriever's query encoder (and its vector cache).
+    cache.attach_encoder(get_embedder())
+    return cache
+
+
+def _build_chunk_texts():
+    from src.rag.history import ChunkTextCache
+    return ChunkTextCache(get_retriever().store)
+
+
+def _build_eval_executor():
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=EVAL_CONCURRENCY, thread_name_prefix="eval")
+
+
+registry = RuntimeRegistry()
+registry.register("retriever", _build_retriever, _warm_retriever)
+registry.register("llm", _build_llm, _warm_llm)
+registry.register("embedder", _build_embedder, _warm_embedder)
+registry.register("response_cache", _build_response_cache)
+registry.register("eval_executor", _build_eval_executor)
+registry.register("chunk_texts", _build_chunk_texts)
+
+
+def get_retriever():
+    return registry.get("retriever")
+
+
+def get_llm():
+    return registry.get("llm")
+
+
+def get_embedder():
+    return registry.get("embedder")
+
+
+def get_response_cache():
+    return registry.get("response_cache")
+
+
+def get_eval_executor():
+    return registry.get("eval_executor")
+
+
+def get_chunk_texts():
+    return registry.get("chunk_texts")
+
+
+def warm_up(names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    return registry.warm_up(names)
+
+
+def metrics() -> Dict[str, Dict[str, float]]:
+    return registry.metrics()
+
+
+def scheduler_metrics() -> Dict[str, Any]:
+    return get_scheduler().metrics()
+
+
+def health() -> Dict[str, Any]:
+    """
+    Readiness summary: which shared resources are built, whether the vector store
+    answers, and whether Ollama is reachable.
+    """
+    status: Dict[str, Any] = {name: registry.is_ready(name) for name in ("retriever", "llm", "embedder")}
+    try:
+        status["index_chunks"] = get_retriever().store.count()
+        status["index_ok"] = True
+    except Exception:
+        status["index_chunks"] = 0
+        status["index_ok"] = False
+    status["ollama_ok"] = get_scheduler().ping()
+    status["ready"] = bool(status["index_ok"] and status["ollama_ok"])
+    return status
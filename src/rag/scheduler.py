@@ -0,0 +1,389 @@
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+import requests
+
+from src.config import (
+    OLLAMA_ENDPOINTS,
+    OLLAMA_TIMEOUT,
+    OLLAMA_MAX_CONCURRENCY,
+    OLLAMA_MAX_QUEUE,
+    OLLAMA_QUEUE_TIMEOUT,
+    OLLAMA_RETRIES,
+)
+from src.rag import ollama_client, tracing
+
+# Lower runs first. Patient/QA replies are interactive; scoring can wait.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EVALUATION = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_EVALUATION: "evaluation", PRIORITY_BATCH: "batch"}
+
+# Seconds an endpoint is skipped after a connection error or 5xx.
+_COOLDOWN = 10.0
+# Queue-wait samples kept per priority for percentiles.
+_WAIT_SAMPLES = 1000
+
+
+class SchedulerBusy(RuntimeError):
+    """
+    Raised when the queue is full or a request waited longer than the queue timeout.
+    """
+
+
+class _Endpoint:
+    def __init__(self, url: str, limit: int):
+        self.url = url.rstrip('/')
+        self.limit = limit
+        self.active = 0
+        self.served = 0
+        self.errors = 0
+        self.down_until = 0.0
+
+
+class _Waiter:
+    def __init__(self, priority: int, exclude: Optional[str]):
+        self.priority = priority
+        self.exclude = exclude
+        self.enqueued = time.perf_counter()
+        self.endpoint: Optional[_Endpoint] = None
+        self.abandoned = False
+
+
+def _retryable(exc: Exception) -> bool:
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(exc, "response", None)
+    return response is not None and response.status_code >= 500
+
+
+def dedup_key(payload: Dict[str, Any], api: str) -> str:
+    return hashlib.sha1(f"{api}:{json.dumps(payload, sort_keys=True, default=str)}".encode("utf-8")).hexdigest()
+
+
+class _SchedulerBase:
+    """
+    Endpoint selection, queue bookkeeping and metrics shared by the thread-based
+    OllamaScheduler and the asyncio one in ollama_async.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[str] = OLLAMA_ENDPOINTS,
+        max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+        max_queue: int = OLLAMA_MAX_QUEUE,
+        queue_timeout: float = OLLAMA_QUEUE_TIMEOUT,
+        retries: int = OLLAMA_RETRIES,
+        timeout: float = OLLAMA_TIMEOUT,
+    ):
+        if not endpoints:
+            raise ValueError("At least one Ollama endpoint is required")
+        self.endpoints = [_Endpoint(url, max_concurrency) for url in endpoints]
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.timeout = timeout
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._waiting = 0
+        self._waits: Dict[int, Deque[float]] = {p: deque(maxlen=_WAIT_SAMPLES) for p in PRIORITY_NAMES}
+        self.counters = {
+            "requests": 0, "dedup_hits": 0, "rejected": 0, "timeouts": 0, "retries": 0, "errors": 0, "peak_queue": 0,
+        }
+
+    @property
+    def endpoint(self) -> str:
+        return self.endpoints[0].url
+
+    def _pick(self, now: float, exclude: Optional[str] = None) -> Optional[_Endpoint]:
+        free = [e for e in self.endpoints if e.active < e.limit]
+        if any(now >= e.down_until for e in self.endpoints):
+            free = [e for e in free if now >= e.down_until]
+        # else every endpoint is cooling down: keep trying them rather than stalling the queue
+        candidates = [e for e in free if e.url != exclude] or free
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (e.active / e.limit, e.served))
+
+    def _hand_out(self) -> List[_Waiter]:
+        # Give free slots to queued waiters in priority order; returns the waiters served.
+        now = time.time()
+        served = []
+        while self._heap:
+            _, _, waiter = self._heap[0]
+            if waiter.abandoned:
+                heapq.heappop(self._heap)
+                continue
+            endpoint = self._pick(now, waiter.exclude)
+            if endpoint is None:
+                break
+            heapq.heappop(self._heap)
+            self._waiting -= 1
+            endpoint.active += 1
+            waiter.endpoint = endpoint
+            served.append(waiter)
+        return served
+
+    def _settle(
+        self, endpoint: _Endpoint, error: Optional[Exception], retryable: Callable[[Exception], bool] = _retryable
+    ):
+        endpoint.active -= 1
+        endpoint.served += 1
+        if error is not None:
+            endpoint.errors += 1
+            self.counters["errors"] += 1
+            if retryable(error):
+                endpoint.down_until = time.time() + _COOLDOWN
+
+    def _snapshot(self) -> Dict[str, Any]:
+        # Caller holds whatever lock guards the queue.
+        queued: Dict[str, int] = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, waiter in self._heap:
+            if not waiter.abandoned:
+                queued[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return {
+            "queued": queued,
+            "waits": {p: list(samples) for p, samples in self._waits.items()},
+            "endpoints": [
+                {
+                    "url": e.url,
+                    "active": e.active,
+                    "limit": e.limit,
+                    "served": e.served,
+                    "errors": e.errors,
+                    "healthy": time.time() >= e.down_until,
+                }
+                for e in self.endpoints
+            ],
+            "counters": dict(self.counters),
+        }
+
+    @staticmethod
+    def _report(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        wait_stats = {}
+        for priority, samples in snapshot["waits"].items():
+            if samples:
+                arr = np.asarray(samples)
+                wait_stats[PRIORITY_NAMES[priority]] = {
+                    "n": len(samples),
+                    "p50_s": float(np.percentile(arr, 50)),
+                    "p95_s": float(np.percentile(arr, 95)),
+                    "max_s": float(arr.max()),
+                }
+        return {
+            "queue_depth": sum(snapshot["queued"].values()),
+            "queued": snapshot["queued"],
+            "in_flight": sum(e["active"] for e in snapshot["endpoints"]),
+            "wait": wait_stats,
+            "endpoints": snapshot["endpoints"],
+            **snapshot["counters"],
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        return self._report(self._snapshot())
+
+
+class OllamaScheduler(_SchedulerBase):
+    """
+    Front door for every generation call.
+
+    Requests take a slot on one of the configured Ollama endpoints; each endpoint
+    accepts at most `max_concurrency` requests at once (match Ollama's
+    OLLAMA_NUM_PARALLEL) and the endpoint with the fewest outstanding requests
+    relative to its limit is chosen. When every slot is busy, requests wait in a
+    priority queue, so a patient reply overtakes queued evaluations. The queue is
+    bounded: past `max_queue` waiters, or after `queue_timeout` seconds of waiting,
+    SchedulerBusy is raised instead of letting requests pile up until the HTTP
+    timeout. Identical non-streaming requests already in flight share one upstream
+    call. Connection errors and 5xx responses put the endpoint in a short cooldown
+    and are retried on another endpoint.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+        self._inflight: Dict[str, Future] = {}
+
+    # -- slots -------------------------------------------------------------
+
+    def _dispatch(self):
+        # Called with the lock held: hand free slots to the highest-priority waiters.
+        self._hand_out()
+        self._cond.notify_all()
+
+    def _acquire(
+        self, priority: int, exclude: Optional[str] = None, cancelled: Optional[Callable[[], bool]] = None
+    ) -> _Endpoint:
+        waiter = _Waiter(priority, exclude)
+        deadline = time.perf_counter() + self.queue_timeout
+        with self._cond:
+            self.counters["requests"] += 1
+            if not self._heap:
+                endpoint = self._pick(time.time(), exclude)
+                if endpoint is not None:
+                    endpoint.active += 1
+                    self._waits[priority].append(0.0)
+                    tracing.record("ollama.queue_wait", 0.0, priority=PRIORITY_NAMES[priority])
+                    return endpoint
+            if self._waiting >= self.max_queue:
+                self.counters["rejected"] += 1
+                raise SchedulerBusy(f"Ollama queue is full ({self._waiting} waiting)")
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+            self._waiting += 1
+            self.counters["peak_queue"] = max(self.counters["peak_queue"], self._waiting)
+            self._dispatch()
+            while waiter.endpoint is None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or (cancelled is not None and cancelled()):
+                    waiter.abandoned = True
+                    self._waiting -= 1
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise SchedulerBusy(f"No Ollama slot free after {self.queue_timeout:.0f}s")
+                    raise SchedulerBusy("Request cancelled while queued")
+                # Wake periodically so cooldowns expire and cancellation is noticed.
+                self._cond.wait(timeout=min(remaining, 0.5))
+                self._dispatch()
+            wait = time.perf_counter() - waiter.enqueued
+            self._waits[priority].append(wait)
+        tracing.record("ollama.queue_wait", wait, priority=PRIORITY_NAMES[priority])
+        return waiter.endpoint
+
+    def _release(self, endpoint: _Endpoint, error: Optional[Exception] = None):
+        with self._cond:
+            self._settle(endpoint, error)
+            self._dispatch()
+
+    # -- calls -------------------------------------------------------------
+
+    def _call(self, fn: Callable[[str], Any], priority: int) -> Any:
+        exclude = None
+        for attempt in range(self.retries + 1):
+            endpoint = self._acquire(priority, exclude)
+            try:
+                result = fn(endpoint.url)
+            except Exception as exc:
+                self._release(endpoint, exc)
+                if attempt < self.retries and _retryable(exc):
+                    with self._cond:
+                        self.counters["retries"] += 1
+                    exclude = endpoint.url
+                    continue
+                raise
+            self._release(endpoint)
+            return result
+
+    def generate(self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE, api: str = "generate") -> Dict[str, Any]:
+        """
+        Non-streaming /api/generate (or /api/chat) through the queue. A request identical
+        to one already in flight waits for that call's result instead of sending another.
+        """
+        payload = dict(payload, stream=False)
+        key = dedup_key(payload, api)
+        with self._cond:
+            leader = self._inflight.get(key)
+            if leader is None:
+                future: Future = Future()
+                self._inflight[key] = future
+            else:
+                self.counters["dedup_hits"] += 1
+        if leader is not None:
+            return leader.result()
+        post = ollama_client.chat if api == "chat" else ollama_client.generate
+        try:
+            result = self._call(lambda url: post(payload, endpoint=url, timeout=self.timeout), priority)
+            future.set_result(result)
+            return result
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def stream(
+        self,
+        payload: Dict[str, Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        on_complete: Optional[Callable[[str], None]] = None,
+        api: str = "generate",
+    ) -> "ScheduledStream":
+        """
+        Streaming call through the queue: the slot is taken when iteration starts and
+        held until the stream ends or is cancelled.
+        """
+        return ScheduledStream(self, priority, payload, on_complete=on_complete, api=api)
+
+    def ping(self) -> bool:
+        return any(ollama_client.ping(e.url) for e in self.endpoints)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            snapshot = self._snapshot()
+        return self._report(snapshot)
+
+
+class ScheduledStream(ollama_client.TokenStream):
+    """
+    TokenStream that waits for a scheduler slot before connecting. A failure before
+    the first token is retried on another endpoint. `stats` gains `queue_wait_s` and
+    `endpoint`.
+    """
+
+    def __init__(
+        self,
+        scheduler: OllamaScheduler,
+        priority: int,
+        payload: Dict[str, Any],
+        on_complete: Optional[Callable[[str], None]] = None,
+        api: str = "generate",
+    ):
+        super().__init__(payload, endpoint=scheduler.endpoint, timeout=scheduler.timeout, on_complete=on_complete, api=api)
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def __iter__(self):
+        exclude = None
+        for attempt in range(self.scheduler.retries + 1):
+            queued_at = time.perf_counter()
+            endpoint = self.scheduler._acquire(self.priority, exclude, cancelled=lambda: self.cancelled)
+            wait = time.perf_counter() - queued_at
+            self.endpoint = endpoint.url
+            error: Optional[Exception] = None
+            try:
+                yield from super().__iter__()
+                return
+            except Exception as exc:
+                error = exc
+                if self._parts or attempt >= self.scheduler.retries or not _retryable(exc):
+                    raise
+                with self.scheduler._cond:
+                    self.scheduler.counters["retries"] += 1
+                exclude = endpoint.url
+            finally:
+                self.scheduler._release(endpoint, error)
+                self.stats = dict(self.stats, queue_wait_s=wait, endpoint=endpoint.url)
+
+
+_scheduler: Optional[OllamaScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> OllamaScheduler:
+    """
+    Process-wide scheduler over OLLAMA_ENDPOINTS, shared by the LLM client and the evaluator.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = OllamaScheduler()
+    return _scheduler
@@ -0,0 +1,256 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+import json
+import os
+import threading
+import time
+import uuid
+
+from src.config import TRACE_LOG, TRACE_KEEP
+
+# Upper bounds (seconds) of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histograms:
+    """
+    Cumulative per-stage latency histograms and counters for the process, in the
+    shape Prometheus expects (bucket counts, sum, count).
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._hist: Dict[str, Dict[str, Any]] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            h = self._hist.get(stage)
+            if h is None:
+                h = self._hist[stage] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h["buckets"][i] += 1
+                    break
+            h["sum"] += seconds
+            h["count"] += 1
+
+    def add(self, counter: str, value: float = 1.0):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0.0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            hist = {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]} for k, v in self._hist.items()}
+            return {"histograms": hist, "counters": dict(self._counters)}
+
+    def prometheus_text(self) -> str:
+        snap = self.snapshot()
+        lines = [
+            "# HELP medsim_stage_seconds Latency of each stage of a RAG turn.",
+            "# TYPE medsim_stage_seconds histogram",
+        ]
+        for stage, h in sorted(snap["histograms"].items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, h["buckets"]):
+                cumulative += n
+                lines.append(f'medsim_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'medsim_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h["count"]}')
+            lines.append(f'medsim_stage_seconds_sum{{stage="{stage}"}} {h["sum"]:.6f}')
+            lines.append(f'medsim_stage_seconds_count{{stage="{stage}"}} {h["count"]}')
+        for counter, value in sorted(snap["counters"].items()):
+            lines.append(f"# TYPE medsim_{counter} counter")
+            lines.append(f"medsim_{counter} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Count, mean and approximate p50/p95 (bucket upper bounds) per stage.
+        """
+        out = {}
+        for stage, h in self.snapshot()["histograms"].items():
+            if not h["count"]:
+                continue
+            out[stage] = {
+                "count": h["count"],
+                "mean_s": h["sum"] / h["count"],
+                "p50_s": self._quantile(h, 0.5),
+                "p95_s": self._quantile(h, 0.95),
+            }
+        return out
+
+    def _quantile(self, h: Dict[str, Any], q: float) -> float:
+        target, seen = q * h["count"], 0
+        for bound, n in zip(self.buckets, h["buckets"]):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Trace:
+    """
+    Spans recorded for one unit of work (a chat turn, a background evaluation),
+    tagged with the session and turn they belong to.
+    """
+
+    def __init__(self, name: str, session_id: Optional[str] = None, turn_id: Any = None, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.session_id = session_id
+        self.turn_id = turn_id
+        self.attrs = attrs
+        self.started = time.time()
+        self.total_s: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter()
+
+    def add(self, name: str, start: float, duration: float, attrs: Dict[str, Any]):
+        self.spans.append({"name": name, "offset_s": max(0.0, start - self._t0), "duration_s": duration, **attrs})
+
+    def breakdown(self) -> Dict[str, float]:
+        """
+        Seconds per stage name, summed over repeated spans.
+        """
+        out: Dict[str, float] = {}
+        for s in self.spans:
+            out[s["name"]] = out.get(s["name"], 0.0) + s["duration_s"]
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "session_id": self.session_id,
+            "turn_id": self.turn_id,
+            "started": self.started,
+            "total_s": self.total_s,
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("medsim_trace", default=None)
+histograms = Histograms()
+_recent: Deque[Trace] = deque(maxlen=TRACE_KEEP)
+_log_lock = threading.Lock()
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def _export(t: Trace):
+    _recent.append(t)
+    if not TRACE_LOG:
+        return
+    line = json.dumps(t.to_dict(), default=str)
+    with _log_lock:
+        os.makedirs(os.path.dirname(TRACE_LOG) or ".", exist_ok=True)
+        with open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def trace(name: str, session_id: Optional[str] = None, turn_id: Any = None, **attrs) -> Iterator[Trace]:
+    """
+    Make a new Trace current for the block. Spans recorded inside it (in this thread,
+    or in work started with `bind`) are attached to it; on exit the total time is
+    observed as stage `<name>` and the trace is kept in memory and appended to
+    TRACE_LOG as one JSON line.
+    """
+    t = Trace(name, session_id, turn_id, **attrs)
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        _current.reset(token)
+        t.total_s = time.perf_counter() - t._t0
+        histograms.observe(name, t.total_s)
+        _export(t)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    Time a stage. The yielded dict can be filled with attributes (e.g. a cache hit)
+    before the block ends. Always feeds the histograms; attached to the current
+    trace when there is one.
+    """
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        duration = time.perf_counter() - start
+        histograms.observe(name, duration)
+        t = _current.get()
+        if t is not None:
+            t.add(name, start, duration, attrs)
+
+
+def record(name: str, seconds: float, **attrs):
+    """
+    Record a stage measured elsewhere (e.g. durations Ollama reports), ending now.
+    """
+    histograms.observe(name, seconds)
+    t = _current.get()
+    if t is not None:
+        t.add(name, time.perf_counter() - seconds, seconds, attrs)
+
+
+def record_ollama(body: Dict[str, Any], api: str):
+    """
+    Capture the timing fields of Ollama's final response: model load, prompt
+    evaluation and generation, with their token counts.
+    """
+    if body.get("load_duration"):
+        record("ollama.load", body["load_duration"] / 1e9, api=api)
+    if body.get("prompt_eval_duration"):
+        record("ollama.prompt_eval", body["prompt_eval_duration"] / 1e9, api=api, tokens=body.get("prompt_eval_count"))
+    if body.get("eval_duration"):
+        record("ollama.eval", body["eval_duration"] / 1e9, api=api, tokens=body.get("eval_count"))
+    if body.get("prompt_eval_count"):
+        histograms.add("ollama_prompt_tokens_total", body["prompt_eval_count"])
+    if body.get("eval_count"):
+        histograms.add("ollama_eval_tokens_total", body["eval_count"])
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap `fn` to run in a copy of the caller's context, so spans from an executor
+    thread land in the caller's trace.
+    """
+    ctx = copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def run_traced(name: str, fn: Callable[..., Any], *args, parent: Optional[Trace] = None, **kwargs) -> Any:
+    """
+    Run `fn` in its own trace, tagged with `parent`'s session and turn (for
+    background work that outlives the turn that started it).
+    """
+    session_id = parent.session_id if parent is not None else None
+    turn_id = parent.turn_id if parent is not None else None
+    with trace(name, session_id=session_id, turn_id=turn_id):
+        return fn(*args, **kwargs)
+
+
+def recent(session_id: Optional[str] = None, turn_id: Any = None) -> List[Trace]:
+    """
+    Finished traces still held in memory, oldest first, optionally filtered.
+    """
+    return [
+        t for t in list(_recent)
+        if (session_id is None or t.session_id == session_id) and (turn_id is None or t.turn_id == turn_id)
+    ]
+
+
+def prometheus_text() -> str:
+    return histograms.prometheus_text()
+
+
+def traces_jsonl(session_id: Optional[str] = None) -> str:
+    return "".join(json.dumps(t.to_dict(), default=str) + "\n" for t in recent(session_id))
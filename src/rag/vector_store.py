@@ -0,0 +1,513 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import json
+import os
+import shutil
+
+import numpy as np
+
+from src.config import (
+    PERSIST_DIR,
+    COLLECTION_NAME,
+    VECTOR_BACKEND,
+    VECTOR_STORE_DIR,
+)
+
+# One page of chunks: ids, texts, metadatas, embeddings (row-aligned).
+Page = Tuple[List[str], List[str], List[Dict[str, Any]], np.ndarray]
+
+# Rows scored per matmul in exact search; bounds the float32 temporary for float16/int8 stores.
+_SCAN_ROWS = 65536
+
+
+def _hit(doc_id: str, text: str, meta: Dict[str, Any], score: float) -> Dict[str, Any]:
+    return {
+        "id": doc_id,
+        "text": text,
+        "pmc_id": (meta or {}).get("pmc_id"),
+        "chunk_index": (meta or {}).get("chunk_index"),
+        "score": float(score),
+    }
+
+
+class VectorStore(ABC):
+    """
+    What ChromaIndexer and ChromaRetriever need from a vector store. Scores follow
+    Chroma's default space for normalized vectors: squared L2 distance, 2 - 2·cosine,
+    lower is closer.
+    """
+
+    backend = ""
+    path = ""
+    name = ""
+    read_only = False
+
+    @property
+    @abstractmethod
+    def embedding_model(self) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    @abstractmethod
+    def query(
+        self, embeddings: np.ndarray, top_k: int, pmc_id: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    def get_case(self, pmc_id: str) -> Page:
+        """
+        Every chunk of one case with its embedding (unordered).
+        """
+
+    @abstractmethod
+    def get_texts(self, refs: Sequence[Tuple[str, Optional[str]]]) -> Dict[str, str]:
+        """
+        Chunk text by id for (id, pmc_id) pairs; ids not in the store are left out.
+        """
+
+    @abstractmethod
+    def first_chunk_pmc_ids(self, limit: int) -> List[str]:
+        ...
+
+    @abstractmethod
+    def iter_pages(self, page_size: int = 5000) -> Iterator[Page]:
+        ...
+
+    @abstractmethod
+    def upsert(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]], embeddings):
+        ...
+
+    @abstractmethod
+    def delete_ids(self, ids: Sequence[str], batch_size: int = 500):
+        ...
+
+    @abstractmethod
+    def reset(self):
+        ...
+
+
+class ChromaStore(VectorStore):
+    """
+    Chroma PersistentClient collection (read/write; the store the index is built in).
+    """
+
+    backend = "chroma"
+
+    def __init__(self, persist_dir: str = PERSIST_DIR, collection_name: str = COLLECTION_NAME, metadata=None):
+        import chromadb
+        from chromadb.config import Settings
+
+        os.makedirs(persist_dir, exist_ok=True)
+        self.path = persist_dir
+        self.client = chromadb.PersistentClient(path=persist_dir, settings=Settings(allow_reset=True))
+        self._metadata = metadata
+        self.collection = self.client.get_or_create_collection(collection_name, metadata=metadata)
+        self.name = self.collection.name
+
+    @property
+    def embedding_model(self) -> Optional[str]:
+        return (self.collection.metadata or {}).get("embedding_model")
+
+    def record_embedding_model(self, model: str):
+        """
+        Store the embedding model in the collection metadata so the retriever can encode
+        queries with the same model. Refuse to mix models within one collection.
+        """
+        metadata = dict(self.collection.metadata or {})
+        recorded = metadata.get("embedding_model")
+        if recorded == model:
+            return
+        if recorded and self.collection.count() > 0:
+            raise ValueError(
+                f"Collection '{self.collection.name}' was built with '{recorded}', "
+                f"not '{model}'. Rebuild with --reset to switch models."
+            )
+        metadata = {k: v for k, v in metadata.items() if not k.startswith("hnsw:")}
+        metadata["embedding_model"] = model
+        self.collection.modify(metadata=metadata)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def query(self, embeddings: np.ndarray, top_k: int, pmc_id: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        results = self.collection.query(
+            query_embeddings=np.asarray(embeddings).tolist(),
+            n_results=top_k,
+            include=["metadatas", "documents", "distances"],
+            where={"pmc_id": pmc_id} if pmc_id else None,
+        )
+        out: List[List[Dict[str, Any]]] = [[] for _ in range(len(embeddings))]
+        if not results or not results.get("documents"):
+            return out
+        ids_all = results.get("ids") or [[] for _ in out]
+        metas_all = results.get("metadatas") or [[] for _ in out]
+        dists_all = results.get("distances") or [[] for _ in out]
+        for qi, (ids_list, docs_list, metas_list, dists_list) in enumerate(
+            zip(ids_all, results["documents"], metas_all, dists_all)
+        ):
+            for doc_id, text, meta, dist in zip(ids_list, docs_list, metas_list, dists_list):
+                out[qi].append(_hit(doc_id, text, meta, dist))
+        return out
+
+    def get_case(self, pmc_id: str) -> Page:
+        res = self.collection.get(where={"pmc_id": pmc_id}, include=["documents", "metadatas", "embeddings"])
+        embeddings = res.get("embeddings")
+        return (
+            list(res.get("ids") or []),
+            list(res.get("documents") or []),
+            list(res.get("metadatas") or []),
+            np.asarray(embeddings if embeddings is not None else [], dtype=np.float32),
+        )
+
+    def get_texts(self, refs: Sequence[Tuple[str, Optional[str]]]) -> Dict[str, str]:
+        ids = list(dict.fromkeys(doc_id for doc_id, _ in refs))
+        if not ids:
+            return {}
+        res = self.collection.get(ids=ids, include=["documents"])
+        return dict(zip(res.get("ids") or [], res.get("documents") or []))
+
+    def first_chunk_pmc_ids(self, limit: int) -> List[str]:
+        res = self.collection.get(where={"chunk_index": 0}, include=["metadatas"], limit=limit)
+        return [m.get("pmc_id") for m in (res.get("metadatas") or []) if m and m.get("pmc_id")]
+
+    def iter_pages(self, page_size: int = 5000) -> Iterator[Page]:
+        offset = 0
+        while True:
+            res = self.collection.get(
+                include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset
+            )
+            ids = list(res.get("ids") or [])
+            if not ids:
+                return
+            yield ids, list(res["documents"]), list(res["metadatas"]), np.asarray(res["embeddings"], dtype=np.float32)
+            offset += len(ids)
+
+    def upsert(self, ids, texts, metadatas, embeddings):
+        # upsert keeps re-committing a batch after a crash/resume idempotent
+        self.collection.upsert(documents=texts, ids=ids, metadatas=metadatas, embeddings=embeddings)
+
+    def delete_ids(self, ids: Sequence[str], batch_size: int = 500):
+        for i in range(0, len(ids), batch_size):
+            self.collection.delete(ids=list(ids[i:i + batch_size]))
+
+    def reset(self):
+        self.client.delete_collection(self.name)
+        self.collection = self.client.get_or_create_collection(self.name, metadata=self._metadata)
+
+
+class _Strings:
+    """
+    Row-aligned strings stored as one UTF-8 byte array plus an offsets array
+    (row i is bytes[offsets[i]:offsets[i + 1]]), both memory-mapped.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def open(cls, path: str, stem: str) -> "_Strings":
+        return cls(
+            np.load(os.path.join(path, f"{stem}.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, f"{stem}_offsets.npy"), mmap_mode="r"),
+        )
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[int(self.offsets[i]):int(self.offsets[i + 1])].tobytes().decode("utf-8")
+
+    @staticmethod
+    def write(path: str, stem: str, strings: Iterable[str]):
+        offsets = [0]
+        raw = os.path.join(path, f"{stem}.bin.tmp")
+        with open(raw, "wb") as f:
+            for s in strings:
+                b = (s or "").encode("utf-8")
+                f.write(b)
+                offsets.append(offsets[-1] + len(b))
+        np.save(os.path.join(path, f"{stem}_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        data = np.lib.format.open_memmap(
+            os.path.join(path, f"{stem}.npy"), mode="w+", dtype=np.uint8, shape=(offsets[-1],)
+        )
+        if offsets[-1]:
+            data[:] = np.fromfile(raw, dtype=np.uint8)
+        data.flush()
+        del data
+        os.remove(raw)
+
+
+CHUNK_DTYPE = np.dtype([("pmc_id", "S32"), ("chunk_index", "<i4"), ("content_hash", "S16")])
+CASE_RANGE_DTYPE = np.dtype([("pmc_id", "S32"), ("start", "<i8"), ("stop", "<i8")])
+
+
+class NumpyStore(VectorStore):
+    """
+    Read-only, memory-mapped store exported from a Chroma collection.
+
+    Layout of the store directory:
+      embeddings.npy           N x D normalized vectors, float16 or int8
+      scales.npy               per-row dequantization scale (int8 only)
+      texts.npy / ids.npy      UTF-8 bytes, with *_offsets.npy giving row boundaries
+      chunks.npy               per-row pmc_id, chunk_index, content_hash
+      cases.npy                per-pmc_id [start, stop) row range, sorted by pmc_id
+      store.json               embedding model, dtype, counts
+
+    Rows are sorted by (pmc_id, chunk_index), so a case is one contiguous slice.
+    Every array is opened with mmap_mode="r": worker processes share the page cache
+    instead of each holding a copy, and nothing is read until a query touches it.
+    Search is exact: a blocked matmul over all rows (or the case's slice) with
+    top-k selection by argpartition.
+    """
+
+    backend = "numpy"
+    read_only = True
+
+    def __init__(self, path: str = VECTOR_STORE_DIR):
+        with open(os.path.join(path, "store.json"), encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.path = path
+        self.name = self.info.get("collection", "")
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        scales = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales, mmap_mode="r") if os.path.exists(scales) else None
+        self.chunks = np.load(os.path.join(path, "chunks.npy"), mmap_mode="r")
+        self.cases = np.load(os.path.join(path, "cases.npy"), mmap_mode="r")
+        self.texts = _Strings.open(path, "texts")
+        self.ids = _Strings.open(path, "ids")
+
+    @property
+    def embedding_model(self) -> Optional[str]:
+        return self.info.get("embedding_model")
+
+    def count(self) -> int:
+        return int(self.embeddings.shape[0])
+
+    def _range(self, pmc_id: str) -> Tuple[int, int]:
+        key = pmc_id.encode("utf-8")[:32]
+        i = int(np.searchsorted(self.cases["pmc_id"], key))
+        if i < len(self.cases) and self.cases["pmc_id"][i] == key:
+            return int(self.cases["start"][i]), int(self.cases["stop"][i])
+        return 0, 0
+
+    def vectors(self, start: int, stop: int) -> np.ndarray:
+        """
+        Rows [start, stop) as dequantized float32 vectors.
+        """
+        block = self.embeddings[start:stop].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:stop, None]
+        return block
+
+    def _meta(self, row: int) -> Dict[str, Any]:
+        c = self.chunks[row]
+        return {
+            "pmc_id": c["pmc_id"].decode("utf-8"),
+            "chunk_index": int(c["chunk_index"]),
+            "content_hash": c["content_hash"].decode("utf-8"),
+        }
+
+    def query(self, embeddings: np.ndarray, top_k: int, pmc_id: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        queries = np.asarray(embeddings, dtype=np.float32)
+        start, stop = self._range(pmc_id) if pmc_id else (0, self.count())
+        k = min(top_k, stop - start)
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_sims = np.empty((len(queries), 0), dtype=np.float32)
+        for lo in range(start, stop, _SCAN_ROWS):
+            hi = min(lo + _SCAN_ROWS, stop)
+            sims = queries @ self.vectors(lo, hi).T
+            if sims.shape[1] > k:
+                part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                sims = np.take_along_axis(sims, part, axis=1)
+                rows = part + lo
+            else:
+                rows = np.broadcast_to(np.arange(lo, hi), sims.shape)
+            best_sims = np.concatenate([best_sims, sims], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_sims.shape[1] > k:
+                keep = np.argpartition(-best_sims, k - 1, axis=1)[:, :k]
+                best_sims = np.take_along_axis(best_sims, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        out: List[List[Dict[str, Any]]] = []
+        for sims, rows in zip(best_sims, best_rows):
+            order = np.argsort(-sims)
+            out.append([
+                _hit(self.ids[r], self.texts[r], self._meta(r), max(0.0, 2.0 - 2.0 * float(s)))
+                for r, s in zip(rows[order], sims[order])
+            ])
+        return out
+
+    def get_case(self, pmc_id: str) -> Page:
+        start, stop = self._range(pmc_id)
+        rows = range(start, stop)
+        return (
+            [self.ids[r] for r in rows],
+            [self.texts[r] for r in rows],
+            [self._meta(r) for r in rows],
+            self.vectors(start, stop),
+        )
+
+    def get_texts(self, refs: Sequence[Tuple[str, Optional[str]]]) -> Dict[str, str]:
+        # Ids are only indexed by case: scan each referenced case's (small) row range.
+        wanted: Dict[Optional[str], set] = {}
+        for doc_id, pmc_id in refs:
+            wanted.setdefault(pmc_id, set()).add(doc_id)
+        out: Dict[str, str] = {}
+        for pmc_id, ids in wanted.items():
+            if not pmc_id:
+                continue
+            for r in range(*self._range(pmc_id)):
+                if self.ids[r] in ids:
+                    out[self.ids[r]] = self.texts[r]
+        return out
+
+    def first_chunk_pmc_ids(self, limit: int) -> List[str]:
+        return [p.decode("utf-8") for p in self.cases["pmc_id"][:limit]]
+
+    def iter_pages(self, page_size: int = 5000) -> Iterator[Page]:
+        for lo in range(0, self.count(), page_size):
+            rows = range(lo, min(lo + page_size, self.count()))
+            yield (
+                [self.ids[r] for r in rows],
+                [self.texts[r] for r in rows],
+                [self._meta(r) for r in rows],
+                self.vectors(rows.start, rows.stop),
+            )
+
+    def upsert(self, ids, texts, metadatas, embeddings):
+        raise NotImplementedError(f"{self.backend} store is read-only")
+
+    def delete_ids(self, ids: Sequence[str], batch_size: int = 500):
+        raise NotImplementedError(f"{self.backend} store is read-only")
+
+    def reset(self):
+        raise NotImplementedError(f"{self.backend} store is read-only")
+
+    @classmethod
+    def export(
+        cls,
+        source: VectorStore,
+        path: str,
+        dtype: str = "float16",
+        page_size: int = 5000,
+        embedding_model: Optional[str] = None,
+    ) -> "NumpyStore":
+        """
+        Write `source` (normally a ChromaStore) as a NumpyStore at `path`. Pages are
+        spooled to disk first, then rows are reordered by (pmc_id, chunk_index), so
+        memory use stays around one page plus the per-row metadata.
+        """
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported dtype '{dtype}' (use float16 or int8)")
+        tmp = f"{path}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        total = source.count()
+        spool = None
+        ids: List[str] = []
+        meta = np.zeros(total, dtype=CHUNK_DTYPE)
+        text_offsets = [0]
+        row = 0
+        with open(os.path.join(tmp, "spool_texts.bin"), "wb") as text_spool:
+            for page_ids, page_texts, page_metas, page_emb in source.iter_pages(page_size):
+                if spool is None:
+                    spool = np.lib.format.open_memmap(
+                        os.path.join(tmp, "spool_embeddings.npy"), mode="w+",
+                        dtype=np.float32, shape=(total, page_emb.shape[1]),
+                    )
+                n = len(page_ids)
+                spool[row:row + n] = page_emb
+                ids.extend(page_ids)
+                for j, (text, m) in enumerate(zip(page_texts, page_metas)):
+                    m = m or {}
+                    meta[row + j] = (
+                        str(m.get("pmc_id", "")).encode("utf-8")[:32],
+                        int(m.get("chunk_index") or 0),
+                        str(m.get("content_hash", "")).encode("utf-8")[:16],
+                    )
+                    b = (text or "").encode("utf-8")
+                    text_spool.write(b)
+                    text_offsets.append(text_offsets[-1] + len(b))
+                row += n
+        meta = meta[:row]
+        order = np.lexsort((meta["chunk_index"], meta["pmc_id"]))
+        sorted_meta = meta[order]
+        np.save(os.path.join(tmp, "chunks.npy"), sorted_meta)
+
+        # Per-case row ranges over the sorted rows.
+        if row:
+            starts = np.flatnonzero(np.r_[True, sorted_meta["pmc_id"][1:] != sorted_meta["pmc_id"][:-1]])
+            stops = np.r_[starts[1:], row]
+        else:
+            starts = stops = np.zeros(0, dtype=np.int64)  # np.r_[True, ...] would yield one empty case
+        cases = np.zeros(len(starts), dtype=CASE_RANGE_DTYPE)
+        cases["pmc_id"] = sorted_meta["pmc_id"][starts]
+        cases["start"] = starts
+        cases["stop"] = stops
+        np.save(os.path.join(tmp, "cases.npy"), cases)
+
+        dim = spool.shape[1] if spool is not None else 0
+        out = np.lib.format.open_memmap(
+            os.path.join(tmp, "embeddings.npy"), mode="w+",
+            dtype=np.float16 if dtype == "float16" else np.int8, shape=(row, dim),
+        )
+        scales = np.zeros(row, dtype=np.float32) if dtype == "int8" else None
+        for lo in range(0, row, _SCAN_ROWS):
+            block = np.asarray(spool[np.sort(order[lo:lo + _SCAN_ROWS])], dtype=np.float32)
+            # np.sort above keeps the spool read sequential; restore the target order.
+            block = block[np.argsort(np.argsort(order[lo:lo + _SCAN_ROWS]))]
+            if scales is None:
+                out[lo:lo + len(block)] = block.astype(np.float16)
+            else:
+                s = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127.0
+                out[lo:lo + len(block)] = np.round(block / s[:, None]).astype(np.int8)
+                scales[lo:lo + len(block)] = s
+        out.flush()
+        del out, spool
+        if scales is not None:
+            np.save(os.path.join(tmp, "scales.npy"), scales)
+
+        spooled = np.memmap(os.path.join(tmp, "spool_texts.bin"), dtype=np.uint8, mode="r") if text_offsets[-1] else None
+        _Strings.write(
+            tmp, "texts",
+            (spooled[text_offsets[i]:text_offsets[i + 1]].tobytes().decode("utf-8") if spooled is not None else ""
+             for i in order),
+        )
+        del spooled
+        _Strings.write(tmp, "ids", (ids[i] for i in order))
+        os.remove(os.path.join(tmp, "spool_texts.bin"))
+        os.remove(os.path.join(tmp, "spool_embeddings.npy"))
+
+        with open(os.path.join(tmp, "store.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "format": 1,
+                "collection": source.name,
+                "embedding_model": embedding_model or source.embedding_model,
+                "dtype": dtype,
+                "count": row,
+                "dimension": dim,
+                "cases": len(cases),
+            }, f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls(path)
+
+
+def open_store(
+    backend: Optional[str] = None,
+    persist_dir: Optional[str] = None,
+    collection_name: str = COLLECTION_NAME,
+) -> VectorStore:
+    """
+    The configured vector store: "chroma" (default) or the read-only "numpy" export.
+    """
+    backend = backend or VECTOR_BACKEND
+    if backend == "chroma":
+        return ChromaStore(persist_dir or PERSIST_DIR, collection_name)
+    if backend == "numpy":
+        return NumpyStore(persist_dir or VECTOR_STORE_DIR)
+    raise ValueError(f"Unknown vector backend '{backend}' (use chroma or numpy)")
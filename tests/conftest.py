@@ -0,0 +1,37 @@
+import pytest
+
+from benchmarks.corpus import HashingEmbedder
+
+
+class CountingEmbedder(HashingEmbedder):
+    """
+    HashingEmbedder that counts the texts it is asked to encode.
+    """
+
+    def __init__(self, dimension: int = 64):
+        super().__init__(dimension)
+        self.encoded = 0
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        return super().encode(texts, **kwargs)
+
+
+@pytest.fixture
+def embedder():
+    return CountingEmbedder()
+
+
+@pytest.fixture
+def indexer(tmp_path, embedder):
+    from src.rag.indexer import ChromaIndexer
+
+    return ChromaIndexer(persist_dir=str(tmp_path / "chroma"), collection_name="test_cases", embedder=embedder)
+
+
+def case_text(pmc_id: str, sentences: int = 40, edit: str = "") -> str:
+    """
+    A synthetic case report long enough for several chunks.
+    """
+    body = " ".join(f"Case {pmc_id} finding {i}: the patient reported symptom {i * 7 % 13}." for i in range(sentences))
+    return body + edit
@@ -0,0 +1,41 @@
+import random
+from collections import Counter
+
+import pytest
+
+from src.rag.case_catalog import CaseCatalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    entries = [{"pmc_id": f"C{i}", "n_chunks": 2 + i % 5, "text_len": 1000 * (i % 5 + 1), "specialty": "cardiology"} for i in range(20)]
+    entries += [{"pmc_id": f"N{i}", "n_chunks": 3, "text_len": 800, "specialty": "neurology"} for i in range(2)]
+    entries += [{"pmc_id": "G0", "n_chunks": 1, "text_len": 200}]
+    path = str(tmp_path / "case_catalog.npy")
+    CaseCatalog.from_entries(entries).save(path)
+    return CaseCatalog.open(path)
+
+
+def test_filtered_sample(catalog):
+    rng = random.Random(0)
+    neuro = {catalog.sample(specialty="neurology", rng=rng) for _ in range(50)}
+    assert neuro == {"N0", "N1"}
+    long_cases = {catalog.sample(min_chunks=6, rng=rng) for _ in range(50)}
+    assert long_cases == {"C4", "C9", "C14", "C19"}
+    assert catalog.sample(specialty="cardiology", min_chars=5000, rng=rng) in {"C4", "C9", "C14", "C19"}
+    assert catalog.sample(specialty="dermatology", rng=rng) is None
+    assert catalog.sample(specialty="neurology", min_chunks=4, rng=rng) is None
+
+
+def test_stratified_sample_balances_specialties(catalog):
+    rng = random.Random(0)
+    picks = Counter(catalog.sample(stratified=True, rng=rng)[0] for _ in range(3000))
+    # Three specialties present: each drawn about a third of the time despite 20 cardiology cases.
+    assert set(picks) == {"C", "N", "G"}
+    assert all(800 < n < 1200 for n in picks.values())
+    assert catalog.sample(stratified=True, min_chunks=3, rng=rng)[0] in {"C", "N"}
+
+
+def test_unknown_specialty_is_a_clear_error(catalog):
+    with pytest.raises(ValueError, match="unknown specialty 'astrology'"):
+        catalog.sample(specialty="astrology")
@@ -0,0 +1,58 @@
+from src.config import CHUNK_OVERLAP, CONTEXT_DEDUP_THRESHOLD
+from src.rag.context_assembler import approx_tokens, assemble_contexts, drop_near_duplicates, merge_adjacent
+
+
+def report(words: int, seed: str = "w") -> str:
+    return " ".join(f"{seed}{i}" for i in range(words))
+
+
+def chunk(pmc_id, index, text, score=0.1):
+    return {"id": f"{pmc_id}-h-{index}", "pmc_id": pmc_id, "chunk_index": index, "text": text, "score": score}
+
+
+def test_adjacent_chunks_merge_with_overlap_kept_once():
+    text = report(200)
+    step = 300
+    first = text[:step + CHUNK_OVERLAP]
+    second = text[step:2 * step + CHUNK_OVERLAP]
+    assert first.endswith(second[:CHUNK_OVERLAP])
+
+    # Retrieved out of order, as ranking returns them.
+    passages = merge_adjacent([chunk("P1", 1, second, 0.2), chunk("P1", 0, first, 0.3)])
+    assert len(passages) == 1
+    merged = passages[0]
+    assert merged["text"] == text[:2 * step + CHUNK_OVERLAP]
+    assert merged["text"].count(second[:CHUNK_OVERLAP]) == 1
+    assert merged["ids"] == ["P1-h-0", "P1-h-1"]
+    assert merged["score"] == 0.2
+
+
+def test_non_adjacent_and_other_cases_stay_separate():
+    passages = merge_adjacent([
+        chunk("P1", 0, report(30, "a")),
+        chunk("P2", 1, report(30, "b")),
+        chunk("P1", 2, report(30, "c")),
+    ])
+    assert [(p["pmc_id"], p["chunk_index"]) for p in passages] == [("P1", 0), ("P2", 1), ("P1", 2)]
+
+
+def test_near_duplicate_is_dropped():
+    base = report(100, "x")
+    near = base + " one extra closing sentence"
+    other = report(100, "y")
+    passages = [chunk("P1", 0, base), chunk("P2", 0, near), chunk("P3", 0, other)]
+    kept = drop_near_duplicates(passages, CONTEXT_DEDUP_THRESHOLD)
+    assert [p["pmc_id"] for p in kept] == ["P1", "P3"]
+    assert len(drop_near_duplicates(passages, 0)) == 3
+
+
+def test_packing_respects_the_budget():
+    contexts = [chunk(f"P{i}", 0, report(120, f"s{i}") + ".") for i in range(6)]
+    budget = 600
+    passages = assemble_contexts(contexts, token_budget=budget)
+    assert sum(approx_tokens(p["text"]) for p in passages) <= budget
+    assert 0 < len(passages) < len(contexts)
+    # Rank order is kept and only the last passage may be trimmed.
+    assert [p["pmc_id"] for p in passages] == [f"P{i}" for i in range(len(passages))]
+    assert not any(p.get("truncated") for p in passages[:-1])
+    assert len(assemble_contexts(contexts, token_budget=0)) == len(contexts)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from src.rag.embeddings import QueryEncoder
+
+from tests.conftest import CountingEmbedder
+
+
+class RecordingEmbedder(CountingEmbedder):
+    """
+    CountingEmbedder that also keeps every batch of texts it is asked to encode.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        return super().encode(texts, **kwargs)
+
+
+def test_query_cache_encodes_original_text():
+    model = RecordingEmbedder()
+    encoder = QueryEncoder(model_name="hashing", model=model, cache_size=8)
+
+    first = encoder.encode_many(["Do you have Chest  PAIN?", "do you have chest pain?", "Any fever?"])
+    assert model.batches == [["Do you have Chest  PAIN?", "Any fever?"]]
+    np.testing.assert_array_equal(first[0], first[1])
+
+    again = encoder.encode("  DO YOU have chest pain? ")
+    assert len(model.batches) == 1
+    np.testing.assert_array_equal(again, first[0])
+    assert encoder.cache_info()["hits"] == 1 and encoder.cache_info()["misses"] == 3
+
+
+def test_query_cache_evicts_least_recently_used():
+    model = RecordingEmbedder()
+    encoder = QueryEncoder(model_name="hashing", model=model, cache_size=2)
+    encoder.encode_many(["a", "b"])
+    encoder.encode("a")
+    encoder.encode("c")
+    encoder.encode("a")
+    assert model.batches == [["a", "b"], ["c"]]
+    encoder.encode("b")
+    assert model.batches[-1] == ["b"]
+    assert encoder.cache_info()["size"] == 2
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from src.rag import evaluator
+from src.rag.evaluator import (
+    COMPACT_FIELDS,
+    CRITERIA,
+    RUBRIC_WEIGHTS,
+    validate_evaluation,
+    with_overall,
+)
+
+CONTEXTS = [{"id": "PMC1:0", "pmc_id": "PMC1", "chunk_index": 0, "text": "Chest pain for two days."}]
+
+VALID = {
+    "scores": {"relevance": 5, "diagnostic_utility": 4, "clarity_specificity": 4, "empathy_professionalism": 3, "hipaa_ethics": 5},
+    "rationale": "Open question on the main complaint.",
+    "phase": "chief_complaint",
+    "flags": [],
+}
+
+
+class CannedModel:
+    """
+    Stands in for evaluator._generate_json: returns the given outputs in order and
+    records each payload.
+    """
+
+    def __init__(self, *outputs):
+        self.outputs = list(outputs)
+        self.payloads = []
+
+    def __call__(self, payload, priority=None):
+        self.payloads.append(payload)
+        return self.outputs.pop(0)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    def install(*outputs):
+        canned = CannedModel(*outputs)
+        monkeypatch.setattr(evaluator, "_generate_json", canned)
+        monkeypatch.setattr(evaluator, "EVAL_REPAIR_RETRIES", 1)
+        return canned
+
+    return install
+
+
+def test_valid_output_passes():
+    valid, missing = validate_evaluation(VALID)
+    assert missing == []
+    assert valid == VALID
+
+
+def test_invalid_fields_are_reported():
+    data = dict(VALID, scores=dict(VALID["scores"], relevance=7, hipaa_ethics="high"), phase="triage")
+    del data["scores"]["clarity_specificity"]
+    valid, missing = validate_evaluation(data)
+    assert missing == ["scores.relevance", "scores.clarity_specificity", "scores.hipaa_ethics", "phase"]
+    assert valid["scores"] == {"diagnostic_utility": 4, "empathy_professionalism": 3}
+    assert validate_evaluation("not json")[1] == COMPACT_FIELDS
+
+
+def test_valid_output_needs_no_repair(model):
+    canned = model(VALID)
+    result = evaluator._evaluate_compact("What brings you in?", CONTEXTS)
+    assert len(canned.payloads) == 1
+    assert result["scores"] == VALID["scores"]
+    assert result["phase_guess"] == "chief_complaint"
+    assert result["risk_flags"] == []
+
+
+def test_bad_scores_get_one_repair_for_those_fields(model):
+    first = dict(VALID, scores={k: v for k, v in VALID["scores"].items() if k != "diagnostic_utility"})
+    first["scores"]["relevance"] = 9
+    canned = model(first, {"scores": {"relevance": 4, "diagnostic_utility": 2}})
+    result = evaluator._evaluate_compact("What brings you in?", CONTEXTS)
+
+    assert len(canned.payloads) == 2
+    repair = canned.payloads[1]
+    assert set(repair["format"]["properties"]) == {"scores"}
+    assert repair["format"]["properties"]["scores"]["required"] == ["relevance", "diagnostic_utility"]
+    assert repair["prompt"].endswith("Return only: scores.relevance, scores.diagnostic_utility.\n")
+    assert result["scores"] == dict(VALID["scores"], relevance=4, diagnostic_utility=2)
+    assert "eval_incomplete" not in result["risk_flags"]
+
+
+def test_failed_repair_falls_back_and_is_flagged(model):
+    canned = model(dict(VALID, scores=dict(VALID["scores"], empathy_professionalism=-1)), None)
+    result = evaluator._evaluate_compact("What brings you in?", CONTEXTS)
+    assert len(canned.payloads) == 2
+    assert result["scores"]["empathy_professionalism"] == 3
+    assert result["risk_flags"] == ["eval_incomplete"]
+
+
+def test_overall_uses_rubric_weights():
+    scores = {"relevance": 5, "diagnostic_utility": 1, "clarity_specificity": 4, "empathy_professionalism": 0, "hipaa_ethics": 2}
+    expected = sum(scores[c] * RUBRIC_WEIGHTS[c] for c in CRITERIA) / sum(RUBRIC_WEIGHTS.values())
+    result = with_overall({"scores": scores})
+    assert result["overall"] == round(expected, 2)
+    assert result["band"] == "Needs focus"
+    # Missing criteria are left out of the average rather than counted as zero.
+    partial = with_overall({"scores": {"relevance": 5, "hipaa_ethics": 2}})
+    assert partial["overall"] == round((5 * 0.30 + 2 * 0.10) / 0.40, 2)
+
+
+def test_parse_evaluation_reads_compact_json():
+    result = evaluator.parse_evaluation(json.dumps(VALID))
+    assert result["scores"] == VALID["scores"]
+    assert result["overall"] == with_overall({"scores": VALID["scores"]})["overall"]
+    assert evaluator.parse_evaluation("{not json")["risk_flags"] == ["parse_error"]
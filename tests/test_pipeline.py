@@ -0,0 +1,106 @@
+import itertools
+
+import pytest
+
+from src.rag.pipeline import Checkpoint, IngestionPipeline, Manifest
+
+from tests.conftest import case_text
+
+
+def rows(*pmc_ids, edits=None):
+    edits = edits or {}
+    return [{"pmc_id": p, "context": case_text(p, edit=edits.get(p, ""))} for p in pmc_ids]
+
+
+def test_duplicate_rows_are_indexed_once(indexer):
+    stats = indexer.add_documents(rows("PMC1", "PMC1", "PMC1", "PMC2"))
+    assert stats["duplicate_rows"] == 2
+    ids = indexer.collection.get()["ids"]
+    assert len(ids) == len(set(ids)) == stats["chunks"]
+    assert {i.split("-")[0] for i in ids} == {"PMC1", "PMC2"}
+
+
+def test_duplicate_rows_across_batches(indexer, tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    pipeline = IngestionPipeline(indexer, workers=0, batch_size=1, manifest=manifest)
+    stats = pipeline.run(rows("PMC1", "PMC2", "PMC1"))
+    assert stats["duplicate_rows"] == 1
+    assert set(manifest.cases) == {"PMC1", "PMC2"}
+    assert indexer.collection.count() == stats["chunks"]
+
+
+def test_counts_are_per_case(indexer, tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    run = lambda data: IngestionPipeline(indexer, workers=0, batch_size=1, manifest=manifest, incremental=True).run(data)
+
+    stats = run(rows("PMC1", "PMC1", "PMC1", "PMC2"))
+    assert (stats["new"], stats["changed"], stats["unchanged"]) == (2, 0, 0)
+
+    # A later row of an already committed case is not "changed"; an edit is, once.
+    stats = run(rows("PMC1", "PMC1", "PMC2") + rows("PMC2", edits={"PMC2": " Edited."}))
+    assert (stats["new"], stats["changed"], stats["unchanged"]) == (0, 1, 1)
+
+
+def pipeline_for(indexer, tmp_path, **kwargs):
+    kwargs.setdefault("batch_size", 1)
+    return IngestionPipeline(
+        indexer,
+        workers=0,
+        manifest=Manifest(str(tmp_path / "manifest.jsonl")),
+        checkpoint=Checkpoint(str(tmp_path / "checkpoint.json")),
+        **kwargs,
+    )
+
+
+def test_incremental_rerun_embeds_nothing(indexer, embedder, tmp_path):
+    data = rows("PMC1", "PMC2", "PMC3")
+    first = pipeline_for(indexer, tmp_path).run(data)
+    assert first["chunks"] > 0
+    embedder.encoded = 0
+
+    stats = pipeline_for(indexer, tmp_path, incremental=True).run(data)
+    assert embedder.encoded == 0
+    assert stats["chunks"] == 0
+    assert stats["unchanged"] == 3
+    assert stats["skipped_embeddings"] == first["chunks"]
+    assert indexer.collection.count() == first["chunks"]
+
+
+def test_edited_case_replaces_its_chunks(indexer, tmp_path):
+    pipeline_for(indexer, tmp_path).run(rows("PMC1", "PMC2"))
+    old_ids = set(indexer.collection.get(where={"pmc_id": "PMC1"})["ids"])
+    other_ids = set(indexer.collection.get(where={"pmc_id": "PMC2"})["ids"])
+
+    stats = pipeline_for(indexer, tmp_path, incremental=True).run(rows("PMC1", "PMC2", edits={"PMC1": " Edited."}))
+    assert stats["changed"] == 1 and stats["unchanged"] == 1
+    assert stats["deleted_chunks"] == len(old_ids)
+
+    new_ids = set(indexer.collection.get(where={"pmc_id": "PMC1"})["ids"])
+    assert new_ids and not new_ids & old_ids
+    assert not indexer.collection.get(ids=sorted(old_ids))["ids"]
+    assert set(indexer.collection.get(where={"pmc_id": "PMC2"})["ids"]) == other_ids
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    assert len(manifest.cases["PMC1"]) == 1
+
+
+def test_resume_continues_from_checkpoint(indexer, embedder, tmp_path):
+    data = rows(*(f"PMC{i}" for i in range(40)))
+
+    def crashing():
+        # Rows are chunked in blocks of ROWS_PER_TASK, so fail past the first block.
+        yield from data[:36]
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        pipeline_for(indexer, tmp_path).run(crashing())
+    next_row = Checkpoint(str(tmp_path / "checkpoint.json")).load()["next_row"]
+    assert 0 < next_row <= 36
+    committed = indexer.collection.count()
+    embedder.encoded = 0
+
+    stats = pipeline_for(indexer, tmp_path).run(itertools.islice(data, next_row, None), start_row=next_row)
+    assert stats["rows"] == len(data) - next_row
+    assert embedder.encoded == stats["chunks"]
+    assert indexer.collection.count() == committed + stats["chunks"]
+    assert Checkpoint(str(tmp_path / "checkpoint.json")).load()["next_row"] == len(data)
+    assert set(Manifest(str(tmp_path / "manifest.jsonl")).cases) == {f"PMC{i}" for i in range(40)}
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from src.rag import scheduler as scheduler_module
+from src.rag.scheduler import (
+    PRIORITY_BATCH,
+    PRIORITY_EVALUATION,
+    PRIORITY_INTERACTIVE,
+    OllamaScheduler,
+    SchedulerBusy,
+)
+
+
+class FakeTransport:
+    """
+    Stands in for ollama_client.generate: records (endpoint, prompt) per call, can
+    hold calls until released, and can fail chosen endpoints with a 500.
+    """
+
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+
+    def __call__(self, payload, endpoint, timeout):
+        with self._lock:
+            self.calls.append((endpoint, payload["prompt"]))
+        self.gate.wait(5)
+        if endpoint in self.failing:
+            response = requests.Response()
+            response.status_code = 500
+            raise requests.HTTPError("500 Server Error", response=response)
+        return {"response": f"answer to {payload['prompt']}"}
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    fake = FakeTransport()
+    monkeypatch.setattr(scheduler_module.ollama_client, "generate", fake)
+    return fake
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def submit(sched, prompt, priority, results):
+    def run():
+        try:
+            results[prompt] = sched.generate({"model": "m", "prompt": prompt}, priority=priority)
+        except Exception as exc:
+            results[prompt] = exc
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_queued_requests_run_in_priority_order(transport):
+    sched = OllamaScheduler(endpoints=["http://a"], max_concurrency=1)
+    held = sched._acquire(PRIORITY_INTERACTIVE)
+    results = {}
+    threads = []
+    for prompt, priority in [("batch", PRIORITY_BATCH), ("eval", PRIORITY_EVALUATION), ("reply", PRIORITY_INTERACTIVE)]:
+        threads.append(submit(sched, prompt, priority, results))
+        wait_for(lambda n=len(threads): sched._waiting == n)
+    sched._release(held)
+    for thread in threads:
+        thread.join(5)
+    assert [prompt for _, prompt in transport.calls] == ["reply", "eval", "batch"]
+    assert sched.metrics()["in_flight"] == 0
+
+
+def test_identical_requests_share_one_call(transport):
+    sched = OllamaScheduler(endpoints=["http://a"], max_concurrency=1)
+    transport.gate.clear()
+    results = {}
+    threads = [submit(sched, "same", PRIORITY_EVALUATION, results) for _ in range(3)]
+    wait_for(lambda: sched.counters["dedup_hits"] == 2)
+    transport.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(transport.calls) == 1
+    assert results["same"] == {"response": "answer to same"}
+
+
+def test_full_queue_rejects(transport):
+    sched = OllamaScheduler(endpoints=["http://a"], max_concurrency=1, max_queue=1)
+    held = sched._acquire(PRIORITY_INTERACTIVE)
+    results = {}
+    waiting = submit(sched, "queued", PRIORITY_INTERACTIVE, results)
+    wait_for(lambda: sched._waiting == 1)
+    with pytest.raises(SchedulerBusy):
+        sched.generate({"model": "m", "prompt": "rejected"})
+    assert sched.counters["rejected"] == 1
+    sched._release(held)
+    waiting.join(5)
+    assert results["queued"] == {"response": "answer to queued"}
+
+
+def test_queue_timeout(transport):
+    sched = OllamaScheduler(endpoints=["http://a"], max_concurrency=1, queue_timeout=0.2)
+    held = sched._acquire(PRIORITY_INTERACTIVE)
+    started = time.perf_counter()
+    with pytest.raises(SchedulerBusy):
+        sched.generate({"model": "m", "prompt": "late"})
+    assert time.perf_counter() - started >= 0.2
+    assert sched.counters["timeouts"] == 1
+    assert sched._waiting == 0
+    sched._release(held)
+
+
+def test_server_error_is_retried_on_the_other_endpoint(transport):
+    transport.failing.add("http://a")
+    sched = OllamaScheduler(endpoints=["http://a", "http://b"], max_concurrency=1, retries=1)
+    assert sched.generate({"model": "m", "prompt": "q"}) == {"response": "answer to q"}
+    assert [endpoint for endpoint, _ in transport.calls] == ["http://a", "http://b"]
+    metrics = sched.metrics()
+    assert metrics["retries"] == 1
+    assert {e["url"]: e["healthy"] for e in metrics["endpoints"]} == {"http://a": False, "http://b": True}
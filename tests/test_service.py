@@ -0,0 +1,85 @@
+import asyncio
+
+import numpy as np
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from src.app import service
+from src.rag.case_context import CaseContext
+from src.rag.response_cache import ResponseCache
+
+
+class FakeRetriever:
+    """
+    One indexed case; records the filters `sample_pmc_id` was called with.
+    """
+
+    def __init__(self):
+        self.sampled = []
+
+    def sample_pmc_id(self, **filters):
+        self.sampled.append(filters)
+        return "PMC1"
+
+    def load_case(self, pmc_id):
+        embeddings = np.eye(2, 8, dtype=np.float32)
+        return CaseContext(pmc_id, ["c0", "c1"], ["First chunk.", "Second chunk."], [{"chunk_index": 0}, {"chunk_index": 1}], embeddings, None)
+
+
+@pytest.fixture
+def retriever(monkeypatch, tmp_path):
+    fake = FakeRetriever()
+    monkeypatch.setattr(service, "WARMUP_ON_START", False)
+    monkeypatch.setattr(service.runtime, "get_retriever", lambda: fake)
+    monkeypatch.setattr(service.runtime, "get_response_cache", lambda: ResponseCache(path=str(tmp_path / "cache.sqlite")))
+    return fake
+
+
+def post(path, body):
+    async def run():
+        async with TestClient(TestServer(service.create_app(workers=2))) as client:
+            resp = await client.post(path, json=body)
+            return resp.status, await resp.json()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "body, field",
+    [
+        ({"persona": "grumpy"}, "persona"),
+        ({"persona": ["Alex"]}, "persona"),
+        ({"specialty": "astrology"}, "specialty"),
+        ({"min_chunks": "3"}, "min_chunks"),
+        ({"min_chunks": -1}, "min_chunks"),
+        ({"min_chunks": True}, "min_chunks"),
+        ({"pmc_id": 42}, "pmc_id"),
+    ],
+)
+def test_create_encounter_rejects_invalid_fields(retriever, body, field):
+    status, data = post("/encounters", body)
+    assert status == 400
+    assert f"'{field}'" in data["error"]
+    assert retriever.sampled == []
+
+
+def test_create_encounter_passes_valid_filters(retriever):
+    persona = {"name": "Sam", "age": 50}
+    status, data = post("/encounters", {"specialty": "cardiology", "min_chunks": 2, "persona": persona})
+    assert status == 201
+    assert data["pmc_id"] == "PMC1"
+    assert data["persona"] == persona
+    assert retriever.sampled == [{"specialty": "cardiology", "min_chunks": 2, "stratified": False}]
+
+
+@pytest.mark.parametrize("top_k", ["4", 0, -1, 999, True])
+def test_top_k_is_validated(retriever, top_k):
+    status, data = post("/retrieve", {"query": "chest pain", "top_k": top_k})
+    assert status == 400
+    assert "'top_k'" in data["error"]
+
+
+def test_evaluate_rejects_malformed_contexts(retriever):
+    status, data = post("/evaluate", {"question": "Any fever?", "contexts": [{"id": "c0"}]})
+    assert status == 400
+    assert "'contexts'" in data["error"]
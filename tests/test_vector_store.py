@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from src.rag.vector_store import NumpyStore, VectorStore
+
+from tests.conftest import case_text
+
+PMC_IDS = ["PMC3", "PMC1", "PMC10", "PMC2"]
+
+
+@pytest.fixture
+def exported(indexer, tmp_path):
+    indexer.add_documents([{"pmc_id": p, "context": case_text(p, sentences=20 + 10 * i)} for i, p in enumerate(PMC_IDS)])
+    return indexer.store, NumpyStore.export(indexer.store, str(tmp_path / "numpy"), dtype="float16", page_size=7)
+
+
+def test_vector_store_is_abstract():
+    with pytest.raises(TypeError):
+        VectorStore()
+
+
+def test_export_keeps_every_case_as_one_ordered_range(exported):
+    chroma, store = exported
+    assert store.count() == chroma.count()
+    assert store.embedding_model == chroma.embedding_model
+    assert [c["pmc_id"].decode() for c in store.cases] == sorted(PMC_IDS)
+    assert int(store.cases["start"][0]) == 0 and int(store.cases["stop"][-1]) == store.count()
+    assert list(store.cases["start"][1:]) == list(store.cases["stop"][:-1])
+    for pmc_id in PMC_IDS:
+        ids, texts, metas, vectors = chroma.get_case(pmc_id)
+        expected = sorted(zip(metas, ids, texts, vectors), key=lambda row: row[0]["chunk_index"])
+        got_ids, got_texts, got_metas, got_vectors = store.get_case(pmc_id)
+        assert got_ids == [row[1] for row in expected]
+        assert got_texts == [row[2] for row in expected]
+        assert [m["chunk_index"] for m in got_metas] == list(range(len(expected)))
+        np.testing.assert_allclose(got_vectors, np.stack([row[3] for row in expected]), atol=1e-3)
+
+
+def test_numpy_top_k_matches_chroma(exported):
+    chroma, store = exported
+    queries = store.vectors(0, store.count())
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    for pmc_id in (None, "PMC10"):
+        expected = chroma.query(queries, top_k=3, pmc_id=pmc_id)
+        got = store.query(queries, top_k=3, pmc_id=pmc_id)
+        assert [[h["id"] for h in hits] for hits in got] == [[h["id"] for h in hits] for hits in expected]
+        for a, b in zip(got, expected):
+            assert [h["score"] for h in a] == pytest.approx([h["score"] for h in b], abs=1e-2)
+
+
+def test_numpy_store_is_read_only(exported):
+    _, store = exported
+    with pytest.raises(NotImplementedError, match="numpy store is read-only"):
+        store.upsert(["x"], ["text"], [{}], [[0.0]])
+    with pytest.raises(NotImplementedError, match="read-only"):
+        store.delete_ids(["x"])
+    with pytest.raises(NotImplementedError, match="read-only"):
+        store.reset()